@@ -0,0 +1,137 @@
+#  Copyright 2018 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+# Measures the cost of a single scheduling decision as the cluster grows,
+# for the PlacementIndex and for the per-call set rebuilding it replaced.
+# This does not need a running cluster; from the functions directory, run
+#
+#   python -m benchmarks.placement
+
+import random
+import time
+
+from scheduler.placement import PlacementIndex
+
+CLUSTER_SIZES = (10, 100, 1000)
+THREADS_PER_NODE = 3
+
+NUM_KEYS = 10000
+KEYS_PER_NODE = 500
+REFS_PER_CALL = 2
+
+# the share of threads that asked the scheduler to back off
+BACKOFF_SHARE = .05
+
+NUM_DECISIONS = 10000
+
+sys_random = random.SystemRandom()
+
+
+class Ref():
+    def __init__(self, key):
+        self.key = key
+
+
+def run():
+    print('%8s %16s %16s' % ('threads', 'index (us)', 'rebuild (us)'))
+
+    for num_threads in CLUSTER_SIZES:
+        placement, key_ip_map = _build_cluster(num_threads)
+        calls = [[Ref(str(sys_random.randrange(NUM_KEYS))) for _ in
+                  range(REFS_PER_CALL)] for _ in range(NUM_DECISIONS)]
+
+        start = time.time()
+        for refs in calls:
+            placement.pick(key_ip_map, refs)
+        index_time = (time.time() - start) / NUM_DECISIONS
+
+        executors = set(placement.executors)
+        backoff = dict(placement.backoff)
+        running_counts = {}
+
+        start = time.time()
+        for refs in calls:
+            _rebuild_pick(executors, key_ip_map, refs, running_counts,
+                          backoff)
+        rebuild_time = (time.time() - start) / NUM_DECISIONS
+
+        print('%8d %16.2f %16.2f' % (num_threads, index_time * 1e6,
+                                     rebuild_time * 1e6))
+
+
+def _build_cluster(num_threads):
+    placement = PlacementIndex()
+    key_ip_map = {}
+
+    num_nodes = (num_threads + THREADS_PER_NODE - 1) // THREADS_PER_NODE
+    nodes = ['10.0.%d.%d' % (i // 256, i % 256) for i in range(num_nodes)]
+
+    for i in range(num_threads):
+        thread = (nodes[i // THREADS_PER_NODE], i % THREADS_PER_NODE)
+        placement.add_executor(thread)
+
+        if sys_random.random() < BACKOFF_SHARE:
+            placement.set_backoff(thread, time.time())
+
+    for node in nodes:
+        for key in sys_random.sample(range(NUM_KEYS), KEYS_PER_NODE):
+            if str(key) not in key_ip_map:
+                key_ip_map[str(key)] = []
+            key_ip_map[str(key)].append(node)
+
+    return placement, key_ip_map
+
+
+# How the scheduler used to pick a thread: it copied the valid executors,
+# dropped backed-off and overloaded ones, and scanned every remaining thread
+# for the node with the most cached keys.
+def _rebuild_pick(valid_executors, key_ip_map, refs, running_counts,
+                  backoff):
+    executors = set(valid_executors)
+    for executor in backoff:
+        if len(executors) > 1:
+            executors.discard(executor)
+
+    keys = list(running_counts.keys())
+    sys_random.shuffle(keys)
+    for key in keys:
+        if len(running_counts[key]) > 1000 and len(executors) > 1:
+            executors.discard(key)
+
+    executor_ips = [e[0] for e in executors]
+
+    arg_map = {}
+    for ref in refs:
+        for ip in key_ip_map.get(ref.key, ()):
+            if ip in executor_ips:
+                arg_map[ip] = arg_map.get(ip, 0) + 1
+
+    max_ip = None
+    if len(arg_map) > 0:
+        max_ip = max(arg_map, key=arg_map.get)
+        candidates = list(filter(lambda e: e[0] == max_ip, executors))
+        max_ip = sys_random.choice(candidates)
+
+    if not max_ip or sys_random.random() < 0.20:
+        max_ip = sys_random.choice(list(executors))
+
+    if max_ip not in running_counts:
+        running_counts[max_ip] = set()
+    running_counts[max_ip].add(time.time())
+
+    return max_ip
+
+
+if __name__ == '__main__':
+    run()
@@ -17,12 +17,17 @@ def run(flconn, kvs, num_requests, sckt):
         from skimage import filters
         return filters.gaussian(inp).reshape(1, 3, 224, 224)
 
-    def sqnet(fluent, inp):
-        import torch
-        import torchvision
-
-        model = torchvision.models.squeezenet1_1()
-        return model(torch.tensor(inp.astype(np.float32))).detach().numpy()
+    # the model is built once by each executor that pins this function,
+    # rather than on every call
+    class SqueezeNet():
+        def __init__(self):
+            import torchvision
+            self.model = torchvision.models.squeezenet1_1()
+
+        def __call__(self, fluent, inp):
+            import torch
+            inp = torch.tensor(inp.astype(np.float32))
+            return self.model(inp).detach().numpy()
 
     def average(fluent, inp1, inp2, inp3):
         import numpy as np
@@ -30,9 +35,9 @@ def run(flconn, kvs, num_requests, sckt):
         return np.mean(inp, axis=0)
 
     cloud_prep = flconn.register(preprocess, 'preprocess')
-    cloud_sqnet1 = flconn.register(sqnet, 'sqnet1')
-    cloud_sqnet2 = flconn.register(sqnet, 'sqnet2')
-    cloud_sqnet3 = flconn.register(sqnet, 'sqnet3')
+    cloud_sqnet1 = flconn.register(SqueezeNet, 'sqnet1')
+    cloud_sqnet2 = flconn.register(SqueezeNet, 'sqnet2')
+    cloud_sqnet3 = flconn.register(SqueezeNet, 'sqnet3')
     cloud_average = flconn.register(average, 'average')
 
     if cloud_prep and cloud_sqnet1 and cloud_sqnet2 and cloud_sqnet3 and \
@@ -0,0 +1,170 @@
+//  Copyright 2018 U.C. Berkeley RISE Lab
+//
+//  Licensed under the Apache License, Version 2.0 (the "License");
+//  you may not use this file except in compliance with the License.
+//  You may obtain a copy of the License at
+//
+//      http://www.apache.org/licenses/LICENSE-2.0
+//
+//  Unless required by applicable law or agreed to in writing, software
+//  distributed under the License is distributed on an "AS IS" BASIS,
+//  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+//  See the License for the specific language governing permissions and
+//  limitations under the License.
+
+#ifndef FUNCTIONS_CACHE_INCLUDE_CACHE_SUMMARY_HPP_
+#define FUNCTIONS_CACHE_INCLUDE_CACHE_SUMMARY_HPP_
+
+#include <algorithm>
+#include <cmath>
+
+#include "common.hpp"
+#include "functions.pb.h"
+
+// the false positive rate the Bloom filter of a cache's keys is sized for
+const double kCacheSummaryFalsePositiveRate = 0.01;
+
+// the smallest filter we publish, in bytes
+const unsigned kCacheSummaryMinBytes = 8;
+
+// values of at least this many bytes are listed in the summary along with
+// their sizes, which the scheduler weighs locality by
+const unsigned kCacheSummaryLargeObjectSize = 64 * 1024;
+
+// 64-bit FNV-1a; the scheduler (functions/scheduler/summary.py) hashes keys
+// the same way, so the two have to be changed together
+inline uint64_t cache_summary_hash(const Key& key) {
+  uint64_t hash = 14695981039346656037ULL;
+
+  for (const unsigned char c : key) {
+    hash ^= c;
+    hash *= 1099511628211ULL;
+  }
+
+  return hash;
+}
+
+// the filter is sized for this many times the keys it holds when it is built,
+// so that keys can be added as they are cached for a while before it has to be
+// rebuilt; it is never sized for fewer than kCacheSummaryMinKeys keys
+const unsigned kCacheSummaryGrowth = 2;
+const unsigned kCacheSummaryMinKeys = 64;
+
+// evicted keys stay in the filter until it is rebuilt, which we do once there
+// are more of them than this share of the cached keys
+const double kCacheSummaryMaxStaleShare = 0.25;
+
+// A Bloom filter of the keys a cache holds, which is kept up to date as keys
+// are cached and evicted, rather than being rebuilt from every key each time
+// it is published. The i-th bit of a key is (h1 + i * h2) mod the number of
+// bits, where h1 and h2 are the low and the high 32 bits of its hash. Bloom
+// filters do not support removal, so evicted keys are only counted, and the
+// filter is rebuilt once too many of them (or too many keys for its size)
+// have piled up.
+class CacheSummaryFilter {
+ public:
+  CacheSummaryFilter() { reset(0); }
+
+  // Adds a cached key; size is the size of its value, if it is known.
+  void add(const Key& key, unsigned size = 0) {
+    set_bits(key);
+
+    if (size >= kCacheSummaryLargeObjectSize) {
+      large_objects_[key] = size;
+    } else {
+      large_objects_.erase(key);
+    }
+  }
+
+  void remove(const Key& key) {
+    large_objects_.erase(key);
+    num_removed_++;
+  }
+
+  // Whether the filter has to be rebuilt before it is published, now that the
+  // cache holds num_keys keys.
+  bool stale(size_t num_keys) const {
+    return num_keys > capacity_ ||
+           num_removed_ > kCacheSummaryMaxStaleShare * num_keys;
+  }
+
+  // Rebuilds the filter from the keys of key_map (a map keyed by Key).
+  template <typename M>
+  void rebuild(const M& key_map) {
+    reset(key_map.size());
+
+    for (const auto& pair : key_map) {
+      set_bits(pair.first);
+    }
+  }
+
+  CacheSummary summary(size_t num_keys) const {
+    CacheSummary summary;
+    summary.set_num_hashes(num_hashes_);
+    summary.set_bits(bits_);
+    summary.set_num_keys(num_keys);
+
+    for (const auto& pair : large_objects_) {
+      Reference* ref = summary.add_large_objects();
+      ref->set_key(pair.first);
+      ref->set_size(pair.second);
+    }
+
+    return summary;
+  }
+
+ private:
+  void reset(size_t num_keys) {
+    capacity_ = std::max(num_keys * kCacheSummaryGrowth,
+                         (size_t)kCacheSummaryMinKeys);
+    double ln2 = std::log(2.0);
+
+    uint64_t num_bytes =
+        std::ceil(-(double)capacity_ *
+                  std::log(kCacheSummaryFalsePositiveRate) / (ln2 * ln2) / 8);
+    num_bytes = std::max(num_bytes, (uint64_t)kCacheSummaryMinBytes);
+    num_bits_ = num_bytes * 8;
+
+    num_hashes_ = std::max(
+        1.0, std::round((double)num_bits_ / capacity_ * ln2));
+
+    bits_ = string(num_bytes, '\0');
+    num_removed_ = 0;
+  }
+
+  void set_bits(const Key& key) {
+    uint64_t hash = cache_summary_hash(key);
+    uint64_t h1 = hash & 0xffffffff;
+    uint64_t h2 = hash >> 32;
+
+    for (unsigned i = 0; i < num_hashes_; i++) {
+      uint64_t index = (h1 + i * h2) % num_bits_;
+      bits_[index / 8] |= (1 << (index % 8));
+    }
+  }
+
+  string bits_;
+  uint64_t num_bits_;
+  unsigned num_hashes_;
+
+  // the number of keys the filter was sized for, and the number of keys that
+  // were evicted since it was built
+  size_t capacity_;
+  size_t num_removed_;
+
+  // the sizes of the large values among the cached keys
+  map<Key, unsigned> large_objects_;
+};
+
+// The LWW lattice to publish summary in under the cache's cache_summary
+// metadata key.
+inline LWWPairLattice<string> get_cache_summary_lattice(
+    const CacheSummary& summary, unsigned thread_id) {
+  string serialized;
+  summary.SerializeToString(&serialized);
+
+  return LWWPairLattice<string>(
+      TimestampValuePair<string>(generate_timestamp(thread_id), serialized));
+}
+
+#endif  // FUNCTIONS_CACHE_INCLUDE_CACHE_SUMMARY_HPP_
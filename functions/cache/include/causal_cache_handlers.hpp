@@ -35,7 +35,8 @@ void put_request_handler(const string& serialized, StoreType& unmerged_store,
                          StoreType& causal_cut_store,
                          VersionStoreType& version_store,
                          map<string, Address>& request_id_to_address_map,
-                         KvsAsyncClientInterface* client);
+                         KvsAsyncClientInterface* client,
+                         CacheSummaryFilter* summary_filter = nullptr);
 
 void versioned_key_request_handler(const string& serialized,
                                    VersionStoreType& version_store,
@@ -63,7 +64,8 @@ void kvs_response_handler(
     SocketCache& pushers, KvsAsyncClientInterface* client, logger log,
     const CausalCacheThread& cct,
     map<string, set<Address>>& get_client_id_to_address_map,
-    map<string, Address>& request_id_to_address_map);
+    map<string, Address>& request_id_to_address_map,
+    CacheSummaryFilter* summary_filter = nullptr);
 
 void periodic_migration_handler(
     const StoreType& unmerged_store, InPreparationType& in_preparation,
@@ -15,6 +15,7 @@
 #ifndef FUNCTIONS_CACHE_INCLUDE_CAUSAL_CACHE_UTILS_HPP_
 #define FUNCTIONS_CACHE_INCLUDE_CAUSAL_CACHE_UTILS_HPP_
 
+#include "cache_summary.hpp"
 #include "functions.pb.h"
 #include "kvs_async_client.hpp"
 
@@ -199,7 +200,14 @@ void process_response(
         cover_map,
     SocketCache& pushers, KvsAsyncClientInterface* client, logger log,
     const CausalCacheThread& cct,
-    map<string, set<Address>>& client_id_to_address_map);
+    map<string, set<Address>>& client_id_to_address_map,
+    CacheSummaryFilter* summary_filter = nullptr);
+
+// add key, whose value in the unmerged store is now lattice, to the summary of
+// the cache's keys, if there is one
+void summarize_key(
+    CacheSummaryFilter* summary_filter, const Key& key,
+    const std::shared_ptr<CrossCausalLattice<SetLattice<string>>>& lattice);
 
 // construct the causal frontier from previous causal caches
 // this is later used to decide what keys should be read remotely
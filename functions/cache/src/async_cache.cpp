@@ -12,6 +12,7 @@
 //  See the License for the specific language governing permissions and
 //  limitations under the License.
 
+#include "cache_summary.hpp"
 #include "kvs_async_client.hpp"
 #include "yaml-cpp/yaml.h"
 
@@ -66,13 +67,16 @@ void update_cache(const Key& key, LatticeType type, const string& payload,
                   map<Key, LWWPairLattice<string>>& local_lww_cache,
                   map<Key, SetLattice<string>>& local_set_cache,
                   map<Key, OrderedSetLattice<string>>& local_ordered_set_cache,
-                  logger log) {
+                  CacheSummaryFilter& summary_filter, logger log) {
   if (type == LatticeType::LWW) {
     local_lww_cache[key].merge(deserialize_lww(payload));
+    summary_filter.add(key, local_lww_cache[key].reveal().value.size());
   } else if (type == LatticeType::SET) {
     local_set_cache[key].merge(deserialize_set(payload));
+    summary_filter.add(key);
   } else if (type == LatticeType::ORDERED_SET) {
     local_ordered_set_cache[key].merge(deserialize_ordered_set(payload));
+    summary_filter.add(key);
   } else {
     log->error("Invalid lattice type.");
   }
@@ -138,6 +142,9 @@ void run(KvsAsyncClientInterface* client, Address ip, unsigned thread_id) {
 
   map<Key, LatticeType> key_type_map;
 
+  // the summary of key_type_map's keys that we publish for the schedulers
+  CacheSummaryFilter summary_filter;
+
   // mapping from request id to respond address of PUT request
   map<string, Address> request_address_map;
 
@@ -247,7 +254,7 @@ void run(KvsAsyncClientInterface* client, Address ip, unsigned thread_id) {
           key_type_map[key] = tuple.lattice_type();
           update_cache(key, tuple.lattice_type(), tuple.payload(),
                        local_lww_cache, local_set_cache,
-                       local_ordered_set_cache, log);
+                       local_ordered_set_cache, summary_filter, log);
 
           if (iterator_cache.find(key) != iterator_cache.end()) {
             access_order.erase(iterator_cache[key]);
@@ -306,7 +313,7 @@ void run(KvsAsyncClientInterface* client, Address ip, unsigned thread_id) {
 
         update_cache(key, tuple.lattice_type(), tuple.payload(),
                      local_lww_cache, local_set_cache, local_ordered_set_cache,
-                     log);
+                     summary_filter, log);
       }
     }
 
@@ -341,7 +348,8 @@ void run(KvsAsyncClientInterface* client, Address ip, unsigned thread_id) {
             key_type_map[key] = response.tuples(0).lattice_type();
             update_cache(key, response.tuples(0).lattice_type(),
                          response.tuples(0).payload(), local_lww_cache,
-                         local_set_cache, local_ordered_set_cache, log);
+                         local_set_cache, local_ordered_set_cache,
+                         summary_filter, log);
           } else {
             log->info("Key {} does not exist!", key);
           }
@@ -402,6 +410,17 @@ void run(KvsAsyncClientInterface* client, Address ip, unsigned thread_id) {
           generate_timestamp(thread_id), serialized));
       Key key = get_user_metadata_key(ip, UserMetadataType::cache_ip);
       client->put_async(key, serialize(val), LatticeType::LWW);
+
+      // the scheduler only reads this compact summary of the same keys
+      if (summary_filter.stale(key_type_map.size())) {
+        summary_filter.rebuild(key_type_map);
+      }
+
+      client->put_async(
+          get_user_metadata_key(ip, UserMetadataType::cache_summary),
+          serialize(get_cache_summary_lattice(
+              summary_filter.summary(key_type_map.size()), thread_id)),
+          LatticeType::LWW);
       report_start = std::chrono::system_clock::now();
     }
 
@@ -414,6 +433,7 @@ void run(KvsAsyncClientInterface* client, Address ip, unsigned thread_id) {
 
         LatticeType type = key_type_map[key];
         key_type_map.erase(key);
+        summary_filter.remove(key);
 
         if (type == LWW) {
           local_lww_cache.erase(key);
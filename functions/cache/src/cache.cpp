@@ -12,6 +12,7 @@
 //  See the License for the specific language governing permissions and
 //  limitations under the License.
 
+#include "cache_summary.hpp"
 #include "kvs_client.hpp"
 #include "yaml-cpp/yaml.h"
 
@@ -35,6 +36,9 @@ void run(KvsClient& client, Address ip, unsigned thread_id) {
 
   map<Key, LatticeType> key_type_map;
 
+  // the summary of key_type_map's keys that we publish for the schedulers
+  CacheSummaryFilter summary_filter;
+
   CacheThread ct = CacheThread(ip, thread_id);
 
   // TODO: can we find a way to make the thread classes uniform across
@@ -88,6 +92,7 @@ void run(KvsClient& client, Address ip, unsigned thread_id) {
               LWWPairLattice<string> resp = client.get(key);
               local_lww_cache[key] = resp;
               key_type_map[key] = LatticeType::LWW;
+              summary_filter.add(key, resp.reveal().value.size());
             }
 
             resp->set_payload(serialize(local_lww_cache[key]));
@@ -99,6 +104,7 @@ void run(KvsClient& client, Address ip, unsigned thread_id) {
               SetLattice<string> resp = client.get_set(key);
               local_set_cache[key] = resp;
               key_type_map[key] = LatticeType::SET;
+              summary_filter.add(key);
             }
 
             resp->set_payload(serialize(local_set_cache[key]));
@@ -111,6 +117,7 @@ void run(KvsClient& client, Address ip, unsigned thread_id) {
               OrderedSetLattice<string> resp = client.get_ordered_set(key);
               local_ordered_set_cache[key] = resp;
               key_type_map[key] = LatticeType::ORDERED_SET;
+              summary_filter.add(key);
             }
             resp->set_payload(serialize(local_ordered_set_cache[key]));
             resp->set_lattice_type(LatticeType::ORDERED_SET);
@@ -161,6 +168,11 @@ void run(KvsClient& client, Address ip, unsigned thread_id) {
 
             local_lww_cache[key] = new_val;
             resp->set_error(0);
+
+            // keys are only summarized once they are read through the cache
+            if (key_type_map.find(key) != key_type_map.end()) {
+              summary_filter.add(key, new_val.reveal().value.size());
+            }
             break;
           }
           case LatticeType::SET: {
@@ -254,6 +266,7 @@ void run(KvsClient& client, Address ip, unsigned thread_id) {
             }
 
             local_lww_cache[key] = new_val;
+            summary_filter.add(key, new_val.reveal().value.size());
             break;
           }
           case LatticeType::SET: {
@@ -263,6 +276,7 @@ void run(KvsClient& client, Address ip, unsigned thread_id) {
             }
 
             local_set_cache[key] = new_val;
+            summary_filter.add(key);
           }
           case LatticeType::ORDERED_SET: {
             OrderedSetLattice<string> new_val =
@@ -272,6 +286,7 @@ void run(KvsClient& client, Address ip, unsigned thread_id) {
               new_val.merge(local_ordered_set_cache[key]);
             }
             local_ordered_set_cache[key] = new_val;
+            summary_filter.add(key);
           }
           default:  // this should never happen!
             break;
@@ -302,6 +317,15 @@ void run(KvsClient& client, Address ip, unsigned thread_id) {
           generate_timestamp(thread_id), serialized));
       Key key = get_user_metadata_key(ip, UserMetadataType::cache_ip);
       client.put(key, val);
+
+      // the scheduler only reads this compact summary of the same keys
+      if (summary_filter.stale(key_type_map.size())) {
+        summary_filter.rebuild(key_type_map);
+      }
+
+      client.put(get_user_metadata_key(ip, UserMetadataType::cache_summary),
+                 get_cache_summary_lattice(
+                     summary_filter.summary(key_type_map.size()), thread_id));
       report_start = std::chrono::system_clock::now();
     }
 
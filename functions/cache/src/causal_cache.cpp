@@ -14,6 +14,7 @@
 
 #include "yaml-cpp/yaml.h"
 
+#include "cache_summary.hpp"
 #include "causal_cache_handlers.hpp"
 #include "causal_cache_utils.hpp"
 
@@ -38,6 +39,9 @@ void run(KvsAsyncClientInterface* client, Address ip, unsigned thread_id) {
   StoreType causal_cut_store;
   VersionStoreType version_store;
 
+  // the summary of unmerged_store's keys that the scheduler reads
+  CacheSummaryFilter summary_filter;
+
   map<Key, set<Key>> to_fetch_map;
   map<Key, std::unordered_map<VectorClock, set<Key>, VectorClockHash>>
       cover_map;
@@ -110,7 +114,8 @@ void run(KvsAsyncClientInterface* client, Address ip, unsigned thread_id) {
     if (pollitems[1].revents & ZMQ_POLLIN) {
       string serialized = kZmqUtil->recv_string(&put_puller);
       put_request_handler(serialized, unmerged_store, causal_cut_store,
-                          version_store, request_id_to_address_map, client);
+                          version_store, request_id_to_address_map, client,
+                          &summary_filter);
     }
 
     // handle updates received from the KVS
@@ -135,7 +140,7 @@ void run(KvsAsyncClientInterface* client, Address ip, unsigned thread_id) {
                          causal_cut_store, version_store, single_callback_map,
                          pending_single_metadata, pending_cross_metadata,
                          to_fetch_map, cover_map, pushers, client, log, cct,
-                         client_id_to_address_map);
+                         client_id_to_address_map, &summary_filter);
       }
     }
 
@@ -167,7 +172,8 @@ void run(KvsAsyncClientInterface* client, Address ip, unsigned thread_id) {
                            causal_cut_store, version_store, single_callback_map,
                            pending_single_metadata, pending_cross_metadata,
                            to_fetch_map, cover_map, pushers, client, log, cct,
-                           client_id_to_address_map, request_id_to_address_map);
+                           client_id_to_address_map, request_id_to_address_map,
+                           &summary_filter);
     }
 
     // collect and store internal statistics
@@ -193,6 +199,17 @@ void run(KvsAsyncClientInterface* client, Address ip, unsigned thread_id) {
           generate_timestamp(thread_id), serialized));
       Key key = get_user_metadata_key(ip, UserMetadataType::cache_ip);
       client->put_async(key, serialize(val), LatticeType::LWW);
+
+      // the scheduler only reads this compact summary of the same keys
+      if (summary_filter.stale(unmerged_store.size())) {
+        summary_filter.rebuild(unmerged_store);
+      }
+
+      client->put_async(
+          get_user_metadata_key(ip, UserMetadataType::cache_summary),
+          serialize(get_cache_summary_lattice(
+              summary_filter.summary(unmerged_store.size()), thread_id)),
+          LatticeType::LWW);
       report_start = std::chrono::system_clock::now();
     }
 
@@ -27,7 +27,8 @@ void kvs_response_handler(
     SocketCache& pushers, KvsAsyncClientInterface* client, logger log,
     const CausalCacheThread& cct,
     map<string, set<Address>>& client_id_to_address_map,
-    map<string, Address>& request_id_to_address_map) {
+    map<string, Address>& request_id_to_address_map,
+    CacheSummaryFilter* summary_filter) {
   Key key = response.tuples(0).key();
   // first, check if the request failed
   if (response.has_error() && response.error() == ResponseErrorType::TIMEOUT) {
@@ -59,7 +60,7 @@ void kvs_response_handler(
                        causal_cut_store, version_store, single_callback_map,
                        pending_single_metadata, pending_cross_metadata,
                        to_fetch_map, cover_map, pushers, client, log, cct,
-                       client_id_to_address_map);
+                       client_id_to_address_map, summary_filter);
     } else {
       if (request_id_to_address_map.find(response.response_id()) ==
           request_id_to_address_map.end()) {
@@ -18,7 +18,8 @@ void put_request_handler(const string& serialized, StoreType& unmerged_store,
                          StoreType& causal_cut_store,
                          VersionStoreType& version_store,
                          map<string, Address>& request_id_to_address_map,
-                         KvsAsyncClientInterface* client) {
+                         KvsAsyncClientInterface* client,
+                         CacheSummaryFilter* summary_filter) {
   CausalRequest request;
   request.ParseFromString(serialized);
 
@@ -37,6 +38,7 @@ void put_request_handler(const string& serialized, StoreType& unmerged_store,
         unmerged_store[key] = causal_merge(unmerged_store[key], lattice);
       }
     }
+    summarize_key(summary_filter, key, unmerged_store[key]);
     // if cross causal, also update causal cut
     if (request.consistency() == ConsistencyType::CROSS) {
       // we compare two lattices
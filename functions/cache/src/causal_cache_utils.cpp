@@ -372,7 +372,8 @@ void process_response(
         cover_map,
     SocketCache& pushers, KvsAsyncClientInterface* client, logger log,
     const CausalCacheThread& cct,
-    map<string, set<Address>>& client_id_to_address_map) {
+    map<string, set<Address>>& client_id_to_address_map,
+    CacheSummaryFilter* summary_filter) {
   // first, update unmerged store
   if (unmerged_store.find(key) == unmerged_store.end()) {
     // key doesn't exist in unmerged map
@@ -410,6 +411,7 @@ void process_response(
       unmerged_store[key] = causal_merge(unmerged_store.at(key), lattice);
     }
   }
+  summarize_key(summary_filter, key, unmerged_store.at(key));
   // then, inspect the to_fetch_map
   if (to_fetch_map.find(key) != to_fetch_map.end() &&
       to_fetch_map[key].size() == 0) {
@@ -486,6 +488,22 @@ void process_response(
   }
 }
 
+void summarize_key(
+    CacheSummaryFilter* summary_filter, const Key& key,
+    const std::shared_ptr<CrossCausalLattice<SetLattice<string>>>& lattice) {
+  if (summary_filter == nullptr) {
+    return;
+  }
+
+  // the bytes a reader would fetch are those of every concurrent version
+  unsigned size = 0;
+  for (const string& val : lattice->reveal().value.reveal()) {
+    size += val.size();
+  }
+
+  summary_filter->add(key, size);
+}
+
 void populate_causal_frontier(
     const Key& key, const VectorClock& vc,
     map<Key, std::unordered_set<VectorClock, VectorClockHash>>&
@@ -85,14 +85,15 @@ class FluentConnection():
         flist = flist.names
         return flist
 
-    def exec_func(self, name, args):
+    # If profile is set, the function runs under a profiler on the executor,
+    # and this returns the profile ID (see get_profile) along with the
+    # response ID.
+    def exec_func(self, name, args, profile=False):
         call = FunctionCall()
         call.name = name
         call.request_id = self.rid
-
-        for arg in args:
-            argobj = call.args.add()
-            serialize_val(arg, argobj)
+        call.profile = profile
+        call.args.extend([self._serialize_arg(arg) for arg in args])
 
         self.func_call_sock.send(call.SerializeToString())
 
@@ -100,13 +101,43 @@ class FluentConnection():
         r.ParseFromString(self.func_call_sock.recv())
 
         self.rid += 1
+
+        if profile:
+            return r.response_id, r.profile_id
+
         return r.response_id
 
-    def register(self, function, name):
+    # function is either a plain function, or a class for functions that keep
+    # state across calls. A class is instantiated once (without arguments) by
+    # each executor that pins it, and the instance is then called like a plain
+    # function; if it has a teardown method, that is called when the function
+    # is unpinned.
+    #
+    # If batching is set, the function is called with the user library
+    # followed by one list per argument, holding that argument for each
+    # invocation in the batch, and must return a list of results in the same
+    # order. Executors collect up to max_batch_size invocations in a batch,
+    # waiting at most max_batch_wait seconds for it to fill up.
+    #
+    # If deterministic is set, the function must always return the same
+    # result for the same arguments (and versions of referenced keys); its
+    # results are then memoized by the executors for memo_ttl seconds.
+    # Memoization does not apply to batches or to causal DAGs.
+    def register(self, function, name, batching=False, max_batch_size=16,
+                 max_batch_wait=.01, deterministic=False, memo_ttl=3600):
         func = Function()
         func.name = name
         func.body = function_ser.dump(function)
 
+        if batching:
+            func.batching = True
+            func.max_batch_size = max_batch_size
+            func.max_batch_wait = max_batch_wait
+
+        if deterministic:
+            func.deterministic = True
+            func.memo_ttl = memo_ttl
+
         self.func_create_sock.send(func.SerializeToString())
 
         resp = GenericResponse()
@@ -141,13 +172,15 @@ class FluentConnection():
 
         return r.success, r.error
 
-    def call_dag(self, dname, arg_map, direct_response=False):
+    # If profile is set, every function in the DAG runs under a profiler, and
+    # this returns the profile ID (see get_profile) along with the result.
+    def call_dag(self, dname, arg_map, direct_response=False, profile=False):
         dc = DagCall()
         dc.name = dname
+        dc.profile = profile
 
         for fname in arg_map:
-            args = [serialize_val(arg, serialize=False) for arg in
-                    arg_map[fname]]
+            args = [self._serialize_arg(arg) for arg in arg_map[fname]]
             al = dc.function_args[fname]
             al.args.extend(args)
 
@@ -159,6 +192,12 @@ class FluentConnection():
         r = GenericResponse()
         r.ParseFromString(self.dag_call_sock.recv())
 
+        if profile:
+            return self._get_dag_result(r, direct_response), r.profile_id
+
+        return self._get_dag_result(r, direct_response)
+
+    def _get_dag_result(self, r, direct_response):
         if direct_response:
             try:
                 result = self.response_sock.recv()
@@ -175,6 +214,26 @@ class FluentConnection():
             else:
                 return None
 
+    # Arguments larger than SPILL_THRESHOLD are stored in the KVS and passed
+    # by reference, so they do not travel through the scheduler. They are
+    # keyed by their contents, so passing the same value again reuses the
+    # stored copy.
+    def _serialize_arg(self, arg):
+        valobj = serialize_val(arg, serialize=False)
+        if len(valobj.body) <= SPILL_THRESHOLD:
+            return valobj
+
+        return spill_val(self.kvs_client, valobj)
+
+    # Returns the profiles stored under profile_id so far, one report per
+    # profiled function invocation, or None if there are none yet.
+    def get_profile(self, profile_id):
+        latt = self.kvs_client.get(profile_id)
+        if latt is None:
+            return None
+
+        return sorted(report.decode() for report in latt.reveal())
+
     def delete_dag(self, dname):
         self.dag_delete_sock.send_string(dname)
 
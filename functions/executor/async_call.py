@@ -0,0 +1,386 @@
+#  Copyright 2018 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import logging
+import time
+
+from anna.lattices import *
+from include.functions_pb2 import *
+from include.shared import *
+from include.serializer import *
+from include import server_utils as sutils
+from . import causal
+from .call import _add_causal_response, _deserialize_refs, _exec_batch, \
+        _forward_causal_result, _get_batch_profile_ids, \
+        _get_causal_dag_args, _get_causal_func_args, _get_causal_request, \
+        _get_causal_sink_clock, _get_dag_args, _get_dag_profile_id, \
+        _get_func_args, _get_successor_triggers, _process_args, \
+        _send_trigger, KVS_GET_SECONDS, REF_WAIT_TIMEOUT
+from .profiler import get_profile_lattice, run_profiled
+from . import utils
+
+
+# These are the asyncio counterparts of exec_function and exec_dag_function.
+# Every KVS access is awaited, so while one invocation waits on the cache,
+# others can make progress. User functions run off the event loop (see
+# _run_user_code), and the KVS accesses they make through the user library
+# are carried out on the loop. Each invocation has its own user library
+# scope, and with it its own message inbox, so concurrent invocations never
+# see each other's messages.
+async def exec_function_async(call, kvs, user_library, function_cache,
+                              object_cache=None, memo_cache=None):
+    logging.info('Received call for ' + call.name)
+
+    fargs = _process_args(call.args)
+
+    f = await _retrieve_function_async(call.name, kvs, function_cache,
+                                       memo_cache)
+    if not f:
+        logging.info('Function %s not found! Putting an error.' %
+                     (call.name))
+        sutils.error.error = FUNC_NOT_FOUND
+        result = serialize_val(('ERROR', sutils.error.SerializeToString()))
+    else:
+        # a stateful function that is called directly, rather than from a
+        # DAG it is pinned for, gets an instance for just this call
+        instance = None
+        user_lib = user_library.scope()
+        try:
+            instance = utils._create_instance(f)
+            profile_id = None
+            if call.profile:
+                profile_id = sutils._get_profile_kvs_name(call.resp_id)
+
+            result = await _exec_func_normal_async(kvs, instance, fargs,
+                                                   user_lib, object_cache,
+                                                   memo_cache, call.name,
+                                                   profile_id)
+            result = serialize_val(result)
+        except WaitTimeoutError as e:
+            logging.error('Invocation of %s timed out: %s' % (call.name,
+                                                              str(e)))
+            sutils.error.error = TIMED_OUT
+            result = serialize_val(('ERROR: ' + str(e),
+                                   sutils.error.SerializeToString()))
+        except Exception as e:
+            logging.exception('Unexpected error %s while executing function.' %
+                              (str(e)))
+            sutils.error.error = EXEC_ERROR
+            result = serialize_val(('ERROR: ' + str(e),
+                                   sutils.error.SerializeToString()))
+
+        user_lib.close()
+        if instance is not None and instance is not f:
+            utils._destroy_instance(instance)
+
+    await kvs.put(call.resp_id, LWWPairLattice(generate_timestamp(0), result))
+
+
+async def exec_dag_function_async(pusher_cache, kvs, triggers, function,
+                                  schedule, user_library, object_cache=None,
+                                  shm_store=None, payloads=None,
+                                  memo_cache=None):
+    user_lib = user_library.scope()
+    try:
+        if schedule.consistency != NORMAL:
+            await _exec_dag_function_causal_async(pusher_cache, kvs,
+                                                  triggers, function,
+                                                  schedule, payloads)
+            return
+
+        fargs = _get_dag_args(schedule, triggers, payloads)
+        result = await _exec_func_normal_async(kvs, function, fargs,
+                                               user_lib, object_cache,
+                                               memo_cache,
+                                               schedule.target_function,
+                                               _get_dag_profile_id(schedule))
+    except WaitTimeoutError as e:
+        logging.error('DAG %s (ID %s) timed out at function %s: %s' %
+                      (schedule.dag.name, schedule.id,
+                       schedule.target_function, str(e)))
+        await _send_dag_error_async(pusher_cache, kvs, schedule, TIMED_OUT,
+                                    'ERROR: ' + str(e))
+        return
+    except Exception as e:
+        logging.exception('Unexpected error %s while executing function %s '
+                          'of DAG %s (ID %s).' % (str(e),
+                                                  schedule.target_function,
+                                                  schedule.dag.name,
+                                                  schedule.id))
+        await _send_dag_error_async(pusher_cache, kvs, schedule, EXEC_ERROR,
+                                    'ERROR: ' + str(e))
+        return
+    finally:
+        user_lib.close()
+
+    await _finish_dag_function_async(pusher_cache, kvs, schedule, result,
+                                     shm_store)
+
+
+# The asyncio counterpart of exec_dag_function_batch.
+async def exec_dag_function_batch_async(pusher_cache, kvs, batch, function,
+                                        user_library, object_cache=None,
+                                        shm_store=None):
+    schedules = [schedule for schedule, _, _ in batch]
+    logging.info('Running a batch of %d invocations of %s.' %
+                 (len(batch), schedules[0].target_function))
+
+    arg_lists = [_get_dag_args(schedule, triggers, payloads)
+                 for schedule, triggers, payloads in batch]
+
+    # all of the batch's references are fetched with a single request
+    refs = [arg for args in arg_lists for arg in args
+            if isinstance(arg, FluentReference)]
+
+    try:
+        ref_values = {}
+        if refs:
+            ref_values = await _resolve_ref_normal_async(refs, kvs,
+                                                         object_cache)
+    except WaitTimeoutError as e:
+        for schedule in schedules:
+            await _send_dag_error_async(pusher_cache, kvs, schedule,
+                                        TIMED_OUT, 'ERROR: ' + str(e))
+        return
+
+    profile_ids = _get_batch_profile_ids(schedules)
+    user_lib = user_library.scope()
+    try:
+        if profile_ids:
+            results, report = await _run_user_code(
+                run_profiled, schedules[0].target_function +
+                ' (batch of %d)' % (len(batch)), _exec_batch,
+                (function, arg_lists, ref_values, user_lib))
+        else:
+            results = await _run_user_code(_exec_batch, function, arg_lists,
+                                           ref_values, user_lib)
+    except Exception as e:
+        # the whole batch ran as one call, so every invocation in it failed
+        logging.exception('Unexpected error %s while executing a batch of '
+                          '%s.' % (str(e), schedules[0].target_function))
+        for schedule in schedules:
+            await _send_dag_error_async(pusher_cache, kvs, schedule,
+                                        EXEC_ERROR, 'ERROR: ' + str(e))
+        return
+    finally:
+        user_lib.close()
+
+    for profile_id in profile_ids:
+        await kvs.put(profile_id, get_profile_lattice(report))
+
+    if results is None:
+        for schedule in schedules:
+            await _send_dag_error_async(pusher_cache, kvs, schedule,
+                                        EXEC_ERROR,
+                                        'ERROR: batch function %s must '
+                                        'return one result per invocation.'
+                                        % (schedule.target_function))
+        return
+
+    for schedule, result in zip(schedules, results):
+        await _finish_dag_function_async(pusher_cache, kvs, schedule, result,
+                                         shm_store)
+
+
+# The asyncio counterpart of _exec_dag_function_causal.
+async def _exec_dag_function_causal_async(pusher_cache, kvs, triggers,
+                                          function, schedule, payloads=None):
+    fargs, dependencies, versioned_key_locations = _get_causal_dag_args(
+        schedule, triggers, payloads)
+
+    # resolve any references to KVS objects
+    kv_pairs = {}
+    refs = [arg for arg in fargs if isinstance(arg, FluentReference)]
+    if len(refs) > 0:
+        keys, future_read_set, vk_lists = _get_causal_request(
+            refs, schedule, versioned_key_locations)
+        response = await wait_for_async(
+            lambda: kvs.causal_get(keys, future_read_set, vk_lists,
+                                   schedule.consistency, schedule.id), keys)
+        versioned_key_locations = _add_causal_response(
+            response, kv_pairs, versioned_key_locations)
+
+    result = await _run_user_code(function,
+                                  *_get_causal_func_args(fargs, kv_pairs))
+
+    dependencies = causal.merge_dependencies([
+        dependencies.items(),
+        [(key, dict(kv_pairs[key][0])) for key in kv_pairs]])
+
+    if _forward_causal_result(pusher_cache, schedule, result, dependencies,
+                              versioned_key_locations):
+        vector_clock = _get_causal_sink_clock(schedule, dependencies)
+
+        result = serialize_val(result)
+        await wait_for_async(lambda: kvs.causal_put(schedule.response_id,
+                                                    vector_clock,
+                                                    dependencies, result,
+                                                    schedule.id),
+                             schedule.response_id)
+
+
+# Runs user code on the event loop's default executor, which the asyncio
+# executor makes a single thread (see async_server.async_executor), so that
+# user functions still run one at a time, but the loop keeps receiving
+# messages and KVS responses while they do.
+async def _run_user_code(func, *args):
+    return await asyncio.get_event_loop().run_in_executor(None, func, *args)
+
+
+async def _finish_dag_function_async(pusher_cache, kvs, schedule, result,
+                                     shm_store=None):
+    is_sink = await _forward_dag_result_async(pusher_cache, kvs, schedule,
+                                              result, shm_store)
+
+    if is_sink:
+        logging.info('DAG %s (ID %s) completed; result at %s.' %
+                     (schedule.dag.name, schedule.id, schedule.id))
+        await _send_dag_result_async(pusher_cache, kvs, schedule, result)
+
+
+# The asyncio counterpart of _forward_dag_result; large values are spilled
+# with the asynchronous KVS client.
+async def _forward_dag_result_async(pusher_cache, kvs, schedule, result,
+                                    shm_store=None):
+    spills = []
+    triggers = _get_successor_triggers(schedule, result, shm_store, spills)
+
+    for key, lattice in spills:
+        await kvs.put(key, lattice)
+
+    for dest_ip, trigger, frames in triggers:
+        _send_trigger(pusher_cache, dest_ip, trigger, frames)
+
+    return len(triggers) == 0
+
+
+async def _send_dag_error_async(pusher_cache, kvs, schedule, error, msg):
+    sutils.error.error = error
+    await _send_dag_result_async(pusher_cache, kvs, schedule,
+                                 (msg, sutils.error.SerializeToString()))
+
+
+async def _send_dag_result_async(pusher_cache, kvs, schedule, result):
+    result = serialize_val(result)
+    if schedule.HasField('response_address'):
+        sckt = pusher_cache.get(schedule.response_address)
+        sckt.send(result)
+    else:
+        lattice = LWWPairLattice(generate_timestamp(0), result)
+        await kvs.put(schedule.id, lattice)
+
+
+async def _exec_func_normal_async(kvs, func, args, user_lib,
+                                  object_cache=None, memo_cache=None,
+                                  fname=None, profile_id=None):
+    refs = list(filter(lambda a: isinstance(a, FluentReference), args))
+
+    kv_pairs = {}
+    if refs:
+        kv_pairs = await _get_refs_async(refs, kvs)
+
+    memo_key = None
+    if memo_cache is not None:
+        memo_key = memo_cache.get_key(fname, args, kv_pairs)
+
+    if memo_key is not None:
+        found, res = memo_cache.get(memo_key)
+        if not found:
+            found, res = memo_cache.load(memo_key,
+                                         (await kvs.get(memo_key))[memo_key])
+
+        if found:
+            return res
+
+    if refs:
+        refs = _deserialize_refs(refs, kv_pairs, object_cache)
+
+    # execute the function
+    func_args = _get_func_args(args, refs, user_lib)
+    if profile_id is None:
+        res = await _run_user_code(func, *func_args)
+    else:
+        res, report = await _run_user_code(run_profiled, fname, func,
+                                           func_args)
+        await kvs.put(profile_id, get_profile_lattice(report))
+
+    # NB: this entry is never removed from the KVS; see MEMO_KEY_PREFIX
+    if memo_key is not None:
+        await kvs.put(memo_key, memo_cache.dump(memo_key, fname, res))
+
+    return res
+
+
+async def _resolve_ref_normal_async(refs, kvs, object_cache=None):
+    return _deserialize_refs(refs, await _get_refs_async(refs, kvs),
+                             object_cache)
+
+
+async def _get_refs_async(refs, kvs):
+    keys = [ref.key for ref in refs]
+    keys = list(set(keys))
+
+    # when chaining function executions, we must wait for the upstream
+    # function to write its result
+    return await wait_for_async(lambda: _get_all_async(kvs, keys), keys,
+                                REF_WAIT_TIMEOUT)
+
+
+async def _get_all_async(kvs, keys):
+    start = time.time()
+    kv_pairs = await kvs.get(keys)
+    KVS_GET_SECONDS.observe(time.time() - start)
+
+    if any(not val for val in kv_pairs.values()):
+        return None
+
+    return kv_pairs
+
+
+async def _retrieve_function_async(name, kvs, function_cache, memo_cache=None):
+    kvs_name = sutils._get_func_kvs_name(name)
+
+    # the metadata also tells us whether the function can be memoized
+    version, metadata = await _retrieve_function_metadata_version_async(name,
+                                                                        kvs)
+    if memo_cache is not None:
+        memo_cache.add_function(name, version, metadata)
+
+    if version is not None:
+        func = function_cache.get(name, version)
+        if func is not None:
+            return func
+
+    latt = (await kvs.get(kvs_name))[kvs_name]
+    if latt is None:
+        return None
+
+    func = function_ser.load(latt.reveal()[1])
+    function_cache.put(name, latt.reveal()[0], func)
+
+    return func
+
+
+# The asyncio counterpart of utils._retrieve_function_metadata_version.
+async def _retrieve_function_metadata_version_async(name, kvs):
+    kvs_name = sutils._get_func_metadata_kvs_name(name)
+    latt = (await kvs.get(kvs_name))[kvs_name]
+
+    if latt is None:
+        return None, None
+
+    func = Function()
+    func.ParseFromString(latt.reveal()[1])
+    return latt.reveal()[0], func
@@ -0,0 +1,231 @@
+#  Copyright 2018 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import time
+import zmq
+import zmq.asyncio
+
+from anna.async_ipc_client import AsyncIpcAnnaClient
+from anna.zmq_util import SocketCache
+from include.functions_pb2 import *
+from .async_call import *
+from .loop import ExecutorLoop, Runner
+from .pin import pin_async
+from . import user_library
+
+
+def async_executor(ip, mgmt_ip, schedulers, thread_id, pin_capacity=1):
+    logging.basicConfig(filename='log_executor.txt', level=logging.INFO,
+                        format='%(asctime)s %(message)s')
+
+    # user functions run one at a time, on a thread of their own (see
+    # async_call._run_user_code)
+    loop = asyncio.get_event_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=1))
+    loop.run_until_complete(_run_executor(ip, mgmt_ip, schedulers, thread_id,
+                                          pin_capacity))
+
+
+# This executor accepts the same messages as executor.server.executor, but
+# runs every function invocation as its own asyncio task. While one
+# invocation waits on the KVS, the loop keeps receiving schedules and triggers
+# and running other invocations, so data-heavy DAGs scale with the number of
+# outstanding requests rather than with the number of executor threads.
+async def _run_executor(ip, mgmt_ip, schedulers, thread_id, pin_capacity):
+    ctx = zmq.asyncio.Context(1)
+
+    # outgoing messages are sent on regular sockets: sending on a PUSH socket
+    # only queues the message, so it never blocks the event loop
+    pusher_cache = SocketCache(zmq.Context(1), zmq.PUSH)
+
+    client = AsyncIpcAnnaClient(thread_id)
+    runner = AsyncRunner(client)
+
+    # user functions reach the KVS through this thread's client as well
+    user_lib = user_library.FluentUserLibrary(
+        ip, thread_id, user_library.EventLoopAnnaClient(
+            client, asyncio.get_event_loop()))
+
+    executor_loop = ExecutorLoop(ip, mgmt_ip, schedulers, thread_id,
+                                 pin_capacity, ctx, pusher_cache,
+                                 _DeferredPutClient(runner), user_lib,
+                                 runner)
+
+    poller = zmq.asyncio.Poller()
+    for sckt in executor_loop.sockets:
+        poller.register(sckt, zmq.POLLIN)
+
+    while True:
+        socks = dict(await poller.poll(timeout=executor_loop.timeout()))
+
+        for sckt in executor_loop.sockets:
+            if sckt in socks and socks[sckt] == zmq.POLLIN:
+                executor_loop.handle(sckt,
+                                     await sckt.recv_multipart(copy=False))
+
+        if executor_loop.step(socks):
+            return 0
+
+
+class AsyncRunner(Runner):
+    # Runs every invocation, and every pin, as an asyncio task that makes its
+    # KVS requests with client.
+    def __init__(self, client):
+        self.client = client
+
+        # the tasks that are currently running, and how many invocations of
+        # each DAG function are among them
+        self.tasks = set()
+        self.counts = {}
+
+        # pins and unpins are handled one at a time, in the order they
+        # arrived, since a pin only checks our capacity when it starts
+        self.control = asyncio.Lock()
+
+        # invocations interleave, so we measure thread utilization as the
+        # CPU time this process used rather than by summing per-event wall
+        # time
+        self.cpu_start = time.process_time()
+
+    def run_function(self, serialized):
+        executor = self.executor
+        call = FunctionCall()
+        call.ParseFromString(serialized)
+
+        self._start_invocation(exec_function_async(call, self.client,
+                                                   executor.user_lib,
+                                                   executor.function_cache,
+                                                   executor.object_cache,
+                                                   executor.memo_cache))
+
+    def run_dag(self, invocation):
+        executor = self.executor
+        fname = invocation.fname
+
+        self._start_invocation(exec_dag_function_async(
+            executor.pusher_cache, self.client, invocation.triggers,
+            executor.pinned_functions[fname], invocation.schedule,
+            executor.user_lib, executor.object_cache, executor.shm_store,
+            invocation.payloads, executor.memo_cache),
+            fname, [invocation.receive_time])
+
+    def run_batch(self, fname, batch):
+        executor = self.executor
+        invocations = [(invocation.schedule, invocation.triggers,
+                        invocation.payloads) for invocation in batch]
+
+        self._start_invocation(exec_dag_function_batch_async(
+            executor.pusher_cache, self.client, invocations,
+            executor.pinned_functions[fname], executor.user_lib,
+            executor.object_cache, executor.shm_store),
+            fname, [invocation.receive_time for invocation in batch])
+
+    def pin(self, msg):
+        self.start(self._pin(msg))
+
+    def unpin(self, name):
+        self.start(self._unpin(name))
+
+    def has_tasks(self, fname):
+        return fname in self.counts
+
+    def busy(self):
+        return len(self.tasks) > 0
+
+    # The in-flight invocations of the functions overlap, so each one's share
+    # of the utilization is its share of their time in flight.
+    def utilization(self, period):
+        cpu_end = time.process_time()
+        utilization = (cpu_end - self.cpu_start) / period
+        self.cpu_start = cpu_end
+
+        function_occupancy = self.executor.function_occupancy
+        total = sum(function_occupancy.values())
+
+        function_utilization = {}
+        if total > 0:
+            for fname in function_occupancy:
+                function_utilization[fname] = utilization * \
+                    function_occupancy[fname] / total
+
+        return utilization, function_utilization
+
+    def queue_depth(self):
+        return {'in_flight': len(self.tasks)}
+
+    # Starts coro as a task, which we wait for before the thread departs.
+    def start(self, coro):
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self._finish_task)
+
+        return task
+
+    def _finish_task(self, task):
+        self.tasks.discard(task)
+
+        if task.cancelled():
+            logging.error('An executor task was cancelled.')
+        elif task.exception() is not None:
+            logging.error('Unexpected error %s in an executor task.' %
+                          (str(task.exception())))
+
+    def _start_invocation(self, coro, fname=None, receive_times=()):
+        task = self.start(coro)
+        task_start = time.time()
+
+        if fname is not None:
+            self.counts[fname] = self.counts.get(fname, 0) + 1
+
+        def finish(task):
+            if fname is not None:
+                self.counts[fname] -= 1
+                if self.counts[fname] == 0:
+                    del self.counts[fname]
+
+            self.executor.finish(fname, time.time() - task_start,
+                                 receive_times)
+
+        task.add_done_callback(finish)
+
+    async def _pin(self, msg):
+        executor = self.executor
+        async with self.control:
+            await pin_async(msg, executor.pusher_cache, self.client,
+                            executor.status, executor.pinned_functions,
+                            executor.runtimes, executor.exec_counts,
+                            executor.function_cache, executor.batch_queues,
+                            executor.unpinned, executor.memo_cache)
+
+        executor.publisher.update()
+
+    async def _unpin(self, name):
+        async with self.control:
+            self.executor.unpin_function(name)
+
+
+class _DeferredPutClient():
+    # The executor reports failed invocations (see pin.reject_unpinned and
+    # pending.report_pending_failure) through a blocking KVS client. This one
+    # starts each put as a task of the runner instead of waiting for it; it
+    # supports nothing else.
+    def __init__(self, runner):
+        self.runner = runner
+
+    def put(self, key, value):
+        self.runner.start(self.runner.client.put(key, value))
+        return True
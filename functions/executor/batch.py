@@ -0,0 +1,108 @@
+#  Copyright 2018 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import time
+
+# the shortest time (in seconds) a batch waits to fill up once its wait time
+# has adapted to a light load
+MIN_BATCH_WAIT = .001
+
+
+class BatchQueue():
+    # Collects the ready invocations of a function that accepts batches. A
+    # batch is released once it holds max_size invocations, or once its oldest
+    # invocation has waited for the current wait time. The wait time adapts to
+    # the load: a batch that times out holding a single invocation only added
+    # latency, so the wait is halved; a batch that fills up, or that collects
+    # several invocations before timing out, doubles it again (up to
+    # max_wait).
+    def __init__(self, max_size, max_wait):
+        self.max_size = max(max_size, 1)
+        self.max_wait = max_wait
+        self.wait = max_wait
+
+        self.invocations = []
+        self.start = None
+
+    def __len__(self):
+        return len(self.invocations)
+
+    # Adds an invocation, and returns the batch if it is now full.
+    def add(self, invocation):
+        if not self.invocations:
+            self.start = time.time()
+
+        self.invocations.append(invocation)
+
+        if len(self.invocations) >= self.max_size:
+            self.wait = min(self.wait * 2, self.max_wait)
+            return self._release()
+
+        return None
+
+    # Returns the batch if it has waited long enough, and None otherwise.
+    def poll(self):
+        if not self.invocations or self.timeout() > 0:
+            return None
+
+        if len(self.invocations) == 1:
+            self.wait = max(self.wait / 2, min(MIN_BATCH_WAIT, self.max_wait))
+        else:
+            self.wait = min(self.wait * 2, self.max_wait)
+
+        return self._release()
+
+    # How long (in seconds) until the current batch has to be released, or
+    # None if there is no batch.
+    def timeout(self):
+        if not self.invocations:
+            return None
+
+        return max(0, self.start + self.wait - time.time())
+
+    def _release(self):
+        batch = self.invocations
+        self.invocations = []
+        self.start = None
+
+        return batch
+
+
+# The number of invocations waiting in any of the batch queues.
+def count_batched(batch_queues):
+    return sum(len(batch_queues[fname]) for fname in batch_queues)
+
+
+# Releases every batch that has waited long enough, returning (function name,
+# batch) pairs.
+def poll_batches(batch_queues):
+    batches = []
+    for fname in batch_queues:
+        batch = batch_queues[fname].poll()
+        if batch:
+            batches.append((fname, batch))
+
+    return batches
+
+
+# How long (in ms) the caller can block before one of the batches has to be
+# released; at most default.
+def get_batch_timeout(batch_queues, default):
+    timeout = default
+    for fname in batch_queues:
+        remaining = batch_queues[fname].timeout()
+        if remaining is not None:
+            timeout = min(timeout, int(remaining * 1000))
+
+    return timeout
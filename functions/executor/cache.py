@@ -0,0 +1,133 @@
+#  Copyright 2018 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from collections import OrderedDict
+import numpy as np
+
+# the number of deserialized functions each executor thread keeps around
+FUNCTION_CACHE_SIZE = 64
+
+# the number of bytes of deserialized KVS objects each executor thread keeps
+OBJECT_CACHE_SIZE = 128 * 1024 * 1024
+
+# values of these types cannot be modified by the functions they are passed
+# to, so it is safe to hand the same object to more than one invocation
+IMMUTABLE_TYPES = (bool, bytes, float, int, str)
+
+
+class FunctionCache():
+    # An LRU cache of deserialized function objects. Each function is cached
+    # alongside the LWW timestamp of the body it was loaded from, so a
+    # re-registered function is simply a miss that replaces the old entry.
+    def __init__(self, capacity=FUNCTION_CACHE_SIZE):
+        self.capacity = capacity
+        self._cache = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name, version):
+        if name in self._cache:
+            cached_version, func = self._cache[name]
+
+            if cached_version == version:
+                self._cache.move_to_end(name)
+                self.hits += 1
+                return func
+
+        self.misses += 1
+        return None
+
+    def put(self, name, version, func):
+        self._cache[name] = (version, func)
+        self._cache.move_to_end(name)
+
+        while len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+
+    def invalidate(self, name):
+        if name in self._cache:
+            del self._cache[name]
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+
+class ObjectCache():
+    # A size-bounded LRU cache of deserialized FluentReference values, keyed by
+    # the KVS key and the LWW timestamp of the value it was deserialized from.
+    # NumPy arrays are stored read-only, and every invocation is given its own
+    # view of the cached array rather than a copy. Other mutable values are
+    # never cached, since one invocation could modify what the next one sees.
+    def __init__(self, capacity=OBJECT_CACHE_SIZE):
+        self.capacity = capacity
+        self.size = 0
+        self._cache = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def get(self, key, version):
+        if key in self._cache:
+            cached_version, value, size = self._cache[key]
+
+            if cached_version == version:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                self.bytes_saved += size
+                return _get_view(value)
+
+        self.misses += 1
+        return None
+
+    # Caches value if possible, and returns the object the caller should use
+    # in its place.
+    def put(self, key, version, value, size):
+        if isinstance(value, np.ndarray):
+            size = value.nbytes
+        elif type(value) not in IMMUTABLE_TYPES:
+            return value
+
+        if size > self.capacity:
+            return value
+
+        if isinstance(value, np.ndarray):
+            value.setflags(write=False)
+
+        if key in self._cache:
+            self.size -= self._cache[key][2]
+
+        self._cache[key] = (version, value, size)
+        self._cache.move_to_end(key)
+        self.size += size
+
+        while self.size > self.capacity:
+            _, (_, _, evicted) = self._cache.popitem(last=False)
+            self.size -= evicted
+
+        return _get_view(value)
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+
+def _get_view(value):
+    if isinstance(value, np.ndarray):
+        return value.view()
+
+    return value
@@ -13,6 +13,7 @@
 #  limitations under the License.
 
 import logging
+import numpy as np
 import sys
 import time
 import zmq
@@ -21,33 +22,80 @@ from anna.lattices import *
 from include.functions_pb2 import *
 from include.shared import *
 from include.serializer import *
+from include import metrics
 from include import server_utils as sutils
-from . import user_library
+from . import causal
+from .profiler import get_profile_lattice, run_profiled
 from . import utils
 
+# how long (in seconds) an invocation waits for a referenced key to be written
+# before it gives up
+REF_WAIT_TIMEOUT = 60
 
-def _process_args(arg_list):
-    return [get_serializer(arg.type).load(arg.body) for arg in arg_list]
+KVS_GET_SECONDS = metrics.histogram('fluent_kvs_get_seconds',
+                                    'Latency of reading referenced keys from '
+                                    'the KVS.')
 
 
-def exec_function(exec_socket, kvs, status, ip, tid):
-    user_lib = user_library.FluentUserLibrary(ip, tid, kvs)
+# Deserializes a list of Values. Values that were sent in a separate frame of
+# a multipart message are loaded from the corresponding buffer in frames.
+def _process_args(arg_list, frames=()):
+    return [get_serializer(arg.type).load(frames[arg.frame] if
+                                          arg.HasField('frame') else arg.body)
+            for arg in arg_list]
+
+
+# serialized is a FunctionCall.
+def exec_function(serialized, kvs, user_library, function_cache,
+                  object_cache=None, memo_cache=None):
     call = FunctionCall()
-    call.ParseFromString(exec_socket.recv())
+    call.ParseFromString(serialized)
+
+    _exec_function_call(call, kvs, user_library, function_cache, object_cache,
+                        memo_cache)
+
+
+def _exec_function_call(call, kvs, user_library, function_cache,
+                        object_cache=None, memo_cache=None):
     logging.info('Received call for ' + call.name)
 
     fargs = _process_args(call.args)
 
-    f = utils._retrieve_function(call.name, kvs)
+    # the function's metadata tells us whether it can be memoized, and its
+    # version is all we need to check our cached copy of it
+    version = None
+    if memo_cache is not None:
+        version, metadata = utils._retrieve_function_metadata_version(
+            call.name, kvs)
+        memo_cache.add_function(call.name, version, metadata)
+
+    f = utils._retrieve_function(call.name, kvs, function_cache, version)
     if not f:
         logging.info('Function %s not found! Putting an error.' %
                      (call.name))
         sutils.error.error = FUNC_NOT_FOUND
         result = serialize_val(('ERROR', sutils.error.SerializeToString()))
     else:
+        # a stateful function that is called directly, rather than from a
+        # DAG it is pinned for, gets an instance for just this call
+        instance = None
+        user_lib = user_library.scope()
         try:
-            result = _exec_func_normal(kvs, f, fargs, user_lib)
+            instance = utils._create_instance(f)
+            profile_id = None
+            if call.profile:
+                profile_id = sutils._get_profile_kvs_name(call.resp_id)
+
+            result = _exec_func_normal(kvs, instance, fargs, user_lib,
+                                       object_cache, memo_cache, call.name,
+                                       profile_id)
             result = serialize_val(result)
+        except WaitTimeoutError as e:
+            logging.error('Invocation of %s timed out: %s' % (call.name,
+                                                              str(e)))
+            sutils.error.error = TIMED_OUT
+            result = serialize_val(('ERROR: ' + str(e),
+                                   sutils.error.SerializeToString()))
         except Exception as e:
             logging.exception('Unexpected error %s while executing function.' %
                               (str(e)))
@@ -55,269 +103,578 @@ def exec_function(exec_socket, kvs, status, ip, tid):
             result = serialize_val(('ERROR: ' + str(e),
                                    sutils.error.SerializeToString()))
 
-    user_lib.close()
+        user_lib.close()
+        if instance is not None and instance is not f:
+            utils._destroy_instance(instance)
+
     kvs.put(call.resp_id, LWWPairLattice(generate_timestamp(0), result))
 
 
-def exec_dag_function(pusher_cache, kvs, triggers, function, schedule, ip,
-                      tid):
-    user_lib = user_library.FluentUserLibrary(ip, tid, kvs)
-    if schedule.consistency == NORMAL:
-        _exec_dag_function_normal(pusher_cache, kvs,
-                                  triggers, function, schedule, user_lib)
-    else:
-        # XXX TODO do we need separate user lib for causal functions?
-        _exec_dag_function_causal(pusher_cache, kvs,
-                                  triggers, function, schedule)
+# Fails a function call whose result we could not produce.
+def _send_call_error(kvs, call, error, msg):
+    sutils.error.error = error
+    result = serialize_val((msg, sutils.error.SerializeToString()))
+    kvs.put(call.resp_id, LWWPairLattice(generate_timestamp(0), result))
 
-    user_lib.close()
+
+# payloads maps each trigger's source to the payload frames that arrived with
+# it, if any.
+def exec_dag_function(pusher_cache, kvs, triggers, function, schedule,
+                      user_library, object_cache=None, shm_store=None,
+                      payloads=None, memo_cache=None):
+    user_lib = user_library.scope()
+    try:
+        if schedule.consistency == NORMAL:
+            _exec_dag_function_normal(pusher_cache, kvs, triggers, function,
+                                      schedule, user_lib, object_cache,
+                                      shm_store, payloads, memo_cache)
+        else:
+            # XXX TODO do we need separate user lib for causal functions?
+            _exec_dag_function_causal(pusher_cache, kvs,
+                                      triggers, function, schedule, payloads)
+    finally:
+        user_lib.close()
 
 
 def _exec_dag_function_normal(pusher_cache, kvs, triggers, function, schedule,
-                              user_lib):
-    fname = schedule.target_function
-    fargs = list(schedule.arguments[fname].args)
+                              user_lib, object_cache=None, shm_store=None,
+                              payloads=None, memo_cache=None):
+    fargs = _get_dag_args(schedule, triggers, payloads)
+
+    try:
+        result = _exec_func_normal(kvs, function, fargs, user_lib,
+                                   object_cache, memo_cache,
+                                   schedule.target_function,
+                                   _get_dag_profile_id(schedule))
+    except WaitTimeoutError as e:
+        # the rest of the DAG cannot run without this result, so the client is
+        # told about the error directly
+        logging.error('DAG %s (ID %s) timed out at function %s: %s' %
+                      (schedule.dag.name, schedule.id,
+                       schedule.target_function, str(e)))
+        _send_dag_error(pusher_cache, kvs, schedule, TIMED_OUT,
+                        'ERROR: ' + str(e))
+        return
+    except Exception as e:
+        logging.exception('Unexpected error %s while executing function %s '
+                          'of DAG %s (ID %s).' % (str(e),
+                                                  schedule.target_function,
+                                                  schedule.dag.name,
+                                                  schedule.id))
+        _send_dag_error(pusher_cache, kvs, schedule, EXEC_ERROR,
+                        'ERROR: ' + str(e))
+        return
+
+    _finish_dag_function(pusher_cache, kvs, schedule, result, shm_store)
+
+
+# Runs a batch of invocations of a function that was registered with
+# batching. batch is a list of (schedule, triggers, payloads) tuples. The
+# function is passed the user library followed by one list per argument,
+# holding that argument for every invocation, and returns a list with one
+# result per invocation, in the same order.
+def exec_dag_function_batch(pusher_cache, kvs, batch, function, user_library,
+                            object_cache=None, shm_store=None):
+    schedules = [schedule for schedule, _, _ in batch]
+    logging.info('Running a batch of %d invocations of %s.' %
+                 (len(batch), schedules[0].target_function))
+
+    arg_lists = [_get_dag_args(schedule, triggers, payloads)
+                 for schedule, triggers, payloads in batch]
+
+    # all of the batch's references are fetched with a single request
+    refs = [arg for args in arg_lists for arg in args
+            if isinstance(arg, FluentReference)]
+
+    try:
+        ref_values = _resolve_ref_normal(refs, kvs, object_cache) if refs \
+            else {}
+    except WaitTimeoutError as e:
+        for schedule in schedules:
+            _send_dag_error(pusher_cache, kvs, schedule, TIMED_OUT,
+                            'ERROR: ' + str(e))
+        return
+
+    profile_ids = _get_batch_profile_ids(schedules)
+    user_lib = user_library.scope()
+    try:
+        if profile_ids:
+            results, report = run_profiled(schedules[0].target_function +
+                                           ' (batch of %d)' % (len(batch)),
+                                           _exec_batch, (function, arg_lists,
+                                                         ref_values,
+                                                         user_lib))
+        else:
+            results = _exec_batch(function, arg_lists, ref_values, user_lib)
+    except Exception as e:
+        # the whole batch ran as one call, so every invocation in it failed
+        logging.exception('Unexpected error %s while executing a batch of '
+                          '%s.' % (str(e), schedules[0].target_function))
+        for schedule in schedules:
+            _send_dag_error(pusher_cache, kvs, schedule, EXEC_ERROR,
+                            'ERROR: ' + str(e))
+        return
+    finally:
+        user_lib.close()
 
-    for trname in schedule.triggers:
-        trigger = triggers[trname]
-        fargs += list(trigger.arguments.args)
+    for profile_id in profile_ids:
+        kvs.put(profile_id, get_profile_lattice(report))
+
+    if results is None:
+        for schedule in schedules:
+            _send_dag_error(pusher_cache, kvs, schedule, EXEC_ERROR,
+                            'ERROR: batch function %s must return one result '
+                            'per invocation.' % (schedule.target_function))
+        return
+
+    for schedule, result in zip(schedules, results):
+        _finish_dag_function(pusher_cache, kvs, schedule, result, shm_store)
+
+
+# Calls a batching function on the resolved arguments of each invocation, and
+# returns its results, or None if it did not return one result per invocation.
+def _exec_batch(function, arg_lists, ref_values, user_lib):
+    arg_lists = [_substitute_refs(args, ref_values) for args in arg_lists]
+    columns = [list(column) for column in zip(*arg_lists)]
+
+    results = function(user_lib, *columns)
+
+    if results is None or len(results) != len(arg_lists):
+        return None
 
-    fargs = _process_args(fargs)
-    result = _exec_func_normal(kvs, function, fargs, user_lib)
+    return list(results)
 
-    is_sink = True
-    for conn in schedule.dag.connections:
-        if conn.source == fname:
-            is_sink = False
-            new_trigger = DagTrigger()
-            new_trigger.id = trigger.id
-            new_trigger.target_function = conn.sink
-            new_trigger.source = fname
 
-            if type(result) != tuple:
-                result = (result,)
+# The profile ID of a DAG invocation, or None if it is not being profiled.
+def _get_dag_profile_id(schedule):
+    if schedule.profile:
+        return sutils._get_profile_kvs_name(schedule.id)
 
-            al = new_trigger.arguments
-            al.args.extend(list(map(lambda v: serialize_val(v, None, False),
-                                    result)))
+    return None
 
-            dest_ip = schedule.locations[conn.sink]
-            sckt = pusher_cache.get(sutils._get_dag_trigger_address(dest_ip))
-            sckt.send(new_trigger.SerializeToString())
+
+# The profile IDs of every profiled invocation in a batch; all of them get the
+# profile of the whole batch.
+def _get_batch_profile_ids(schedules):
+    return [_get_dag_profile_id(schedule) for schedule in schedules
+            if schedule.profile]
+
+
+def _finish_dag_function(pusher_cache, kvs, schedule, result,
+                         shm_store=None):
+    is_sink = _forward_dag_result(pusher_cache, schedule, result, shm_store,
+                                  kvs)
 
     if is_sink:
         logging.info('DAG %s (ID %s) completed; result at %s.' %
-                     (schedule.dag.name, trigger.id, schedule.id))
-        result = serialize_val(result)
-        if schedule.HasField('response_address'):
-            sckt = pusher_cache.get(schedule.response_address)
-            sckt.send(result)
-        else:
-            lattice = LWWPairLattice(generate_timestamp(0), result)
-            kvs.put(schedule.id, lattice)
+                     (schedule.dag.name, schedule.id, schedule.id))
+        _send_dag_result(pusher_cache, kvs, schedule, result)
+
+
+def _send_dag_error(pusher_cache, kvs, schedule, error, msg):
+    sutils.error.error = error
+    _send_dag_result(pusher_cache, kvs, schedule,
+                     (msg, sutils.error.SerializeToString()))
 
 
-def _exec_func_normal(kvs, func, args, user_lib):
+def _send_dag_result(pusher_cache, kvs, schedule, result):
+    result = serialize_val(result)
+    if schedule.HasField('response_address'):
+        sckt = pusher_cache.get(schedule.response_address)
+        sckt.send(result)
+    else:
+        lattice = LWWPairLattice(generate_timestamp(0), result)
+        kvs.put(schedule.id, lattice)
+
+
+# Returns the deserialized arguments of a DAG function: its own arguments from
+# the schedule, followed by those of each of its triggers.
+def _get_dag_args(schedule, triggers, payloads=None):
+    fname = schedule.target_function
+    fargs = _process_args(schedule.arguments[fname].args)
+
+    for trname in schedule.triggers:
+        fargs += _process_args(triggers[trname].arguments.args,
+                               _get_trigger_frames(payloads, trname))
+
+    return fargs
+
+
+def _get_trigger_frames(payloads, trname):
+    if payloads and trname in payloads:
+        return payloads[trname]
+
+    return ()
+
+
+# Sends the result of a DAG function to each of its successors. Returns True if
+# the function has no successors, i.e., it is the sink of the DAG. If we have a
+# shared memory store, large arrays are handed to successors on this node
+# through shared memory; if we have a KVS client, large values for successors
+# on other nodes are spilled to the KVS. Either way, the result is serialized
+# at most once.
+def _forward_dag_result(pusher_cache, schedule, result, shm_store=None,
+                        kvs=None):
+    spills = [] if kvs is not None else None
+    triggers = _get_successor_triggers(schedule, result, shm_store, spills)
+
+    # spilled values have to be in the KVS before a successor looks for them
+    for key, lattice in spills or ():
+        kvs.put(key, lattice)
+
+    for dest_ip, trigger, frames in triggers:
+        _send_trigger(pusher_cache, dest_ip, trigger, frames)
+
+    return len(triggers) == 0
+
+
+# Returns a (destination, trigger, payload frames) tuple for each of the
+# function's successors. If spills is a list, large values for successors on
+# other nodes are passed by reference, and the (key, lattice) pairs to store
+# for them are added to spills.
+def _get_successor_triggers(schedule, result, shm_store=None, spills=None):
+    fname = schedule.target_function
+
+    if type(result) != tuple:
+        result = (result,)
+
+    remote = None
+    local = None
+
+    triggers = []
+    successors = sutils._get_dag_index(schedule.dag).successors[fname]
+    for sink in successors:
+        new_trigger = DagTrigger()
+        new_trigger.id = schedule.id
+        new_trigger.target_function = sink
+        new_trigger.source = fname
+
+        dest_ip = schedule.locations[sink]
+        if shm_store is not None and shm_store.is_local(dest_ip):
+            if local is None:
+                local = _serialize_trigger_args(result, shm_store)
+            args, frames = local
+        else:
+            if remote is None:
+                remote = _serialize_trigger_args(result, None, spills)
+            args, frames = remote
+
+        new_trigger.arguments.args.extend(args)
+        triggers.append((dest_ip, new_trigger, frames))
+
+    return triggers
+
+
+# Serializes the result of a DAG function for its successors' triggers.
+# Rather than being copied into the trigger, each NumPy array is serialized
+# into its own buffer, which is sent as a payload frame after the trigger and
+# can be shared by every successor. If spills is a list, values larger than
+# SPILL_THRESHOLD are instead passed by reference, and the (key, lattice)
+# pairs to store in the KVS for them are added to spills (see get_spill).
+# Returns the argument Values and the payload frames.
+def _serialize_trigger_args(result, shm_store=None, spills=None):
+    args = []
+    frames = []
+    for i, val in enumerate(result):
+        valobj = None
+        if shm_store is not None:
+            valobj = shm_store.dump(val)
+
+        spill = spills is not None and valobj is None
+        if valobj is None and isinstance(val, np.ndarray) and \
+                not (spill and val.nbytes > SPILL_THRESHOLD):
+            valobj = Value()
+            valobj.body = b''
+            valobj.type = NUMPY
+            valobj.frame = len(frames)
+            frames.append(numpy_ser.dump_buffer(val))
+        elif valobj is None:
+            valobj = serialize_val(val, None, False)
+
+            if spill and len(valobj.body) > SPILL_THRESHOLD:
+                key, lattice, valobj = get_spill(valobj)
+                spills.append((key, lattice))
+
+        args.append(valobj)
+
+    return args, frames
+
+
+def _send_trigger(pusher_cache, dest_ip, trigger, frames):
+    sckt = pusher_cache.get(sutils._get_dag_trigger_address(dest_ip))
+    sckt.send_multipart([trigger.SerializeToString()] + frames, copy=False)
+
+
+# If memo_cache is given and fname was registered as deterministic, a result
+# memoized for the same arguments is returned without running func. If
+# profile_id is set, func runs under the profiler, and its profile is added to
+# that key.
+def _exec_func_normal(kvs, func, args, user_lib, object_cache=None,
+                      memo_cache=None, fname=None, profile_id=None):
     refs = list(filter(lambda a: isinstance(a, FluentReference), args))
 
+    kv_pairs = {}
     if refs:
-        refs = _resolve_ref_normal(refs, kvs)
-    end = time.time()
+        kv_pairs = _get_refs(refs, kvs)
+
+    memo_key = None
+    if memo_cache is not None:
+        memo_key = memo_cache.get_key(fname, args, kv_pairs)
+
+    if memo_key is not None:
+        found, res = memo_cache.get(memo_key)
+        if not found:
+            found, res = memo_cache.load(memo_key,
+                                         kvs.get(memo_key)[memo_key])
+
+        if found:
+            return res
+
+    if refs:
+        refs = _deserialize_refs(refs, kv_pairs, object_cache)
+
+    # execute the function
+    func_args = _get_func_args(args, refs, user_lib)
+    if profile_id is None:
+        res = func(*func_args)
+    else:
+        res, report = run_profiled(fname, func, func_args)
+        kvs.put(profile_id, get_profile_lattice(report))
+
+    # NB: this entry is never removed from the KVS; see MEMO_KEY_PREFIX
+    if memo_key is not None:
+        kvs.put(memo_key, memo_cache.dump(memo_key, fname, res))
 
-    func_args = (user_lib,)
+    return res
+
+
+# Substitutes each FluentReference in args with its resolved value, and
+# prepends the user library, which is every function's first argument.
+def _get_func_args(args, ref_values, user_lib):
+    return (user_lib,) + _substitute_refs(args, ref_values)
+
+
+def _substitute_refs(args, ref_values):
+    func_args = ()
     for arg in args:
         if isinstance(arg, FluentReference):
-            func_args += (refs[arg.key],)
+            func_args += (ref_values[arg.key],)
         else:
             func_args += (arg,)
 
-    # execute the function
-    res = func(*func_args)
-    return res
+    return func_args
 
 
-def _resolve_ref_normal(refs, kvs):
-    start = time.time()
+def _resolve_ref_normal(refs, kvs, object_cache=None):
+    return _deserialize_refs(refs, _get_refs(refs, kvs), object_cache)
+
+
+# Returns the (serialized) lattices of all of refs.
+def _get_refs(refs, kvs):
     keys = [ref.key for ref in refs]
     keys = list(set(keys))
+
+    # when chaining function executions, we must wait for the upstream
+    # function to write its result
+    return wait_for(lambda: _get_all(kvs, keys), keys, REF_WAIT_TIMEOUT)
+
+
+# Returns the values of all of keys, or None if any of them is missing.
+def _get_all(kvs, keys):
+    start = time.time()
     kv_pairs = kvs.get(keys)
+    KVS_GET_SECONDS.observe(time.time() - start)
 
-    # when chaining function executions, we must wait
-    num_nulls = len(list(filter(lambda a: not a, kv_pairs.values())))
-    while num_nulls > 0:
-        kv_pairs = kvs.get(keys)
+    if any(not val for val in kv_pairs.values()):
+        return None
 
+    return kv_pairs
+
+
+def _deserialize_refs(refs, kv_pairs, object_cache=None):
     for ref in refs:
         if ref.deserialize and isinstance(kv_pairs[ref.key], LWWPairLattice):
-            kv_pairs[ref.key] = deserialize_val(kv_pairs[ref.key].reveal()[1])
+            ts, payload = kv_pairs[ref.key].reveal()
+
+            value = None
+            if object_cache is not None:
+                value = object_cache.get(ref.key, ts)
+
+            if value is None:
+                value = deserialize_val(payload)
+
+                if object_cache is not None:
+                    value = object_cache.put(ref.key, ts, value, len(payload))
+
+            kv_pairs[ref.key] = value
 
-    end = time.time()
     return kv_pairs
 
 
-def _exec_dag_function_causal(pusher_cache, kvs, triggers, function, schedule):
-    fname = schedule.target_function
-    fargs = list(schedule.arguments[fname].args)
+def _exec_dag_function_causal(pusher_cache, kvs, triggers, function, schedule,
+                              payloads=None):
+    fargs, dependencies, versioned_key_locations = _get_causal_dag_args(
+        schedule, triggers, payloads)
+
+    kv_pairs = {}
+    result, versioned_key_locations = _exec_func_causal(
+        kvs, function, fargs, kv_pairs, schedule, versioned_key_locations)
+
+    dependencies = causal.merge_dependencies([
+        dependencies.items(),
+        [(key, dict(kv_pairs[key][0])) for key in kv_pairs]])
+
+    if _forward_causal_result(pusher_cache, schedule, result, dependencies,
+                              versioned_key_locations):
+        vector_clock = _get_causal_sink_clock(schedule, dependencies)
+
+        result = serialize_val(result)
+        wait_for(lambda: kvs.causal_put(schedule.response_id, vector_clock,
+                                        dependencies, result, schedule.id),
+                 schedule.response_id)
+
 
-    versioned_key_locations = None
-    dependencies = {}
+# Returns the deserialized arguments of a causal DAG function, along with the
+# dependencies and versioned key locations of all of its triggers.
+def _get_causal_dag_args(schedule, triggers, payloads=None):
+    fname = schedule.target_function
+    fargs = _process_args(schedule.arguments[fname].args)
 
+    trigger_metadata = []
     for trname in schedule.triggers:
         trigger = triggers[trname]
-        fargs += list(trigger.arguments.args)
-        # combine versioned_key_locations
-        if versioned_key_locations is None:
-            versioned_key_locations = trigger.versioned_key_locations
-        else:
-            for addr in trigger.versioned_key_locations:
-                versioned_key_locations[addr].versioned_keys.extend(
-                        trigger.versioned_key_locations[addr].versioned_keys)
-        # combine dependencies from previous func
-        for dep in trigger.dependencies:
-            if dep.key in dependencies:
-                dependencies[dep.key] = _merge_vector_clock(
-                      dependencies[dep.key], dep.vector_clock)
-            else:
-                dependencies[dep.key] = dep.vector_clock
-
-    fargs = _process_args(fargs)
+        fargs += _process_args(trigger.arguments.args,
+                               _get_trigger_frames(payloads, trname))
+        trigger_metadata.append(causal.read_trigger_metadata(trigger))
 
-    kv_pairs = {}
-    result = _exec_func_causal(kvs, function, fargs, kv_pairs,
-                               schedule, versioned_key_locations)
+    # the metadata of all of the triggers is merged in one pass
+    dependencies = causal.merge_dependencies(deps for deps, _ in
+                                             trigger_metadata)
+    versioned_key_locations = causal.merge_versioned_key_locations(
+        locations for _, locations in trigger_metadata)
 
-    for key in kv_pairs:
-        if key in dependencies:
-            dependencies[key] = _merge_vector_clock(dependencies[key],
-                                                    kv_pairs[key][0])
-        else:
-            dependencies[key] = kv_pairs[key][0]
+    return fargs, dependencies, versioned_key_locations
 
-    is_sink = True
-    for conn in schedule.dag.connections:
-        if conn.source == fname:
-            is_sink = False
-            new_trigger = DagTrigger()
-            new_trigger.id = trigger.id
-            new_trigger.target_function = conn.sink
-            new_trigger.source = fname
 
-            if type(result) != tuple:
-                result = (result,)
+# Sends the result of a causal DAG function to each of its successors, along
+# with the causal metadata they need. Returns True if the function is the sink
+# of the DAG.
+def _forward_causal_result(pusher_cache, schedule, result, dependencies,
+                           versioned_key_locations):
+    fname = schedule.target_function
 
-            al = new_trigger.arguments
-            al.args.extend(list(map(lambda v: serialize_val(v, None, False),
-                                    result)))
+    # the result is serialized once, and shared by all of the successors
+    if type(result) != tuple:
+        args, frames = _serialize_trigger_args((result,))
+    else:
+        args, frames = _serialize_trigger_args(result)
 
-            new_trigger.versioned_key_locations = versioned_key_locations
+    # as is the causal metadata
+    metadata = DagTrigger()
+    causal.write_trigger_metadata(metadata, dependencies,
+                                  versioned_key_locations)
 
-            for key in dependencies:
-                dep = new_trigger.dependencies.add()
-                dep.key = key
-                dep.vector_clock = dependencies[key]
+    successors = sutils._get_dag_index(schedule.dag).successors[fname]
+    for sink in successors:
+        new_trigger = DagTrigger()
+        new_trigger.id = schedule.id
+        new_trigger.target_function = sink
+        new_trigger.source = fname
 
-            dest_ip = schedule.locations[conn.sink]
-            sckt = pusher_cache.get(sutils._get_dag_trigger_address(dest_ip))
-            sckt.send(new_trigger.SerializeToString())
+        new_trigger.arguments.args.extend(args)
+        new_trigger.MergeFrom(metadata)
 
-    if is_sink:
-        vector_clock = {}
-        if schedule.response_id in dependencies:
-            if schedule.id in dependencies[schedule.response_id]:
-                dependencies[schedule.response_id][schedule.id] += 1
-            else:
-                dependencies[schedule.response_id][schedule.id] = 1
-            vector_clock = dependencies[schedule.response_id][schedule.id]
-            del dependencies[schedule.response_id]
-        else:
-            vector_clock = {schedule.id: 1}
+        dest_ip = schedule.locations[sink]
+        _send_trigger(pusher_cache, dest_ip, new_trigger, frames)
 
-        succeed = kvs.causal_put(schedule.response_id,
-                                 vector_clock, dependencies,
-                                 serialize_val(result), schedule.id)
-        while not succeed:
-            kvs.causal_put(schedule.response_id, vector_clock,
-                           dependencies, serialize_val(result), schedule.id)
+    return len(successors) == 0
 
 
+# Returns the vector clock to write the result of a causal DAG under; the
+# result's own key is removed from dependencies.
+def _get_causal_sink_clock(schedule, dependencies):
+    vector_clock = dependencies.pop(schedule.response_id, {})
+    vector_clock[schedule.id] = vector_clock.get(schedule.id, 0) + 1
+
+    return vector_clock
+
+
+# Returns the function's result and the versioned key locations, including
+# the versions of the keys read here.
 def _exec_func_causal(kvs, func, args, kv_pairs,
                       schedule, versioned_key_locations):
-    func_args = ()
-    to_resolve = []
-    deserialize = {}
-
     # resolve any references to KVS objects
-    key_index_map = {}
-    for i, arg in enumerate(args):
-        if isinstance(arg, FluentReference):
-            to_resolve.append(arg)
-            key_index_map[arg.key] = i
-            deserialize[arg.key] = arg.deserialize
-        func_args += (arg,)
-
-    if len(to_resolve) > 0:
-        _resolve_ref_causal(to_resolve, kvs, kv_pairs,
-                            schedule, versioned_key_locations)
-
-        for key in kv_pairs:
-            if deserialize[key]:
-                func_args[key_index_map[key]] = \
-                                deserialize_val(kv_pairs[key][1])
-            else:
-                func_args[key_index_map[key]] = kv_pairs[key][1]
+    refs = [arg for arg in args if isinstance(arg, FluentReference)]
+    if len(refs) > 0:
+        versioned_key_locations = _resolve_ref_causal(
+            refs, kvs, kv_pairs, schedule, versioned_key_locations)
 
     # execute the function
-    return func(*func_args)
+    return func(*_get_causal_func_args(args, kv_pairs)), \
+        versioned_key_locations
+
+
+# Substitutes each FluentReference in args with the value that was read for
+# it into kv_pairs.
+def _get_causal_func_args(args, kv_pairs):
+    func_args = []
+    for arg in args:
+        if isinstance(arg, FluentReference):
+            value = kv_pairs[arg.key][1]
+            if arg.deserialize:
+                value = deserialize_val(value)
+
+            func_args.append(value)
+        else:
+            func_args.append(arg)
+
+    return func_args
 
 
 def _resolve_ref_causal(refs, kvs, kv_pairs, schedule,
                         versioned_key_locations):
+    keys, future_read_set, vk_lists = _get_causal_request(
+        refs, schedule, versioned_key_locations)
+    result = wait_for(lambda: kvs.causal_get(keys, future_read_set,
+                                             vk_lists,
+                                             schedule.consistency,
+                                             schedule.id), keys)
+
+    return _add_causal_response(result, kv_pairs, versioned_key_locations)
+
+
+# Returns the keys, future read set, and versioned key lists to read refs
+# with.
+def _get_causal_request(refs, schedule, versioned_key_locations):
     future_read_set = _compute_children_read_set(schedule)
     keys = [ref.key for ref in refs]
-    result = kvs.causal_get(keys, future_read_set,
-                            versioned_key_locations,
-                            schedule.consistency, schedule.id)
+    vk_lists = causal.get_versioned_key_lists(versioned_key_locations)
+
+    return keys, future_read_set, vk_lists
 
-    while not result:
-        result = kvs.causal_get(refs, future_read_set,
-                                versioned_key_locations,
-                                schedule.consistency, schedule.id)
+
+# Adds the values in the result of a causal_get to kv_pairs, and returns the
+# versioned key locations, including those of the keys that were read.
+def _add_causal_response(result, kv_pairs, versioned_key_locations):
+    kv_pairs.update(result[1])
 
     if result[0] is not None:
-        versioned_key_locations[result[0][0]] = list(result[0][1])
+        addr, versioned_keys = result[0]
+        versioned_key_locations = causal.merge_versioned_key_locations([
+            versioned_key_locations,
+            {addr: [(vk.key, dict(vk.vector_clock)) for vk in
+                    versioned_keys]}])
 
-    kv_pairs = result[1]
+    return versioned_key_locations
 
 
 def _compute_children_read_set(schedule):
     future_read_set = set()
     fname = schedule.target_function
-    children = set()
-    delta = set(fname)
-
-    while not len(delta) == 0:
-        new_delta = set()
-        for conn in schedule.dag.connections:
-            if conn.source in delta and conn.sink not in children:
-                children.add(conn.sink)
-                new_delta.add(conn.sink)
-        delta = new_delta
+    children = sutils._get_dag_index(schedule.dag).descendants[fname]
 
     for child in children:
-        fargs = list(schedule.arguments[child].args)
-        refs = list(filter(lambda arg: type(arg) == FluentReference,
-                    map(lambda arg: get_serializer(arg.type).load(arg.body),
-                        fargs)))
-        (future_read_set.add(ref.key) for ref in refs)
+        refs = sutils._get_references(schedule.arguments[child].args)
+        future_read_set.update(ref.key for ref in refs)
 
     return future_read_set
-
-
-def _merge_vector_clock(lhs, rhs):
-    result = lhs
-    for cid in rhs:
-        if cid not in result:
-            result[cid] = rhs[cid]
-        else:
-            result[cid] = max(result[cid], rhs[cid])
-    return result
@@ -0,0 +1,181 @@
+#  Copyright 2018 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from include.functions_pb2 import *
+
+# The causal metadata of a DAG request is made up of its dependencies, which
+# map each key read so far to the vector clock of the version that was read,
+# and its versioned key locations, which map each cache's address to the
+# (key, vector clock) pairs of the versions that cache holds for the request.
+# Vector clocks are dicts from client IDs to counters.
+#
+# Every stage merges the metadata of all of its triggers, so rather than
+# growing with the depth of the DAG, the merged metadata only keeps the
+# versions that are not dominated by another version of the same key. Vector
+# clocks of different keys are not comparable, so the metadata stays bounded
+# by the size of the request's read set.
+
+
+# Returns True if lhs has seen every update that rhs has.
+def dominates(lhs, rhs):
+    for cid in rhs:
+        if lhs.get(cid, 0) < rhs[cid]:
+            return False
+
+    return True
+
+
+def merge_vector_clocks(clocks):
+    result = {}
+    for clock in clocks:
+        for cid in clock:
+            if clock[cid] > result.get(cid, 0):
+                result[cid] = clock[cid]
+
+    return result
+
+
+# Merges lists of (key, vector clock) dependencies into a dict with a single
+# vector clock per key.
+def merge_dependencies(dependency_lists):
+    clocks = {}
+    for dependencies in dependency_lists:
+        for key, clock in dependencies:
+            if key not in clocks:
+                clocks[key] = []
+            clocks[key].append(clock)
+
+    return {key: merge_vector_clocks(clocks[key]) for key in clocks}
+
+
+# Merges dicts of versioned key locations, dropping each version that another
+# version of the same key at the same cache dominates.
+def merge_versioned_key_locations(location_maps):
+    merged = {}
+    for locations in location_maps:
+        for addr in locations:
+            if addr not in merged:
+                merged[addr] = {}
+
+            for key, clock in locations[addr]:
+                if key not in merged[addr]:
+                    merged[addr][key] = []
+                merged[addr][key].append(clock)
+
+    result = {}
+    for addr in merged:
+        result[addr] = []
+        for key in merged[addr]:
+            for clock in _get_maximal_clocks(merged[addr][key]):
+                result[addr].append((key, clock))
+
+    return result
+
+
+# Returns the versioned key locations in the form the KVS client expects.
+def get_versioned_key_lists(versioned_key_locations):
+    result = {}
+    for addr in versioned_key_locations:
+        vk_list = VersionedKeyList()
+        for key, clock in versioned_key_locations[addr]:
+            vk = vk_list.versioned_keys.add()
+            vk.key = key
+            vk.vector_clock.update(clock)
+
+        result[addr] = vk_list
+
+    return result
+
+
+# Returns a trigger's dependencies, as a list of (key, vector clock) pairs,
+# and its versioned key locations. Both the compact and the plain encodings
+# are read.
+def read_trigger_metadata(trigger):
+    dependencies = []
+    for vk in trigger.dependencies:
+        dependencies.append((vk.key, dict(vk.vector_clock)))
+
+    for cvk in trigger.compact_dependencies:
+        dependencies.append(_decode_versioned_key(cvk, trigger.client_ids))
+
+    locations = {}
+    for addr in trigger.versioned_key_locations:
+        locations[addr] = [(vk.key, dict(vk.vector_clock)) for vk in
+                           trigger.versioned_key_locations[addr]
+                           .versioned_keys]
+
+    for addr in trigger.compact_versioned_key_locations:
+        if addr not in locations:
+            locations[addr] = []
+
+        for cvk in trigger.compact_versioned_key_locations[addr] \
+                .versioned_keys:
+            locations[addr].append(_decode_versioned_key(cvk,
+                                                         trigger.client_ids))
+
+    return dependencies, locations
+
+
+# Writes the compact encoding of the metadata into trigger, which can then be
+# merged into the trigger for each successor.
+def write_trigger_metadata(trigger, dependencies, versioned_key_locations):
+    client_ids = {}
+
+    for key in dependencies:
+        _encode_versioned_key(trigger.compact_dependencies.add(), key,
+                              dependencies[key], client_ids)
+
+    for addr in versioned_key_locations:
+        vk_list = trigger.compact_versioned_key_locations[addr]
+        for key, clock in versioned_key_locations[addr]:
+            _encode_versioned_key(vk_list.versioned_keys.add(), key, clock,
+                                  client_ids)
+
+    trigger.client_ids.extend(sorted(client_ids, key=client_ids.get))
+
+
+def _get_maximal_clocks(clocks):
+    # a clock can only be dominated by one with a larger total, so looking
+    # at the largest first means each clock is only compared to kept ones
+    result = []
+    for clock in sorted(clocks, key=lambda clock: -sum(clock.values())):
+        if not any(dominates(kept, clock) for kept in result):
+            result.append(clock)
+
+    return result
+
+
+def _encode_versioned_key(cvk, key, clock, client_ids):
+    cvk.key = key
+
+    for cid in clock:
+        if cid not in client_ids:
+            client_ids[cid] = len(client_ids)
+
+    prev = 0
+    for index, cid in sorted((client_ids[cid], cid) for cid in clock):
+        cvk.client_deltas.append(index - prev)
+        cvk.counts.append(clock[cid])
+        prev = index
+
+
+def _decode_versioned_key(cvk, client_ids):
+    clock = {}
+
+    index = 0
+    for delta, count in zip(cvk.client_deltas, cvk.counts):
+        index += delta
+        clock[client_ids[index]] = count
+
+    return cvk.key, clock
@@ -0,0 +1,514 @@
+#  Copyright 2018 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import logging
+import time
+import zmq
+
+from include.functions_pb2 import *
+from include.metrics import start_metrics_server
+from include import metrics
+from include import server_utils as sutils
+from .batch import count_batched, get_batch_timeout, poll_batches
+from .cache import FunctionCache, ObjectCache
+from .memo import MemoCache
+from .pending import PendingTable, report_pending_failure
+from .pin import pin, release_unpinned, reject_unpinned, unpin
+from .shm import SharedMemoryStore
+from .status import StatusPublisher
+from . import utils
+
+REPORT_THRESH = 5
+
+
+class Runner():
+    # Runs the invocations an ExecutorLoop hands it: inline, in a pool of
+    # worker processes, or as asyncio tasks. attach() is called once, before
+    # anything else, and the runner calls ExecutorLoop.finish() for every
+    # invocation it has run.
+    def attach(self, executor):
+        self.executor = executor
+
+    # Runs a function call; serialized is a FunctionCall.
+    def run_function(self, serialized):
+        raise NotImplementedError
+
+    # Runs a ready DAG invocation, or a batch of them, of a pinned function.
+    def run_dag(self, invocation):
+        raise NotImplementedError
+
+    def run_batch(self, fname, batch):
+        raise NotImplementedError
+
+    # Handles pin and unpin requests; msg is the body of a pin request.
+    def pin(self, msg):
+        self.executor.pin_function(msg)
+
+    def unpin(self, name):
+        self.executor.unpin_function(name)
+
+    # Whether any invocations of fname, or any invocations at all, are still
+    # running.
+    def has_tasks(self, fname):
+        return False
+
+    def busy(self):
+        return False
+
+    # Called after every poll with the sockets that are ready.
+    def poll(self, socks):
+        pass
+
+    # Called once an unpinned function has drained.
+    def release(self, fname):
+        pass
+
+    # Returns the thread's utilization over the last period seconds, and the
+    # share of it that each function accounts for.
+    def utilization(self, period):
+        executor = self.executor
+        function_utilization = {}
+        for fname in executor.function_occupancy:
+            function_utilization[fname] = \
+                executor.function_occupancy[fname] / period
+
+        return executor.total_occupancy / period, function_utilization
+
+    # Adds the runner's own statistics to stats (an ExecutorStatistics).
+    def report(self, stats):
+        pass
+
+    # The number of invocations the runner holds, by queue name.
+    def queue_depth(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+class ExecutorLoop():
+    # The state of an executor thread, and its handling of every message it
+    # receives; where invocations run is up to its runner. The thread's main
+    # loop polls self.sockets, passes every message it receives to handle(),
+    # and calls step() after each poll.
+    #
+    # ctx creates the sockets we receive on, and kvs is used for pinning and
+    # to report failed invocations; the runner may use clients of its own.
+    def __init__(self, ip, mgmt_ip, schedulers, thread_id, pin_capacity, ctx,
+                 pusher_cache, kvs, user_lib, runner):
+        self.ip = ip
+        self.mgmt_ip = mgmt_ip
+        self.schedulers = schedulers
+        self.thread_id = thread_id
+
+        pin_socket = ctx.socket(zmq.PULL)
+        pin_socket.bind(sutils.BIND_ADDR_TEMPLATE % (sutils.PIN_PORT +
+                                                     thread_id))
+
+        unpin_socket = ctx.socket(zmq.PULL)
+        unpin_socket.bind(sutils.BIND_ADDR_TEMPLATE % (sutils.UNPIN_PORT +
+                                                       thread_id))
+
+        exec_socket = ctx.socket(zmq.PULL)
+        exec_socket.bind(sutils.BIND_ADDR_TEMPLATE % (sutils.FUNC_EXEC_PORT +
+                                                      thread_id))
+
+        dag_queue_socket = ctx.socket(zmq.PULL)
+        dag_queue_socket.bind(sutils.BIND_ADDR_TEMPLATE %
+                              (sutils.DAG_QUEUE_PORT + thread_id))
+
+        dag_exec_socket = ctx.socket(zmq.PULL)
+        dag_exec_socket.bind(sutils.BIND_ADDR_TEMPLATE %
+                             (sutils.DAG_EXEC_PORT + thread_id))
+
+        self_depart_socket = ctx.socket(zmq.PULL)
+        self_depart_socket.bind(sutils.BIND_ADDR_TEMPLATE %
+                                (sutils.SELF_DEPART_PORT + thread_id))
+
+        # the sockets to poll, in the order their messages are handled, and
+        # the event each one's messages are counted under, if any
+        self.sockets = [pin_socket, unpin_socket, exec_socket,
+                        dag_queue_socket, dag_exec_socket, self_depart_socket]
+        self.handlers = {
+            pin_socket: ('pin', self._handle_pin),
+            unpin_socket: ('unpin', self._handle_unpin),
+            exec_socket: ('func_exec', self._handle_call),
+            dag_queue_socket: ('dag_queue', self._handle_schedule),
+            dag_exec_socket: ('dag_exec', self._handle_trigger),
+            self_depart_socket: (None, self._handle_depart)
+        }
+
+        self.pusher_cache = pusher_cache
+        self.kvs = kvs
+
+        # the user library (and its message inbox) lives as long as this
+        # thread
+        self.user_lib = user_lib
+
+        self.status = ThreadStatus()
+        self.status.ip = ip
+        self.status.tid = thread_id
+        self.status.running = True
+        self.status.capacity = pin_capacity
+
+        # status changes are coalesced and sent to the schedulers as deltas
+        self.publisher = StatusPublisher(schedulers, pusher_cache,
+                                         self.status)
+        self.publisher.publish_full()
+
+        self.departing = False
+
+        # the DAG invocations that are still waiting for their schedule or
+        # for some of their triggers
+        self.pending = PendingTable()
+
+        # track the actual function objects that we are storing here
+        self.pinned_functions = {}
+
+        # functions we were asked to unpin that still have invocations to
+        # run, and when we were asked to
+        self.unpinned = {}
+
+        # ready invocations of pinned functions that accept batches, waiting
+        # for their batch to fill up
+        self.batch_queues = {}
+
+        # deserialized functions, keyed by name and the version they were
+        # loaded from, so that we do not unpickle a function on every call
+        self.function_cache = FunctionCache()
+
+        # deserialized FluentReference arguments, keyed by KVS key and version
+        self.object_cache = ObjectCache()
+
+        # results of deterministic functions, keyed by function and arguments
+        self.memo_cache = MemoCache()
+
+        # large results for DAG functions on this node are passed through
+        # shared memory rather than sent over a socket
+        self.shm_store = SharedMemoryStore(ip)
+
+        # tracks runtime cost of excuting a DAG function
+        self.runtimes = {}
+
+        # track how many functions we're executing
+        self.exec_counts = {}
+
+        # the metrics served on this thread's metrics endpoint
+        start_metrics_server(sutils.METRICS_PORT + thread_id)
+        self.event_seconds = metrics.counter(
+            'fluent_executor_event_seconds_total',
+            'Time spent handling each type of event.', ['event'])
+        self.function_latency = metrics.histogram(
+            'fluent_executor_function_latency_seconds',
+            'End-to-end latency of DAG function invocations.', ['function'])
+        self.queue_depth = metrics.gauge(
+            'fluent_executor_queue_depth',
+            'Invocations waiting or running, by queue.', ['queue'])
+        self.pending_bytes = metrics.gauge(
+            'fluent_executor_pending_bytes',
+            'Bytes of schedules and triggers held for pending invocations.')
+        self.utilization_gauge = metrics.gauge(
+            'fluent_executor_utilization',
+            'Thread utilization in the last report period.')
+        self.socket_cache_size = metrics.gauge(
+            'fluent_socket_cache_size', 'Sockets in the push socket cache.')
+
+        # metadata to track thread utilization
+        self.report_start = time.time()
+        self.event_occupancy = {'pin': 0.0,
+                                'unpin': 0.0,
+                                'func_exec': 0.0,
+                                'dag_queue': 0.0,
+                                'dag_exec': 0.0}
+        self.total_occupancy = 0.0
+
+        # how long each pinned function has run for since the last report
+        self.function_occupancy = {}
+
+        self.runner = runner
+        runner.attach(self)
+
+    # How long (in ms) the main loop can block in its next poll.
+    def timeout(self):
+        return get_batch_timeout(self.batch_queues,
+                                 self.publisher.timeout(1000))
+
+    # Handles a message (a list of frames) that arrived on sckt.
+    def handle(self, sckt, frames):
+        event, handler = self.handlers[sckt]
+
+        work_start = time.time()
+        handler(frames)
+
+        if event is not None:
+            self.add_occupancy(event, time.time() - work_start)
+
+    def add_occupancy(self, event, elapsed):
+        self.event_occupancy[event] += elapsed
+        self.total_occupancy += elapsed
+
+    # Records that a runner finished invocations of fname (None for a
+    # function call), which ran for elapsed seconds; receive_times are the
+    # times the invocations were received.
+    def finish(self, fname, elapsed, receive_times=()):
+        if fname is not None:
+            if fname not in self.function_occupancy:
+                self.function_occupancy[fname] = 0.0
+            self.function_occupancy[fname] += elapsed
+
+        if fname in self.runtimes:
+            now = time.time()
+            for receive_time in receive_times:
+                self.runtimes[fname] += now - receive_time
+                self.function_latency.labels(fname).observe(now -
+                                                            receive_time)
+            self.exec_counts[fname] += len(receive_times)
+
+        self.publisher.update(served=True)
+
+    def pin_function(self, msg):
+        pin(msg, self.pusher_cache, self.kvs, self.status,
+            self.pinned_functions, self.runtimes, self.exec_counts,
+            self.function_cache, self.batch_queues, self.unpinned,
+            self.memo_cache)
+        self.publisher.update()
+
+    def unpin_function(self, name):
+        unpin(name, self.status, self.unpinned)
+        self.publisher.update()
+
+    # Whether a function still has invocations waiting or running here.
+    def is_busy(self, fname):
+        return self.pending.count(fname) > 0 or \
+            len(self.batch_queues.get(fname, ())) > 0 or \
+            self.runner.has_tasks(fname)
+
+    # Invocations of functions that accept batches wait in their batch queue
+    # (causal invocations are never batched); everything else goes to the
+    # runner right away.
+    def dispatch(self, invocation):
+        fname = invocation.fname
+        if fname not in self.pinned_functions:
+            reject_unpinned(self.pusher_cache, self.kvs, invocation)
+        elif fname in self.batch_queues and \
+                invocation.schedule.consistency == NORMAL:
+            batch = self.batch_queues[fname].add(invocation)
+            if batch:
+                self.runner.run_batch(fname, batch)
+        else:
+            self.runner.run_dag(invocation)
+
+    def _handle_pin(self, frames):
+        self.runner.pin(frames[0].bytes.decode())
+
+    def _handle_unpin(self, frames):
+        self.runner.unpin(frames[0].bytes.decode())
+
+    def _handle_call(self, frames):
+        self.runner.run_function(frames[0].bytes)
+
+    def _handle_schedule(self, frames):
+        msg = frames[0].bytes
+        schedule = DagSchedule()
+        schedule.ParseFromString(msg)
+
+        logging.info('Received a schedule for DAG %s (%s), function %s.' %
+                     (schedule.dag.name, schedule.id,
+                      schedule.target_function))
+
+        # in case we receive the trigger before we receive the schedule, we
+        # can trigger from this operation as well
+        invocation = self.pending.add_schedule(schedule, len(msg))
+        if invocation:
+            self.dispatch(invocation)
+
+    def _handle_trigger(self, frames):
+        # large arguments arrive as separate frames after the trigger, which
+        # we keep as buffers rather than copying them
+        trigger = DagTrigger()
+        trigger.ParseFromString(frames[0].bytes)
+        payloads = [frame.buffer for frame in frames[1:]]
+        size = sum(len(frame.buffer) for frame in frames)
+
+        logging.info('Received a trigger for schedule %s, function %s.' %
+                     (trigger.id, trigger.target_function))
+
+        invocation = self.pending.add_trigger(trigger, size, payloads)
+        if invocation:
+            self.dispatch(invocation)
+
+    def _handle_depart(self, frames):
+        # This message should not matter
+        logging.info('Preparing to depart. No longer accepting requests ' +
+                     'and clearing all queues.')
+
+        self.status.ClearField('functions')
+        self.status.running = False
+        self.publisher.publish_full()
+
+        self.departing = True
+
+    # Does the work that is due after a poll; socks are the sockets that were
+    # ready. Returns True once the thread has departed, and should exit.
+    def step(self, socks):
+        self.runner.poll(socks)
+
+        # run any batches that have waited long enough to fill up
+        work_start = time.time()
+        for fname, batch in poll_batches(self.batch_queues):
+            self.runner.run_batch(fname, batch)
+        self.add_occupancy('dag_exec', time.time() - work_start)
+
+        self.shm_store.expire()
+
+        # fail any invocations whose inputs did not all arrive in time, or
+        # that did not fit in the pending table
+        self.pending.expire()
+        for invocation, error in self.pending.remove_failed():
+            report_pending_failure(self.pusher_cache, self.kvs, invocation,
+                                   error)
+
+        # free the functions we were asked to unpin once they have drained
+        released = release_unpinned(self.unpinned, self.pinned_functions,
+                                    self.runtimes, self.exec_counts,
+                                    self.batch_queues, self.function_cache,
+                                    self.memo_cache, self.is_busy)
+        for fname in released:
+            self.runner.release(fname)
+
+        # let the schedulers and the management server know the drain is done
+        if released:
+            self.publisher.publish_full()
+
+            sckt = self.pusher_cache.get(utils._get_util_report_address(
+                self.mgmt_ip))
+            sckt.send(self.status.SerializeToString())
+
+        # send any status changes that were held back by rate limiting
+        self.publisher.flush()
+
+        self.queue_depth.labels('pending').set(len(self.pending))
+        self.queue_depth.labels('batched').set(
+            count_batched(self.batch_queues))
+        runner_depth = self.runner.queue_depth()
+        for queue in runner_depth:
+            self.queue_depth.labels(queue).set(runner_depth[queue])
+        self.pending_bytes.set(self.pending.size)
+        self.socket_cache_size.set(len(self.pusher_cache))
+
+        # periodically report function occupancy
+        if time.time() - self.report_start > REPORT_THRESH:
+            self._report()
+
+            # if we are departing and have cleared our queues, let the
+            # management server know, and exit the process
+            if self.departing and len(self.pending) == 0 and \
+                    count_batched(self.batch_queues) == 0 and \
+                    not self.runner.busy():
+                self._depart()
+                return True
+
+        return False
+
+    def _report(self):
+        # periodically report my full status to schedulers, which lets them
+        # recover from any deltas they missed
+        self.publisher.publish_full()
+
+        period = time.time() - self.report_start
+        utilization, function_utilization = self.runner.utilization(period)
+        self.status.utilization = utilization
+        self.utilization_gauge.set(utilization)
+
+        utils._set_function_utilization(self.status, function_utilization)
+        self.function_occupancy.clear()
+
+        if utilization > 0.5:
+            msg = self.ip + ':' + str(self.thread_id)
+            for scheduler in self.schedulers:
+                sckt = self.pusher_cache.get(sutils._get_backoff_addresss
+                                             (scheduler))
+                sckt.send_string(msg)
+
+        sckt = self.pusher_cache.get(utils._get_util_report_address(
+            self.mgmt_ip))
+        sckt.send(self.status.SerializeToString())
+
+        logging.info('Total thread occupancy: %.6f' % (utilization))
+        logging.info('Pending invocations: %d (%d bytes), %d expired, %d '
+                     'dropped.' % (len(self.pending), self.pending.size,
+                                   self.pending.expired,
+                                   self.pending.dropped))
+
+        runner_depth = self.runner.queue_depth()
+        for queue in runner_depth:
+            logging.info('Invocations in %s: %d' % (queue,
+                                                    runner_depth[queue]))
+
+        for event in self.event_occupancy:
+            occ = self.event_occupancy[event] / period
+            logging.info('Event %s occupancy: %.6f' % (event, occ))
+            self.event_seconds.labels(event).inc(self.event_occupancy[event])
+            self.event_occupancy[event] = 0.0
+
+        stats = ExecutorStatistics()
+        for fname in self.runtimes:
+            if self.exec_counts[fname] > 0:
+                fstats = stats.statistics.add()
+                fstats.fname = fname
+                fstats.runtime = self.runtimes[fname]
+                fstats.call_count = self.exec_counts[fname]
+
+            self.runtimes[fname] = 0.0
+            self.exec_counts[fname] = 0
+
+        stats.function_cache_hits = self.function_cache.hits
+        stats.function_cache_misses = self.function_cache.misses
+        self.function_cache.reset_stats()
+
+        stats.object_cache_hits = self.object_cache.hits
+        stats.object_cache_misses = self.object_cache.misses
+        stats.object_cache_bytes_saved = self.object_cache.bytes_saved
+        self.object_cache.reset_stats()
+
+        stats.pending_invocations = len(self.pending)
+        stats.pending_bytes = self.pending.size
+        stats.pending_expired = self.pending.expired
+        stats.pending_dropped = self.pending.dropped
+        self.pending.reset_stats()
+
+        stats.memo_hits = self.memo_cache.hits
+        stats.memo_misses = self.memo_cache.misses
+        self.memo_cache.reset_stats()
+
+        self.runner.report(stats)
+
+        sckt = self.pusher_cache.get(sutils._get_statistics_report_address
+                                     (self.mgmt_ip))
+        sckt.send(stats.SerializeToString())
+
+        self.report_start = time.time()
+        self.total_occupancy = 0.0
+
+    def _depart(self):
+        sckt = self.pusher_cache.get(utils._get_depart_done_addr(
+            self.mgmt_ip))
+        sckt.send_string(self.ip)
+
+        for fname in self.pinned_functions:
+            utils._destroy_instance(self.pinned_functions[fname])
+
+        self.user_lib.close()
+        self.shm_store.close()
+        self.runner.close()
@@ -0,0 +1,228 @@
+#  Copyright 2018 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from collections import OrderedDict
+import hashlib
+import struct
+import time
+
+from anna.lattices import *
+import numpy as np
+from include.serializer import *
+from include.shared import *
+
+# the number of bytes of memoized results each executor thread keeps around
+MEMO_CACHE_SIZE = 64 * 1024 * 1024
+
+# memoized results are stored in the KVS under this prefix, followed by a hash
+# of the function and its arguments. The KVS has no deletes, so these entries
+# are never removed: an expired entry is ignored and overwritten by the next
+# call with the same arguments, but entries for arguments that are not seen
+# again, and for older versions of a function (whose version is part of the
+# key), stay around. The memo/ keys grow with the number of distinct calls.
+MEMO_KEY_PREFIX = 'memo/'
+
+
+class MemoCache():
+    # Results of functions registered as deterministic, keyed by a hash of the
+    # function's name and version and of the call's arguments. Results are
+    # shared with every executor through the KVS, where each entry carries
+    # the time it expires at; this thread keeps a size-bounded LRU of the
+    # results it has seen, so a repeated call does not go to the KVS at all.
+    def __init__(self, capacity=MEMO_CACHE_SIZE):
+        self.capacity = capacity
+        self.size = 0
+        self._cache = OrderedDict()
+
+        # the version and TTL of each deterministic function we know of
+        self.functions = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    # Records whether the function (as of version) is deterministic, based on
+    # its registration metadata.
+    def add_function(self, name, version, metadata):
+        if metadata is not None and version is not None and \
+                metadata.deterministic:
+            self.functions[name] = (version, metadata.memo_ttl)
+        else:
+            self.functions.pop(name, None)
+
+    def remove_function(self, name):
+        self.functions.pop(name, None)
+
+    # Returns the memo key for a call of name with args, or None if the call
+    # cannot be memoized. kv_pairs holds the (not yet deserialized) lattices
+    # of args' FluentReferences, whose versions are part of the key.
+    def get_key(self, name, args, kv_pairs):
+        if name not in self.functions:
+            return None
+
+        version, _ = self.functions[name]
+
+        digest = hashlib.sha256()
+        digest.update(name.encode())
+        digest.update(str(version).encode())
+
+        for arg in args:
+            if isinstance(arg, FluentReference):
+                # a reference is identified by its key and the version of
+                # the value we read for it
+                latt = kv_pairs.get(arg.key)
+                if not isinstance(latt, LWWPairLattice):
+                    return None
+
+                digest.update(b'ref:' + arg.key.encode())
+                digest.update(str(latt.reveal()[0]).encode())
+            else:
+                # serialize_val's output is not canonical (equal values can
+                # pickle differently), so we hash an encoding of our own
+                encoded = _encode(arg)
+                if encoded is None:
+                    return None
+
+                digest.update(b'val:' + encoded)
+
+        return MEMO_KEY_PREFIX + digest.hexdigest()
+
+    # Both get and load return a (found, result) pair.
+    def get(self, key):
+        if key in self._cache:
+            expiry, result, size = self._cache[key]
+
+            if expiry > time.time():
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return True, result
+
+            self._evict(key)
+
+        return False, None
+
+    # Caches the result stored in the KVS lattice for key, if there is one
+    # and it has not expired.
+    def load(self, key, lattice):
+        if lattice is None:
+            self.misses += 1
+            return False, None
+
+        payload = lattice.reveal()[1]
+        expiry, result = deserialize_val(payload)
+
+        if expiry <= time.time():
+            self.misses += 1
+            return False, None
+
+        self.hits += 1
+        self._put(key, expiry, result, len(payload))
+        return True, result
+
+    # Caches the result of a call, and returns the lattice to store in the
+    # KVS for it.
+    def dump(self, key, name, result):
+        _, ttl = self.functions.get(name, (None, 0))
+        expiry = time.time() + ttl
+
+        payload = serialize_val((expiry, result))
+        self._put(key, expiry, result, len(payload))
+
+        return LWWPairLattice(generate_timestamp(0), payload)
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def _put(self, key, expiry, result, size):
+        if size > self.capacity:
+            return
+
+        if key in self._cache:
+            self._evict(key)
+
+        self._cache[key] = (expiry, result, size)
+        self.size += size
+
+        while self.size > self.capacity:
+            self._evict(next(iter(self._cache)))
+
+    def _evict(self, key):
+        self.size -= self._cache[key][2]
+        del self._cache[key]
+
+
+# Returns an encoding of val that is the same for equal values, or None if we
+# do not know how to encode its type, in which case the call is not memoized.
+# Every encoding starts with a tag for its type, and variable-length parts are
+# prefixed with their length, so different values never encode the same way.
+# Exact types are checked, since a subclass may compare differently.
+def _encode(val):
+    vtype = type(val)
+
+    if val is None:
+        return b'n'
+    elif vtype is bool:
+        return b't' if val else b'f'
+    elif vtype is int:
+        return b'i' + _encode_bytes(str(val).encode())
+    elif vtype is float:
+        return b'd' + struct.pack('<d', val)
+    elif vtype is str:
+        return b's' + _encode_bytes(val.encode())
+    elif vtype is bytes:
+        return b'b' + _encode_bytes(val)
+    elif vtype is np.ndarray:
+        if val.dtype.hasobject:
+            return None
+
+        return b'a' + _encode_bytes(val.dtype.str.encode()) + \
+            _encode_bytes(str(val.shape).encode()) + \
+            _encode_bytes(np.ascontiguousarray(val).tobytes())
+    elif isinstance(val, np.generic) and not val.dtype.hasobject:
+        return b'g' + _encode_bytes(val.dtype.str.encode()) + \
+            _encode_bytes(val.tobytes())
+
+    if vtype is tuple or vtype is list:
+        items = [_encode(item) for item in val]
+    elif vtype is set or vtype is frozenset:
+        # sets have no order of their own, so their elements are sorted by
+        # their encodings
+        items = [_encode(item) for item in val]
+        if None in items:
+            return None
+
+        items.sort()
+    elif vtype is dict:
+        items = []
+        for key in val:
+            encoded = _encode(key)
+            if encoded is None:
+                return None
+
+            items.append((encoded, _encode(val[key])))
+
+        items.sort(key=lambda item: item[0])
+        items = [item for pair in items for item in pair]
+    else:
+        return None
+
+    if None in items:
+        return None
+
+    tags = {tuple: b'T', list: b'L', set: b'S', frozenset: b'F', dict: b'D'}
+    return tags[vtype] + struct.pack('<Q', len(items)) + b''.join(items)
+
+
+def _encode_bytes(data):
+    return struct.pack('<Q', len(data)) + data
@@ -0,0 +1,179 @@
+#  Copyright 2018 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from collections import OrderedDict
+import logging
+import time
+
+from anna.lattices import *
+from include.functions_pb2 import *
+from include.serializer import *
+from include.shared import *
+from include import server_utils as sutils
+from .call import _send_dag_error
+
+# how long (in seconds) we hold on to a DAG invocation that is still missing
+# its schedule or some of its triggers
+PENDING_TTL = 30
+
+# the most DAG invocations, and the most bytes of schedules and triggers, each
+# executor thread holds on to; past this, the oldest invocations are dropped
+MAX_PENDING_ENTRIES = 10000
+MAX_PENDING_BYTES = 64 * 1024 * 1024
+
+
+class PendingInvocation():
+    def __init__(self, sid, fname):
+        self.id = sid
+        self.fname = fname
+
+        self.schedule = None
+        self.triggers = {}
+
+        # the payload frames that arrived with each trigger
+        self.payloads = {}
+
+        # when we heard about this invocation first, which is when its
+        # end-to-end latency starts
+        self.receive_time = time.time()
+        self.size = 0
+
+    def ready(self):
+        return self.schedule is not None and \
+            len(self.triggers) == len(self.schedule.triggers)
+
+
+class PendingTable():
+    # The DAG invocations this thread has received a schedule or triggers for,
+    # but cannot run yet. An invocation is handed back as soon as its schedule
+    # and all of its triggers have arrived. Invocations that are still
+    # incomplete after ttl seconds expire, and the oldest invocations are
+    # dropped whenever the table grows past max_entries or max_bytes; both
+    # are kept for the caller to collect with remove_failed().
+    def __init__(self, ttl=PENDING_TTL, max_entries=MAX_PENDING_ENTRIES,
+                 max_bytes=MAX_PENDING_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        # entries are kept in the order they were first received, so the
+        # oldest entry is always at the front
+        self._entries = OrderedDict()
+        self._counts = {}
+        self._failed = []
+
+        self.size = 0
+        self.expired = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    # The number of invocations of fname that are waiting here.
+    def count(self, fname):
+        return self._counts.get(fname, 0)
+
+    # Both add_schedule and add_trigger return the invocation if it is now
+    # ready to run, and None otherwise.
+    def add_schedule(self, schedule, size):
+        entry = self._get_entry(schedule.id, schedule.target_function)
+        entry.schedule = schedule
+
+        return self._add(entry, size)
+
+    def add_trigger(self, trigger, size, payloads=None):
+        entry = self._get_entry(trigger.id, trigger.target_function)
+        entry.triggers[trigger.source] = trigger
+
+        if payloads:
+            entry.payloads[trigger.source] = payloads
+
+        return self._add(entry, size)
+
+    def expire(self):
+        now = time.time()
+        while self._entries:
+            entry = next(iter(self._entries.values()))
+            if now - entry.receive_time < self.ttl:
+                break
+
+            self._remove(entry)
+            self._failed.append((entry, TIMED_OUT))
+            self.expired += 1
+
+    # Returns (invocation, error type) pairs for every invocation that expired
+    # or was dropped since the last call.
+    def remove_failed(self):
+        failed = self._failed
+        self._failed = []
+        return failed
+
+    def reset_stats(self):
+        self.expired = 0
+        self.dropped = 0
+
+    def _get_entry(self, sid, fname):
+        key = (sid, fname)
+        if key not in self._entries:
+            self._entries[key] = PendingInvocation(sid, fname)
+            self._counts[fname] = self._counts.get(fname, 0) + 1
+
+        return self._entries[key]
+
+    def _add(self, entry, size):
+        entry.size += size
+        self.size += size
+
+        if entry.ready():
+            self._remove(entry)
+            return entry
+
+        while len(self._entries) > self.max_entries or \
+                self.size > self.max_bytes:
+            oldest = next(iter(self._entries.values()))
+            self._remove(oldest)
+            self._failed.append((oldest, NO_RESOURCES))
+            self.dropped += 1
+
+        return None
+
+    def _remove(self, entry):
+        del self._entries[(entry.id, entry.fname)]
+        self.size -= entry.size
+
+        self._counts[entry.fname] -= 1
+        if self._counts[entry.fname] == 0:
+            del self._counts[entry.fname]
+
+
+# Tells the client of a failed DAG invocation about the failure. If we never
+# received the schedule, we do not know where the client is waiting, so we put
+# the error where a client without a response address would look for it.
+def report_pending_failure(pusher_cache, kvs, entry, error):
+    if error == TIMED_OUT:
+        msg = 'ERROR: DAG invocation expired before all of its inputs arrived.'
+    else:
+        msg = 'ERROR: DAG invocation dropped; too many pending invocations.'
+
+    logging.error('Failing invocation of %s for DAG %s: %s' %
+                  (entry.fname, entry.id, msg))
+
+    if entry.schedule is not None:
+        _send_dag_error(pusher_cache, kvs, entry.schedule, error, msg)
+    else:
+        sutils.error.error = error
+        result = (msg, sutils.error.SerializeToString())
+
+        lattice = LWWPairLattice(generate_timestamp(0), serialize_val(result))
+        kvs.put(entry.id, lattice)
@@ -13,46 +13,189 @@
 #  limitations under the License.
 
 import logging
-import os
+import time
 
 from . import utils
+from .async_call import _retrieve_function_async, \
+        _retrieve_function_metadata_version_async
+from .batch import BatchQueue
+from .call import _send_dag_error
 from include.functions_pb2 import *
+from include.shared import *
 from include import server_utils as sutils
 
+# how long (in seconds) we keep trying to retrieve a function we were asked to
+# pin
+PIN_WAIT_TIMEOUT = 60
 
-def pin(pin_socket, pusher_cache, client, status, pinned_functions, runtimes,
-        exec_counts):
-    msg = pin_socket.recv_string()
+# how long (in seconds) we hold on to an unpinned function after its queued
+# invocations have run, since schedules sent before the schedulers heard about
+# the unpin can still arrive
+UNPIN_GRACE_PERIOD = 1
+
+
+def pin(msg, pusher_cache, client, status, pinned_functions, runtimes,
+        exec_counts, function_cache, batch_queues, unpinned, memo_cache):
+    name, sckt = _check_pin(msg, pusher_cache, status)
+    if name is None:
+        return
+
+    # The function must exist -- because otherwise the DAG couldn't be
+    # registered -- so we keep trying to retrieve it.
+    try:
+        func = wait_for(lambda: utils._retrieve_function(name, client,
+                                                         function_cache),
+                        sutils._get_func_kvs_name(name), PIN_WAIT_TIMEOUT)
+    except WaitTimeoutError as e:
+        logging.error('Unable to pin function %s: %s' % (name, str(e)))
+        sckt.send(sutils.error.SerializeToString())
+        return
+
+    version, metadata = utils._retrieve_function_metadata_version(name,
+                                                                  client)
+    _add_pinned_function(name, func, version, metadata, sckt, status,
+                         pinned_functions, runtimes, exec_counts,
+                         batch_queues, unpinned, memo_cache)
+
+
+# The asyncio counterpart of pin, which awaits the function's retrieval
+# rather than blocking the event loop on it; client is an AsyncIpcAnnaClient.
+# Callers must not run two of these at once, since the capacity check only
+# counts functions that were already pinned.
+async def pin_async(msg, pusher_cache, client, status, pinned_functions,
+                    runtimes, exec_counts, function_cache, batch_queues,
+                    unpinned, memo_cache):
+    name, sckt = _check_pin(msg, pusher_cache, status)
+    if name is None:
+        return
+
+    try:
+        func = await wait_for_async(
+            lambda: _retrieve_function_async(name, client, function_cache),
+            sutils._get_func_kvs_name(name), PIN_WAIT_TIMEOUT)
+    except WaitTimeoutError as e:
+        logging.error('Unable to pin function %s: %s' % (name, str(e)))
+        sckt.send(sutils.error.SerializeToString())
+        return
+
+    version, metadata = await _retrieve_function_metadata_version_async(
+        name, client)
+
+    # the thread may have started to depart while we waited
+    if not status.running:
+        sckt.send(sutils.error.SerializeToString())
+        return
+
+    _add_pinned_function(name, func, version, metadata, sckt, status,
+                         pinned_functions, runtimes, exec_counts,
+                         batch_queues, unpinned, memo_cache)
+
+
+# Returns the name of the function msg asks us to pin and the socket to
+# answer on, or None for the name if we have already refused.
+def _check_pin(msg, pusher_cache, status):
     splits = msg.split(':')
 
     resp_ip, name = splits[0], splits[1]
     sckt = pusher_cache.get(sutils._get_pin_accept_port(resp_ip))
 
-    if len(pinned_functions) > 0 or not status.running:
-        resp = sutils.error.SerializeToString()
+    # we only have room for status.capacity functions
+    full = name not in status.functions and \
+        len(status.functions) >= status.capacity
+    if full or not status.running:
         sckt.send(sutils.error.SerializeToString())
-        return
+        return None, sckt
 
     logging.info('Adding function %s to my local pinned functions.' % (name))
-    sckt.send(sutils.ok_resp)
+    return name, sckt
 
-    func = utils._retrieve_function(name, client)
 
-    # the function must exist -- because otherwise the DAG couldn't be
-    # registered -- so we keep trying to retrieve it
-    while not func:
-        func = utils._retrieve_function(name, client)
+# We only accept the pin once the function is ready to run here, so that if it
+# cannot be retrieved or initialized, the scheduler tries another thread.
+def _add_pinned_function(name, func, version, metadata, sckt, status,
+                         pinned_functions, runtimes, exec_counts,
+                         batch_queues, unpinned, memo_cache):
+    # if the function is still draining from an earlier unpin, we keep its
+    # (warm) instance and batch queue
+    unpinned.pop(name, None)
 
     if name not in pinned_functions:
+        # stateful functions are initialized once here, and the instance is
+        # kept for as long as the function is pinned
+        try:
+            func = utils._create_instance(func)
+        except Exception as e:
+            logging.exception('Unable to initialize function %s: %s' %
+                              (name, str(e)))
+            sckt.send(sutils.error.SerializeToString())
+            return
+
         pinned_functions[name] = func
+        memo_cache.add_function(name, version, metadata)
+
+        if metadata and metadata.batching:
+            logging.info('Batching up to %d invocations of %s.' %
+                         (metadata.max_batch_size, name))
+            batch_queues[name] = BatchQueue(metadata.max_batch_size,
+                                            metadata.max_batch_wait)
+
+    if name not in status.functions:
         status.functions.append(name)
+
     runtimes[name] = 0.0
     exec_counts[name] = 0
 
+    sckt.send(sutils.ok_resp)
+
+
+# Stops accepting new invocations of the function; the invocations we already
+# have are still run, and release_unpinned frees the function once they are
+# done, which leaves the thread running and ready to be pinned again.
+def unpin(name, status, unpinned):
+    if name not in status.functions:
+        logging.info('Ignoring unpin request for %s, which is not pinned.' %
+                     (name))
+        return
 
-def unpin(unpin_socket, status, pinned_functions, runtimes, exec_counts):
-    name = unpin_socket.recv_string()  # the name of the func to unpin
     logging.info('Removing function %s from my local pinned functions.' %
                  (name))
+    status.functions.remove(name)
+    unpinned[name] = time.time()
+
+
+# Frees the state of every unpinned function that has no invocations left;
+# is_busy tells us whether a function still has any queued or running.
+# Returns the names of the functions that were freed.
+def release_unpinned(unpinned, pinned_functions, runtimes, exec_counts,
+                     batch_queues, function_cache, memo_cache, is_busy):
+    released = []
+    now = time.time()
+    for name in list(unpinned.keys()):
+        if now - unpinned[name] < UNPIN_GRACE_PERIOD or is_busy(name):
+            continue
+
+        del unpinned[name]
+        if name in pinned_functions:
+            utils._destroy_instance(pinned_functions[name])
+            del pinned_functions[name]
+
+        runtimes.pop(name, None)
+        exec_counts.pop(name, None)
+        batch_queues.pop(name, None)
+        function_cache.invalidate(name)
+        memo_cache.remove_function(name)
+
+        logging.info('Finished draining function %s.' % (name))
+        released.append(name)
+
+    return released
+
 
-    os._exit(0)
+# Fails an invocation that became ready after its function was unpinned and
+# freed here.
+def reject_unpinned(pusher_cache, kvs, invocation):
+    logging.error('Rejecting invocation of %s for DAG %s: not pinned.' %
+                  (invocation.fname, invocation.id))
+    _send_dag_error(pusher_cache, kvs, invocation.schedule, NOT_PINNED,
+                    'ERROR: function %s is not pinned on this executor.' %
+                    (invocation.fname))
@@ -0,0 +1,349 @@
+#  Copyright 2018 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from collections import deque
+import inspect
+import logging
+import multiprocessing
+import time
+import zmq
+
+from anna.ipc_client import IpcAnnaClient
+from anna.zmq_util import SocketCache
+from include.functions_pb2 import *
+from .cache import FunctionCache, ObjectCache
+from .memo import MemoCache
+from .shm import SharedMemoryStore
+from . import call as fcall
+from . import user_library
+from . import utils
+
+# the largest number of worker processes a single executor thread can have
+MAX_POOL_SIZE = 16
+
+# how long (in ms) an idle worker waits for a task before it checks for
+# expired shared memory segments
+WORKER_POLL_TIMEOUT = 1000
+
+# worker processes need their own KVS response addresses and user library
+# inboxes, so they are given thread IDs well above the executor threads'
+POOL_TID_OFFSET = 100
+
+FUNC_TASK = 'func'
+DAG_TASK = 'dag'
+BATCH_TASK = 'batch'
+
+# tells a worker to drop its state for a function that was unpinned; workers
+# do not report these as done
+RELEASE_TASK = 'release'
+
+# the ExecutorStatistics counters that workers keep for their own caches and
+# report back with every finished task
+WORKER_STATS = ('function_cache_hits', 'function_cache_misses',
+                'object_cache_hits', 'object_cache_misses',
+                'object_cache_bytes_saved', 'memo_hits', 'memo_misses')
+
+
+class ExecutionPool():
+    # A bounded pool of worker processes that run user functions on behalf of
+    # a single executor thread, so that a slow function does not block the
+    # executor's control loop. Tasks are handed out in the order they were
+    # submitted, and only ever to an idle worker.
+    def __init__(self, ip, thread_id, size):
+        if size > MAX_POOL_SIZE:
+            logging.info('Execution pool size %d is too large; using %d.' %
+                         (size, MAX_POOL_SIZE))
+            size = MAX_POOL_SIZE
+
+        self.thread_id = thread_id
+        self.size = size
+
+        # this must be called before the executor creates any ZMQ state,
+        # because ZMQ contexts cannot be safely shared across a fork
+        self.workers = []
+        for wid in range(size):
+            worker = multiprocessing.Process(target=_run_worker,
+                                             args=(ip, thread_id, wid))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+        self.idle = deque(range(size))
+        self.pending = deque()
+
+        # the ID of the task each busy worker is running
+        self.running = {}
+
+        # the workers' cache statistics since the last report
+        self.stats = dict.fromkeys(WORKER_STATS, 0)
+
+    def connect(self, ctx, poller):
+        self.task_sockets = []
+        for wid in range(self.size):
+            sckt = ctx.socket(zmq.PUSH)
+            sckt.connect(_get_worker_task_address(self.thread_id, wid))
+            self.task_sockets.append(sckt)
+
+        self.done_socket = ctx.socket(zmq.PULL)
+        self.done_socket.bind(_get_worker_done_address(self.thread_id))
+        poller.register(self.done_socket, zmq.POLLIN)
+
+    def submit_function(self, serialized_call):
+        self.pending.append((FUNC_TASK, None, serialized_call))
+        self._dispatch()
+
+    def submit_dag(self, invocation):
+        self.pending.append((DAG_TASK,
+                             (invocation.fname, [invocation.receive_time]),
+                             _serialize_invocation(invocation)))
+        self._dispatch()
+
+    def submit_dag_batch(self, invocations):
+        self.pending.append((BATCH_TASK,
+                             (invocations[0].fname,
+                              [invocation.receive_time for invocation in
+                               invocations]),
+                             [_serialize_invocation(invocation) for invocation
+                              in invocations]))
+        self._dispatch()
+
+    # Returns a list of (task type, task ID, elapsed time) tuples for all of
+    # the tasks that have finished since the last call. The ID of a DAG or
+    # batch task is its function's name and the times its invocations were
+    # received.
+    def collect(self):
+        completed = []
+        while True:
+            try:
+                wid, ttype, tid, elapsed, stats = \
+                    self.done_socket.recv_pyobj(zmq.NOBLOCK)
+            except zmq.ZMQError as e:
+                if e.errno == zmq.EAGAIN:
+                    break
+                else:
+                    raise e
+
+            for name in stats:
+                self.stats[name] += stats[name]
+
+            self.idle.append(wid)
+            del self.running[wid]
+            completed.append((ttype, tid, elapsed))
+
+        self._dispatch()
+        return completed
+
+    # Adds the workers' cache statistics to the executor's own in stats (an
+    # ExecutorStatistics), and starts counting again.
+    def report_stats(self, stats):
+        for name in WORKER_STATS:
+            setattr(stats, name, getattr(stats, name) + self.stats[name])
+
+        self.stats = dict.fromkeys(WORKER_STATS, 0)
+
+    def busy(self):
+        return len(self.pending) > 0 or len(self.idle) < self.size
+
+    # Whether any DAG invocations of fname are queued or running.
+    def has_tasks(self, fname):
+        tids = [task[1] for task in self.pending]
+        tids.extend(self.running.values())
+
+        return any(tid is not None and tid[0] == fname for tid in tids)
+
+    # Has every worker drop its instance and cached copy of fname; only called
+    # once fname has no tasks left.
+    def release(self, fname):
+        for sckt in self.task_sockets:
+            sckt.send_pyobj((RELEASE_TASK, fname, None))
+
+    def close(self):
+        for worker in self.workers:
+            worker.terminate()
+
+    def _dispatch(self):
+        while self.idle and self.pending:
+            wid = self.idle.popleft()
+            task = self.pending.popleft()
+
+            self.running[wid] = task[1]
+            self.task_sockets[wid].send_pyobj(task)
+
+
+def _run_worker(ip, thread_id, wid):
+    worker_tid = _get_worker_tid(thread_id, wid)
+
+    ctx = zmq.Context(1)
+    task_socket = ctx.socket(zmq.PULL)
+    task_socket.bind(_get_worker_task_address(thread_id, wid))
+
+    done_socket = ctx.socket(zmq.PUSH)
+    done_socket.connect(_get_worker_done_address(thread_id))
+
+    pusher_cache = SocketCache(ctx, zmq.PUSH)
+    client = IpcAnnaClient(worker_tid)
+    user_lib = user_library.FluentUserLibrary(ip, worker_tid, client)
+    function_cache = FunctionCache()
+    object_cache = ObjectCache()
+    memo_cache = MemoCache()
+    shm_store = SharedMemoryStore(ip)
+
+    # the instances of stateful functions, keyed by name
+    instances = {}
+
+    while True:
+        shm_store.expire()
+        if task_socket.poll(WORKER_POLL_TIMEOUT) == 0:
+            continue
+
+        ttype, tid, body = task_socket.recv_pyobj()
+
+        if ttype == RELEASE_TASK:
+            if tid in instances:
+                utils._destroy_instance(instances.pop(tid)[1])
+            function_cache.invalidate(tid)
+            continue
+
+        start = time.time()
+
+        if ttype == FUNC_TASK:
+            call = FunctionCall()
+            call.ParseFromString(body)
+        elif ttype == DAG_TASK:
+            batch = [_parse_invocation(body)]
+        else:
+            batch = [_parse_invocation(invocation) for invocation in body]
+
+        try:
+            if ttype == FUNC_TASK:
+                fcall._exec_function_call(call, client, user_lib,
+                                          function_cache, object_cache,
+                                          memo_cache)
+            elif ttype == DAG_TASK:
+                schedule, triggers, payloads = batch[0]
+
+                fname = schedule.target_function
+                version, metadata = \
+                    utils._retrieve_function_metadata_version(fname, client)
+                memo_cache.add_function(fname, version, metadata)
+
+                func = utils._retrieve_function(fname, client, function_cache,
+                                                version)
+                func = _get_instance(instances, fname, func)
+                fcall.exec_dag_function(pusher_cache, client, triggers, func,
+                                        schedule, user_lib, object_cache,
+                                        shm_store, payloads, memo_cache)
+            else:
+                fname = batch[0][0].target_function
+                func = utils._retrieve_function(fname, client, function_cache)
+                func = _get_instance(instances, fname, func)
+                fcall.exec_dag_function_batch(pusher_cache, client, batch,
+                                              func, user_lib, object_cache,
+                                              shm_store)
+        except Exception as e:
+            # the task's scopes are closed by the call functions; here, we
+            # only have to make sure that nobody waits for a result
+            logging.exception('Unexpected error %s in pool worker %d.' %
+                              (str(e), wid))
+
+            if ttype == FUNC_TASK:
+                fcall._send_call_error(client, call, EXEC_ERROR,
+                                       'ERROR: ' + str(e))
+            else:
+                for schedule, _, _ in batch:
+                    fcall._send_dag_error(pusher_cache, client, schedule,
+                                          EXEC_ERROR, 'ERROR: ' + str(e))
+
+        done_socket.send_pyobj((wid, ttype, tid, time.time() - start,
+                                _get_worker_stats(function_cache,
+                                                  object_cache, memo_cache)))
+
+
+# Returns the worker's cache statistics since its last task, by their
+# ExecutorStatistics field names.
+def _get_worker_stats(function_cache, object_cache, memo_cache):
+    stats = {
+        'function_cache_hits': function_cache.hits,
+        'function_cache_misses': function_cache.misses,
+        'object_cache_hits': object_cache.hits,
+        'object_cache_misses': object_cache.misses,
+        'object_cache_bytes_saved': object_cache.bytes_saved,
+        'memo_hits': memo_cache.hits,
+        'memo_misses': memo_cache.misses
+    }
+
+    function_cache.reset_stats()
+    object_cache.reset_stats()
+    memo_cache.reset_stats()
+
+    return stats
+
+
+# Workers retrieve a DAG function for every task, so the instance of a stateful
+# function is kept here, and only replaced if its class was re-registered.
+def _get_instance(instances, name, func):
+    if not inspect.isclass(func):
+        return func
+
+    if name in instances:
+        cls, instance = instances[name]
+        if cls is func:
+            return instance
+
+        utils._destroy_instance(instance)
+
+    instances[name] = (func, func())
+    return instances[name][1]
+
+
+# Workers receive tasks as pickled messages, so the invocation's payload
+# frames are copied out of their (unpicklable) ZMQ buffers here.
+def _serialize_invocation(invocation):
+    triggers = {}
+    for source in invocation.triggers:
+        triggers[source] = invocation.triggers[source].SerializeToString()
+
+    payloads = {}
+    for source in invocation.payloads:
+        payloads[source] = [bytes(frame) for frame in
+                            invocation.payloads[source]]
+
+    return invocation.schedule.SerializeToString(), triggers, payloads
+
+
+def _parse_invocation(serialized):
+    serialized_schedule, serialized_triggers, payloads = serialized
+
+    schedule = DagSchedule()
+    schedule.ParseFromString(serialized_schedule)
+
+    triggers = {}
+    for source in serialized_triggers:
+        trigger = DagTrigger()
+        trigger.ParseFromString(serialized_triggers[source])
+        triggers[source] = trigger
+
+    return schedule, triggers, payloads
+
+
+def _get_worker_tid(thread_id, wid):
+    return POOL_TID_OFFSET + thread_id * MAX_POOL_SIZE + wid
+
+
+def _get_worker_task_address(thread_id, wid):
+    return 'ipc:///tmp/executor_%d_worker_%d' % (thread_id, wid)
+
+
+def _get_worker_done_address(thread_id):
+    return 'ipc:///tmp/executor_%d_done' % (thread_id)
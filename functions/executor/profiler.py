@@ -0,0 +1,54 @@
+#  Copyright 2018 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import cProfile
+import io
+import pstats
+import socket
+import time
+
+from anna.lattices import *
+
+# the number of most expensive frames (by cumulative time) in each profile
+PROFILE_TOP_FRAMES = 30
+
+
+# Runs func(*args) under cProfile, and returns its result along with a text
+# report of the wall and CPU time the call took and its most expensive frames.
+# label identifies the invocation in the report.
+def run_profiled(label, func, args):
+    profiler = cProfile.Profile()
+
+    wall_start = time.time()
+    cpu_start = time.process_time()
+    result = profiler.runcall(func, *args)
+    cpu_time = time.process_time() - cpu_start
+    wall_time = time.time() - wall_start
+
+    report = io.StringIO()
+    report.write('%s on %s at %.6f\n' % (label, socket.gethostname(),
+                                         wall_start))
+    report.write('Wall time: %.6f s, CPU time: %.6f s\n\n' % (wall_time,
+                                                              cpu_time))
+
+    stats = pstats.Stats(profiler, stream=report)
+    stats.sort_stats('cumulative').print_stats(PROFILE_TOP_FRAMES)
+
+    return result, report.getvalue()
+
+
+# Profiles are stored as a set, so that every stage of a profiled DAG can add
+# its own report under the same key.
+def get_profile_lattice(report):
+    return SetLattice({report.encode()})
@@ -13,285 +13,148 @@
 #  limitations under the License.
 
 import logging
-import os
 import time
 import zmq
 
 from anna.ipc_client import IpcAnnaClient
 from anna.zmq_util import SocketCache
 from .call import *
-from .pin import *
-from include import server_utils as sutils
-from include.shared import *
-from . import utils
+from .loop import ExecutorLoop, Runner
+from .pool import ExecutionPool, FUNC_TASK
+from . import user_library
 
-REPORT_THRESH = 5
 
-
-def executor(ip, mgmt_ip, schedulers, thread_id):
+def executor(ip, mgmt_ip, schedulers, thread_id, pool_size=0, pin_capacity=1):
     logging.basicConfig(filename='log_executor.txt', level=logging.INFO,
                         format='%(asctime)s %(message)s')
 
+    # if we have a pool of worker processes, user functions run there, and
+    # this thread only handles control messages; the pool must be started
+    # before we create any ZMQ state
+    if pool_size > 0:
+        runner = PoolRunner(ExecutionPool(ip, thread_id, pool_size))
+    else:
+        runner = InlineRunner()
+
     ctx = zmq.Context(1)
+    pusher_cache = SocketCache(ctx, zmq.PUSH)
+    client = IpcAnnaClient(thread_id)
+    user_lib = user_library.FluentUserLibrary(ip, thread_id, client)
+
+    executor_loop = ExecutorLoop(ip, mgmt_ip, schedulers, thread_id,
+                                 pin_capacity, ctx, pusher_cache, client,
+                                 user_lib, runner)
+
     poller = zmq.Poller()
+    for sckt in executor_loop.sockets:
+        poller.register(sckt, zmq.POLLIN)
 
-    pin_socket = ctx.socket(zmq.PULL)
-    pin_socket.bind(sutils.BIND_ADDR_TEMPLATE % (sutils.PIN_PORT + thread_id))
+    if pool_size > 0:
+        runner.pool.connect(ctx, poller)
 
-    unpin_socket = ctx.socket(zmq.PULL)
-    unpin_socket.bind(sutils.BIND_ADDR_TEMPLATE % (sutils.UNPIN_PORT +
-                                                   thread_id))
+    while True:
+        socks = dict(poller.poll(timeout=executor_loop.timeout()))
 
-    exec_socket = ctx.socket(zmq.PULL)
-    exec_socket.bind(sutils.BIND_ADDR_TEMPLATE % (sutils.FUNC_EXEC_PORT +
-                                                  thread_id))
+        for sckt in executor_loop.sockets:
+            if sckt in socks and socks[sckt] == zmq.POLLIN:
+                executor_loop.handle(sckt, sckt.recv_multipart(copy=False))
 
-    dag_queue_socket = ctx.socket(zmq.PULL)
-    dag_queue_socket.bind(sutils.BIND_ADDR_TEMPLATE % (sutils.DAG_QUEUE_PORT
-                                                       + thread_id))
+        if executor_loop.step(socks):
+            return 0
 
-    dag_exec_socket = ctx.socket(zmq.PULL)
-    dag_exec_socket.bind(sutils.BIND_ADDR_TEMPLATE % (sutils.DAG_EXEC_PORT
-                                                      + thread_id))
 
-    self_depart_socket = ctx.socket(zmq.PULL)
-    self_depart_socket.bind(sutils.BIND_ADDR_TEMPLATE %
-                            (sutils.SELF_DEPART_PORT + thread_id))
+class InlineRunner(Runner):
+    # Runs every invocation on the executor thread itself, as soon as it is
+    # ready, so the thread handles no other messages while a function runs.
+    def run_function(self, serialized):
+        executor = self.executor
+        exec_function(serialized, executor.kvs, executor.user_lib,
+                      executor.function_cache, executor.object_cache,
+                      executor.memo_cache)
 
-    pusher_cache = SocketCache(ctx, zmq.PUSH)
+        executor.finish(None, 0.0)
 
-    poller = zmq.Poller()
-    poller.register(pin_socket, zmq.POLLIN)
-    poller.register(unpin_socket, zmq.POLLIN)
-    poller.register(exec_socket, zmq.POLLIN)
-    poller.register(dag_queue_socket, zmq.POLLIN)
-    poller.register(dag_exec_socket, zmq.POLLIN)
-    poller.register(self_depart_socket, zmq.POLLIN)
+    def run_dag(self, invocation):
+        executor = self.executor
+        fname = invocation.fname
 
-    client = IpcAnnaClient(thread_id)
+        fstart = time.time()
+        exec_dag_function(executor.pusher_cache, executor.kvs,
+                          invocation.triggers,
+                          executor.pinned_functions[fname],
+                          invocation.schedule, executor.user_lib,
+                          executor.object_cache, executor.shm_store,
+                          invocation.payloads, executor.memo_cache)
 
-    status = ThreadStatus()
-    status.ip = ip
-    status.tid = thread_id
-    status.running = True
-    status.type = PERIODIC
-    utils._push_status(schedulers, pusher_cache, status)
+        executor.finish(fname, time.time() - fstart,
+                        [invocation.receive_time])
 
-    departing = False
+    def run_batch(self, fname, batch):
+        executor = self.executor
 
-    # this is going to be a map of map of maps for every function that we have
-    # pinnned, we will track a map of execution ids to DAG schedules
-    queue = {}
+        fstart = time.time()
+        exec_dag_function_batch(executor.pusher_cache, executor.kvs,
+                                [(invocation.schedule, invocation.triggers,
+                                  invocation.payloads)
+                                 for invocation in batch],
+                                executor.pinned_functions[fname],
+                                executor.user_lib, executor.object_cache,
+                                executor.shm_store)
 
-    # track the actual function objects that we are storing here
-    pinned_functions = {}
+        executor.finish(fname, time.time() - fstart,
+                        [invocation.receive_time for invocation in batch])
 
-    # tracks runtime cost of excuting a DAG function
-    runtimes = {}
 
-    # if multiple triggers are necessary for a function, track the triggers as
-    # we receive them
-    received_triggers = {}
+class PoolRunner(Runner):
+    # Hands every invocation to an ExecutionPool, whose workers run them in
+    # parallel; pinning and everything else stay on the executor thread.
+    def __init__(self, pool):
+        self.pool = pool
 
-    # track when we received a function request, so we can report e2e latency
-    receive_times = {}
+    def run_function(self, serialized):
+        self.pool.submit_function(serialized)
 
-    # track how many functions we're executing
-    exec_counts = {}
+    def run_dag(self, invocation):
+        self.pool.submit_dag(invocation)
 
-    # metadata to track thread utilization
-    report_start = time.time()
-    event_occupancy = {'pin': 0.0,
-                       'unpin': 0.0,
-                       'func_exec': 0.0,
-                       'dag_queue': 0.0,
-                       'dag_exec': 0.0}
-    total_occupancy = 0.0
+    def run_batch(self, fname, batch):
+        self.pool.submit_dag_batch(batch)
 
-    while True:
-        socks = dict(poller.poll(timeout=1000))
-
-        if pin_socket in socks and socks[pin_socket] == zmq.POLLIN:
-            work_start = time.time()
-            pin(pin_socket, pusher_cache, client, status, pinned_functions,
-                runtimes, exec_counts)
-            status.type = POST_REQUEST
-            utils._push_status(schedulers, pusher_cache, status)
-
-            elapsed = time.time() - work_start
-            event_occupancy['pin'] += elapsed
-            total_occupancy += elapsed
-
-        if unpin_socket in socks and socks[unpin_socket] == zmq.POLLIN:
-            work_start = time.time()
-            unpin(unpin_socket, status, pinned_functions, runtimes,
-                  exec_counts)
-            status.type = POST_REQUEST
-            utils._push_status(schedulers, pusher_cache, status)
-
-            elapsed = time.time() - work_start
-            event_occupancy['unpin'] += elapsed
-            total_occupancy += elapsed
-
-        if exec_socket in socks and socks[exec_socket] == zmq.POLLIN:
-            work_start = time.time()
-            exec_function(exec_socket, client, status, ip, thread_id)
-
-            status.type = POST_REQUEST
-            utils._push_status(schedulers, pusher_cache, status)
-
-            elapsed = time.time() - work_start
-            event_occupancy['func_exec'] += elapsed
-            total_occupancy += elapsed
-
-        if dag_queue_socket in socks and socks[dag_queue_socket] == zmq.POLLIN:
-            work_start = time.time()
-
-            schedule = DagSchedule()
-            schedule.ParseFromString(dag_queue_socket.recv())
-            fname = schedule.target_function
-
-            logging.info('Received a schedule for DAG %s (%s), function %s.' %
-                         (schedule.dag.name, schedule.id, fname))
-
-            if fname not in queue:
-                queue[fname] = {}
-
-            queue[fname][schedule.id] = schedule
-
-            if (schedule.id, fname) not in receive_times:
-                receive_times[(schedule.id, fname)] = time.time()
-
-            # in case we receive the trigger before we receive the schedule, we
-            # can trigger from this operation as well
-            trkey = (schedule.id, fname)
-            if (trkey in received_triggers and (len(received_triggers[trkey])
-                                                == len(schedule.triggers))):
-                exec_dag_function(pusher_cache, client,
-                                  received_triggers[trkey],
-                                  pinned_functions[fname], schedule, ip,
-                                  thread_id)
-                del received_triggers[trkey]
-                del queue[fname][schedule.id]
-
-                fend = time.time()
-                fstart = receive_times[(schedule.id, fname)]
-                runtimes[fname] += fend - fstart
-                exec_counts[fname] += 1
-
-            elapsed = time.time() - work_start
-            event_occupancy['dag_queue'] += elapsed
-            total_occupancy += elapsed
-
-        if dag_exec_socket in socks and socks[dag_exec_socket] == zmq.POLLIN:
-            work_start = time.time()
-            trigger = DagTrigger()
-            trigger.ParseFromString(dag_exec_socket.recv())
-
-            fname = trigger.target_function
-            logging.info('Received a trigger for schedule %s, function %s.' %
-                         (trigger.id, fname))
-
-            key = (trigger.id, fname)
-            if key not in received_triggers:
-                received_triggers[key] = {}
-
-            if (trigger.id, fname) not in receive_times:
-                receive_times[(trigger.id, fname)] = time.time()
-
-            received_triggers[key][trigger.source] = trigger
-            if fname in queue and trigger.id in queue[fname]:
-                schedule = queue[fname][trigger.id]
-                if len(received_triggers[key]) == len(schedule.triggers):
-                    exec_dag_function(pusher_cache, client,
-                                      received_triggers[key],
-                                      pinned_functions[fname], schedule, ip,
-                                      thread_id)
-                    del received_triggers[key]
-                    del queue[fname][trigger.id]
-
-                    fend = time.time()
-                    fstart = receive_times[(trigger.id, fname)]
-                    runtimes[fname] += fend - fstart
-                    exec_counts[fname] += 1
-
-            elapsed = time.time() - work_start
-            event_occupancy['dag_exec'] += elapsed
-            total_occupancy += elapsed
-
-        if self_depart_socket in socks and socks[self_depart_socket] == \
-                zmq.POLLIN:
-            # This message should not matter
-            msg = self_depart_socket.recv()
-
-            logging.info('Preparing to depart. No longer accepting requests ' +
-                         'and clearing all queues.')
-
-            status.ClearField('functions')
-            status.running = False
-            status.type = PERIODIC
-            utils._push_status(schedulers, pusher_cache, status)
-
-            departing = True
-
-        # periodically report function occupancy
-        report_end = time.time()
-        if report_end - report_start > REPORT_THRESH:
-            # periodically report my status to schedulers
-            status.type = PERIODIC
-            utils._push_status(schedulers, pusher_cache, status)
-
-            utilization = total_occupancy / (report_end - report_start)
-            status.utilization = utilization
-
-            if utilization > 0.5:
-                msg = ip + ':' + str(thread_id)
-                for scheduler in schedulers:
-                    sckt = pusher_cache.get(sutils._get_backoff_addresss
-                                            (scheduler))
-                    sckt.send_string(msg)
-
-            sckt = pusher_cache.get(utils._get_util_report_address(mgmt_ip))
-            sckt.send(status.SerializeToString())
-
-            logging.info('Total thread occupancy: %.6f' % (utilization))
-
-            for event in event_occupancy:
-                occ = event_occupancy[event] / (report_end - report_start)
-                logging.info('Event %s occupancy: %.6f' % (event, occ))
-                event_occupancy[event] = 0.0
-
-            stats = ExecutorStatistics()
-            for fname in runtimes:
-                if exec_counts[fname] > 0:
-                    fstats = stats.statistics.add()
-                    fstats.fname = fname
-                    fstats.runtime = runtimes[fname]
-                    fstats.call_count = exec_counts[fname]
-
-                runtimes[fname] = 0.0
-                exec_counts[fname] = 0
-
-            sckt = pusher_cache.get(sutils._get_statistics_report_address
-                                    (mgmt_ip))
-            sckt.send(stats.SerializeToString())
-
-            report_start = time.time()
-            total_occupancy = 0.0
-
-            # periodically clear any old functions we have cached that we are
-            # no longer accepting requests for
-            for fname in queue:
-                if len(queue[fname]) == 0 and fname not in status.functions:
-                    del queue[fname]
-                    del pinned_functions[fname]
-                    del runtimes[fname]
-                    del exec_counts[fname]
-
-            # if we are departing and have cleared our queues, let the
-            # management server know, and exit the process
-            if departing and len(queue) == 0:
-                sckt = pusher_cache.get(utils._get_depart_done_addr(mgmt_ip))
-                sckt.send_string(ip)
-
-                return 0
+    def has_tasks(self, fname):
+        return self.pool.has_tasks(fname)
+
+    def busy(self):
+        return self.pool.busy()
+
+    def poll(self, socks):
+        pool = self.pool
+        if pool.done_socket not in socks or \
+                socks[pool.done_socket] != zmq.POLLIN:
+            return
+
+        for ttype, task_id, elapsed in pool.collect():
+            # the workers run in parallel, so we scale their busy time by the
+            # pool size to keep occupancy between 0 and 1
+            elapsed /= pool.size
+
+            if ttype == FUNC_TASK:
+                self.executor.add_occupancy('func_exec', elapsed)
+                self.executor.finish(None, elapsed)
+            else:
+                self.executor.add_occupancy('dag_exec', elapsed)
+
+                fname, fstarts = task_id
+                self.executor.finish(fname, elapsed, fstarts)
+
+    def release(self, fname):
+        self.pool.release(fname)
+
+    # the pool's workers keep caches of their own
+    def report(self, stats):
+        self.pool.report_stats(stats)
+
+    def queue_depth(self):
+        return {'pool': len(self.pool.pending) + len(self.pool.running)}
+
+    def close(self):
+        self.pool.close()
@@ -0,0 +1,79 @@
+#  Copyright 2018 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from collections import deque
+import logging
+import numpy as np
+import os
+import time
+
+from include.functions_pb2 import *
+from include.serializer import *
+
+# NumPy results smaller than this (in bytes) are cheaper to send in the trigger
+SHM_THRESHOLD = 1024 * 1024
+
+# how long (in seconds) a shared memory segment is kept around for the
+# downstream function to map it; pending invocations expire well before this
+SHM_TTL = 60
+
+
+class SharedMemoryStore():
+    # Hands large NumPy results to DAG functions pinned on the same node
+    # through shared memory: the array is written once, the trigger carries
+    # only its path, and the downstream thread maps it read-only. The thread
+    # that wrote a segment removes it after SHM_TTL seconds; a reader that has
+    # already mapped it keeps its mapping.
+    def __init__(self, ip):
+        self.ip = ip
+        self.segments = deque()
+
+    def is_local(self, ip_tid):
+        return ip_tid.split(':')[0] == self.ip
+
+    # Returns a SHARED_MEMORY Value for val, or None if val should be
+    # serialized normally instead.
+    def dump(self, val):
+        if not isinstance(val, np.ndarray) or val.nbytes < SHM_THRESHOLD:
+            return None
+
+        try:
+            body = shm_ser.dump(val)
+        except Exception as e:
+            logging.info('Unable to write result to shared memory: %s' %
+                         (str(e)))
+            return None
+
+        self.segments.append((time.time() + SHM_TTL, body.decode()))
+
+        valobj = Value()
+        valobj.body = body
+        valobj.type = SHARED_MEMORY
+        return valobj
+
+    def expire(self):
+        now = time.time()
+        while self.segments and self.segments[0][0] <= now:
+            _remove_segment(self.segments.popleft()[1])
+
+    def close(self):
+        while self.segments:
+            _remove_segment(self.segments.popleft()[1])
+
+
+def _remove_segment(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
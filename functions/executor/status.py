@@ -0,0 +1,126 @@
+#  Copyright 2018 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import time
+
+from include.functions_pb2 import *
+from . import utils
+
+# the minimum amount of time (in seconds) between two status updates
+STATUS_INTERVAL = .1
+
+# utilization changes smaller than this are not worth telling schedulers about
+UTILIZATION_DELTA = .05
+
+
+class StatusPublisher():
+    # Publishes an executor thread's ThreadStatus to the schedulers. Changes
+    # made between two updates are coalesced and sent at most once every
+    # STATUS_INTERVAL as a delta, which only contains the functions that were
+    # added or removed and the utilization if it changed noticeably. A thread
+    # that served a call sends a delta even if nothing else changed, which
+    # tells schedulers that it is ready for more. Every message carries a
+    # sequence number; a scheduler that misses a delta ignores later ones
+    # until the next full (periodic) status.
+    def __init__(self, schedulers, pusher_cache, status):
+        self.schedulers = schedulers
+        self.pusher_cache = pusher_cache
+        self.status = status
+
+        self.seq = 0
+        self.published = ThreadStatus()
+        self.last_publish = 0.0
+        self.dirty = False
+        self.served = False
+
+    # Sends the whole status; used for periodic reports and whenever the
+    # thread stops running.
+    def publish_full(self):
+        self.seq += 1
+        self.status.seq = self.seq
+        self.status.delta = False
+        self.status.type = PERIODIC
+
+        utils._push_status(self.schedulers, self.pusher_cache, self.status)
+
+        self.published.CopyFrom(self.status)
+        self.last_publish = time.time()
+        self.dirty = False
+        self.served = False
+
+    # Marks the status as changed (served is True after the thread ran a
+    # call); the delta is sent right away unless we have published too
+    # recently, in which case it waits for flush().
+    def update(self, served=False):
+        self.dirty = True
+        self.served = self.served or served
+        self.flush()
+
+    def flush(self):
+        if not self.dirty:
+            return
+
+        if time.time() - self.last_publish < STATUS_INTERVAL:
+            return
+
+        if self.published.running != self.status.running:
+            self.publish_full()
+            return
+
+        published = set(self.published.functions)
+        current = set(self.status.functions)
+
+        added = [f for f in self.status.functions if f not in published]
+        removed = [f for f in self.published.functions if f not in current]
+        util_change = abs(self.status.utilization -
+                          self.published.utilization) > UTILIZATION_DELTA
+
+        served = self.served
+        self.dirty = False
+        self.served = False
+        if not added and not removed and not util_change and not served:
+            return
+
+        self.seq += 1
+        delta = ThreadStatus()
+        delta.ip = self.status.ip
+        delta.tid = self.status.tid
+        delta.running = self.status.running
+        delta.type = POST_REQUEST
+        delta.seq = self.seq
+        delta.delta = True
+        delta.functions.extend(added)
+        delta.removed_functions.extend(removed)
+
+        if util_change:
+            delta.utilization = self.status.utilization
+
+        utils._push_status(self.schedulers, self.pusher_cache, delta)
+
+        # small utilization changes are not sent, so we keep comparing against
+        # the last value the schedulers actually received
+        utilization = self.published.utilization
+        self.published.CopyFrom(self.status)
+        if not util_change:
+            self.published.utilization = utilization
+
+        self.last_publish = time.time()
+
+    # How long (in ms) the caller can block before it has to call flush().
+    def timeout(self, default):
+        if not self.dirty:
+            return default
+
+        remaining = STATUS_INTERVAL - (time.time() - self.last_publish)
+        return max(0, min(default, int(remaining * 1000)))
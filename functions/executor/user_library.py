@@ -12,15 +12,30 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import asyncio
+from collections import OrderedDict
 import queue
 import threading
 import time
+import uuid
 import zmq
 
 from anna.zmq_util import SocketCache
 from include import server_utils
 from include import shared
 
+# How long (in ms) the inbox listener blocks before checking if it should exit.
+INBOX_POLL_TIMEOUT = 1000
+
+# Messages for a scope that has not been opened yet are held for up to this
+# long (in seconds), and at most this many of them are held at once.
+PENDING_MESSAGE_TTL = 10
+PENDING_MESSAGE_MAX = 1000
+
+# How many closed scopes we remember, so that late messages for them are
+# dropped rather than held.
+CLOSED_INBOX_HISTORY = 10000
+
 
 class AbstractFluentUserLibrary:
     # Stores a lattice value at ref.
@@ -43,11 +58,39 @@ class AbstractFluentUserLibrary:
         raise NotImplementedError
 
 
+class EventLoopAnnaClient():
+    # A blocking KVS client for user functions that run off an event loop,
+    # whose requests are made by an AsyncIpcAnnaClient on that loop; the
+    # asyncio executor gives it to its user library, so that user functions
+    # share the loop's client rather than blocking on one of their own. It
+    # must never be called from the loop's own thread, which would deadlock.
+    def __init__(self, client, loop):
+        self.client = client
+        self.loop = loop
+
+    def get(self, keys):
+        return self._run(self.client.get(keys))
+
+    def put(self, key, value):
+        return self._run(self.client.put(key, value))
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+
 class FluentUserLibrary(AbstractFluentUserLibrary):
 
     # ip: Executor IP.
     # tid: Executor thread ID.
-    # anna_client: The Anna client, used for interfacing with the kvs.
+    # anna_client: The Anna client, used for interfacing with the kvs; an
+    # IpcAnnaClient, or an EventLoopAnnaClient in the asyncio executor.
+    #
+    # A single FluentUserLibrary is created per executor thread and lives for
+    # the whole process; each invocation is handed its own view via scope(),
+    # so that we never rebind the inbox socket or restart the listener thread
+    # on the request path. Every scope has its own inbox, and messages are
+    # addressed to a scope (see getid()), so an invocation never receives
+    # messages that were meant for another one on the same thread.
     def __init__(self, ip, tid, anna_client):
         self.ctx = zmq.Context()
         self.send_socket_cache = SocketCache(self.ctx, zmq.PUSH)
@@ -56,14 +99,23 @@ class FluentUserLibrary(AbstractFluentUserLibrary):
         self.executor_tid = tid
         self.client = anna_client
 
-        # Threadsafe queue to serve as this node's inbox.
-        # Items are (sender string, message bytestring).
+        # The inbox of each open scope, by the scope's ID. Items are (sender
+        # ID, message bytestring).
         # NB: currently unbounded in size.
-        self.recv_inbox = queue.Queue()
+        self.recv_inboxes = {}
+        self.recv_inboxes_lock = threading.Lock()
+
+        # Messages for scopes that are not open yet, as lists of (arrival
+        # time, sender ID, message) by scope ID, oldest scope first, and the
+        # IDs of recently closed scopes.
+        self.pending_messages = OrderedDict()
+        self.num_pending = 0
+        self.closed_inboxes = OrderedDict()
 
         # Thread for receiving messages into our inbox.
         self.recv_inbox_thread = threading.Thread(
               target=self._recv_inbox_listener)
+        self.recv_inbox_thread.daemon = True
         self.recv_inbox_thread.do_run = True
         self.recv_inbox_thread.start()
 
@@ -76,32 +128,95 @@ class FluentUserLibrary(AbstractFluentUserLibrary):
 
         return self.client.get(ref)[ref]
 
-    def getid(self):
-        return (self.executor_ip, self.executor_tid)
+    def getid(self, inbox_id=None):
+        return (self.executor_ip, self.executor_tid, inbox_id)
 
-    # dest is currently (IP string, thread id int) of destination executor.
-    def send(self, dest, bytestr):
-        ip, tid = dest
+    # dest is the getid() of the destination invocation, i.e., (IP string,
+    # thread id int, inbox ID string).
+    def send(self, dest, bytestr, sender=None):
+        ip, tid, inbox_id = dest
         dest_addr = server_utils._get_user_msg_inbox_addr(ip, tid)
-        sender = (self.executor_ip, self.executor_tid)
+        if sender is None:
+            sender = self.getid()
 
         socket = self.send_socket_cache.get(dest_addr)
-        socket.send_pyobj((sender, bytestr))
+        socket.send_pyobj((sender, inbox_id, bytestr))
+
+    # Returns a view of this library that is only valid for a single
+    # invocation, with an inbox of its own. Messages that were sent to
+    # inbox_id before the scope was opened are delivered to it.
+    def scope(self, inbox_id=None):
+        if inbox_id is None:
+            inbox_id = str(uuid.uuid4())
 
+        inbox = queue.Queue()
+        with self.recv_inboxes_lock:
+            self.recv_inboxes[inbox_id] = inbox
+            self.closed_inboxes.pop(inbox_id, None)
+
+            pending = self.pending_messages.pop(inbox_id, [])
+            self.num_pending -= len(pending)
+
+        for _, sender, msg in pending:
+            inbox.put((sender, msg))
+
+        return FluentUserLibraryScope(self, inbox_id)
+
+    # Stops the inbox listener; only called when the executor shuts down.
     def close(self):
         self.recv_inbox_thread.do_run = False
         self.recv_inbox_thread.join()
 
-    def recv(self):
+    def recv(self, inbox_id=None):
+        with self.recv_inboxes_lock:
+            inbox = self.recv_inboxes.get(inbox_id)
+
         res = []
-        while True:
+        while inbox is not None:
             try:
-                (sender, msg) = self.recv_inbox.get(block=False)
+                (sender, msg) = inbox.get(block=False)
                 res.append((sender, msg))
             except queue.Empty:
                 break
         return res
 
+    # Drops the scope's inbox, along with any messages it never received.
+    def close_inbox(self, inbox_id):
+        with self.recv_inboxes_lock:
+            self.recv_inboxes.pop(inbox_id, None)
+
+            self.closed_inboxes[inbox_id] = True
+            if len(self.closed_inboxes) > CLOSED_INBOX_HISTORY:
+                self.closed_inboxes.popitem(last=False)
+
+    # Delivers a message that arrived for inbox_id. Messages for a scope that
+    # was closed are dropped; messages for one we have not seen yet are held
+    # until it is opened, within PENDING_MESSAGE_TTL and PENDING_MESSAGE_MAX.
+    def _deliver(self, inbox_id, sender, msg):
+        now = time.time()
+
+        with self.recv_inboxes_lock:
+            if inbox_id in self.recv_inboxes:
+                self.recv_inboxes[inbox_id].put((sender, msg))
+            elif inbox_id not in self.closed_inboxes:
+                if inbox_id not in self.pending_messages:
+                    self.pending_messages[inbox_id] = []
+                self.pending_messages[inbox_id].append((now, sender, msg))
+                self.num_pending += 1
+
+            self._expire_pending(now)
+
+    def _expire_pending(self, now):
+        while self.pending_messages:
+            inbox_id = next(iter(self.pending_messages))
+            oldest = self.pending_messages[inbox_id][0][0]
+
+            if self.num_pending <= PENDING_MESSAGE_MAX and \
+                    now - oldest <= PENDING_MESSAGE_TTL:
+                break
+
+            self.num_pending -= len(self.pending_messages.pop(inbox_id))
+
     # Function that continuously listens for send()s sent by other nodes,
     # and stores the messages in an inbox.
     def _recv_inbox_listener(self):
@@ -110,17 +225,58 @@ class FluentUserLibrary(AbstractFluentUserLibrary):
         recv_inbox_socket.bind(server_utils.BIND_ADDR_TEMPLATE %
                                (server_utils.RECV_INBOX_PORT +
                                 self.executor_tid))
+
+        poller = zmq.Poller()
+        poller.register(recv_inbox_socket, zmq.POLLIN)
         t = threading.currentThread()
 
         while t.do_run:
-            try:
-                (sender, msg) = recv_inbox_socket.recv_pyobj(zmq.NOBLOCK)
-                self.recv_inbox.put((sender, msg))
-            except zmq.ZMQError as e:
-                if e.errno == zmq.EAGAIN:
-                    continue
-                else:
-                    raise e
-            time.sleep(.010)
+            # We block until a message arrives; the timeout only bounds how
+            # long close() waits for this thread to notice do_run.
+            socks = dict(poller.poll(timeout=INBOX_POLL_TIMEOUT))
+            if recv_inbox_socket not in socks:
+                continue
+
+            # drain everything that is already queued on the socket
+            while True:
+                try:
+                    (sender, inbox_id, msg) = recv_inbox_socket.recv_pyobj(
+                        zmq.NOBLOCK)
+                except zmq.ZMQError as e:
+                    if e.errno == zmq.EAGAIN:
+                        break
+                    else:
+                        raise e
+
+                self._deliver(inbox_id, sender, msg)
 
         recv_inbox_socket.close()
+
+
+class FluentUserLibraryScope(AbstractFluentUserLibrary):
+
+    # A per-invocation view of a FluentUserLibrary. Its ID includes the ID of
+    # its inbox, so only messages sent to this invocation are received here,
+    # even if other invocations run on the same thread at the same time. Any
+    # messages that were never received are discarded on close().
+    def __init__(self, runtime, inbox_id):
+        self.runtime = runtime
+        self.inbox_id = inbox_id
+
+    def put(self, ref, ltc):
+        return self.runtime.put(ref, ltc)
+
+    def get(self, ref):
+        return self.runtime.get(ref)
+
+    def getid(self):
+        return self.runtime.getid(self.inbox_id)
+
+    def send(self, dest, bytestr):
+        return self.runtime.send(dest, bytestr, self.getid())
+
+    def recv(self):
+        return self.runtime.recv(self.inbox_id)
+
+    def close(self):
+        self.runtime.close_inbox(self.inbox_id)
@@ -12,6 +12,7 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import inspect
 import logging
 
 from include.functions_pb2 import *
@@ -24,16 +25,89 @@ UTILIZATION_REPORT_PORT = 7003
 EXECUTOR_DEPART_PORT = 7005
 
 
-def _retrieve_function(name, kvs):
+# version is the function's current version, if the caller has already read
+# it.
+def _retrieve_function(name, kvs, function_cache=None, version=None):
     kvs_name = server_utils._get_func_kvs_name(name)
-    result = kvs.get(kvs_name)
 
-    while not result:
-        logging.info("retrying get for function %s" % kvs_name)
-        result = kvs.get(kvs_name)
-    latt = result[kvs_name]
+    # if we have a cached copy of this function, we only need to check that it
+    # has not been re-registered since, which is a small metadata read
+    if function_cache is not None:
+        if version is None:
+            version = _retrieve_function_version(name, kvs)
 
-    return serializer.function_ser.load(latt.reveal()[1])
+        if version is not None:
+            func = function_cache.get(name, version)
+            if func is not None:
+                return func
+
+    latt = kvs.get(kvs_name)[kvs_name]
+
+    if latt is None:
+        return None
+
+    func = serializer.function_ser.load(latt.reveal()[1])
+    if function_cache is not None:
+        function_cache.put(name, latt.reveal()[0], func)
+
+    return func
+
+
+# Stateful functions are registered as classes. Executors create an instance
+# once, when they pin the function, and call it like a plain function; this
+# returns plain functions unchanged.
+def _create_instance(func):
+    if inspect.isclass(func):
+        return func()
+
+    return func
+
+
+# Calls the teardown method of an instance created by _create_instance, if its
+# class defines one.
+def _destroy_instance(func):
+    if inspect.isfunction(func) or not hasattr(func, 'teardown'):
+        return
+
+    try:
+        func.teardown()
+    except Exception as e:
+        logging.exception('Unexpected error %s while tearing down %s.' %
+                          (str(e), type(func).__name__))
+
+
+def _retrieve_function_version(name, kvs):
+    kvs_name = server_utils._get_func_metadata_kvs_name(name)
+    latt = kvs.get(kvs_name)[kvs_name]
+
+    # functions registered before we tracked metadata have no version
+    if latt is None:
+        return None
+
+    return latt.reveal()[0]
+
+
+# Returns the function's version along with its metadata, or (None, None).
+def _retrieve_function_metadata_version(name, kvs):
+    kvs_name = server_utils._get_func_metadata_kvs_name(name)
+    latt = kvs.get(kvs_name)[kvs_name]
+
+    if latt is None:
+        return None, None
+
+    func = Function()
+    func.ParseFromString(latt.reveal()[1])
+    return latt.reveal()[0], func
+
+
+# Records how much of this thread's utilization each pinned function accounts
+# for; function_utilization maps function names to their utilization.
+def _set_function_utilization(status, function_utilization):
+    status.ClearField('function_utilization')
+    for fname in status.functions:
+        futil = status.function_utilization.add()
+        futil.fname = fname
+        futil.utilization = function_utilization.get(fname, 0.0)
 
 
 def _push_status(schedulers, pusher_cache, status):
@@ -0,0 +1,271 @@
+#  Copyright 2018 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import bisect
+import http.server
+import logging
+import threading
+
+# the default histogram buckets (in seconds), which cover everything from a
+# cached KVS read to a slow function
+DEFAULT_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1,
+                   2.5, 5, 10)
+
+
+class MetricsRegistry():
+    # The counters, gauges and histograms of a process, rendered in the
+    # Prometheus text format for the metrics endpoint. Registering a metric
+    # under a name that already exists returns the existing metric, so the
+    # same metric can be declared wherever it is used. Metrics are only
+    # updated by the thread that owns them; the endpoint's thread only reads
+    # them.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._metrics = {}
+
+    def counter(self, name, doc, labelnames=()):
+        return self._register(Counter, name, doc, labelnames)
+
+    def gauge(self, name, doc, labelnames=()):
+        return self._register(Gauge, name, doc, labelnames)
+
+    def histogram(self, name, doc, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, doc, labelnames, buckets)
+
+    def render(self):
+        with self.lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, cls, name, doc, labelnames, *args):
+        with self.lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(self, name, doc, tuple(labelnames),
+                                          *args)
+
+            metric = self._metrics[name]
+
+        if type(metric) != cls:
+            raise ValueError('Metric %s is already registered as a %s.' %
+                             (name, metric.kind))
+
+        return metric
+
+
+class Metric():
+    kind = None
+
+    def __init__(self, registry, name, doc, labelnames):
+        self.registry = registry
+        self.name = name
+        self.doc = doc
+        self.labelnames = labelnames
+
+        self._children = {}
+
+    # Returns the metric for the given label values, which are in the same
+    # order as the metric's label names.
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError('Metric %s takes %d labels, not %d.' %
+                             (self.name, len(self.labelnames), len(values)))
+
+        if values not in self._children:
+            with self.registry.lock:
+                self._children[values] = self._new_child()
+
+        return self._children[values]
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.doc),
+                 '# TYPE %s %s' % (self.name, self.kind)]
+
+        with self.registry.lock:
+            children = list(self._children.items())
+
+        for values, child in children:
+            labels = list(zip(self.labelnames, values))
+            lines.extend(child.render(self.name, labels))
+
+        return lines
+
+    def _new_child(self):
+        raise NotImplementedError()
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def _new_child(self):
+        return _CounterValue()
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def _new_child(self):
+        return _GaugeValue()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, doc, labelnames,
+                 buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, doc, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+
+class _CounterValue():
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def render(self, name, labels):
+        return [_format_sample(name, labels, self.value)]
+
+
+class _GaugeValue():
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def render(self, name, labels):
+        return [_format_sample(name, labels, self.value)]
+
+
+class _HistogramValue():
+    def __init__(self, buckets):
+        self.buckets = buckets
+
+        # the number of observations in each bucket (not cumulative), with a
+        # final bucket for everything larger than the largest bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self, name, labels):
+        counts = list(self.counts)
+
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets, counts):
+            total += count
+            lines.append(_format_sample(name + '_bucket',
+                                        labels + [('le', repr(float(bound)))],
+                                        total))
+
+        total += counts[-1]
+        lines.append(_format_sample(name + '_bucket',
+                                    labels + [('le', '+Inf')], total))
+        lines.append(_format_sample(name + '_sum', labels, self.sum))
+        lines.append(_format_sample(name + '_count', labels, total))
+
+        return lines
+
+
+def _format_sample(name, labels, value):
+    if not labels:
+        return '%s %s' % (name, repr(float(value)))
+
+    labels = ','.join('%s="%s"' % (label, _escape(value)) for label, value in
+                      labels)
+    return '%s{%s} %s' % (name, labels, repr(float(value)))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+# the registry every metric in this process is registered with by default
+REGISTRY = MetricsRegistry()
+
+
+def counter(name, doc, labelnames=()):
+    return REGISTRY.counter(name, doc, labelnames)
+
+
+def gauge(name, doc, labelnames=()):
+    return REGISTRY.gauge(name, doc, labelnames)
+
+
+def histogram(name, doc, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.histogram(name, doc, labelnames, buckets)
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = self.server.registry.render().encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # scrapes are frequent, so we do not log each of them
+    def log_message(self, format, *args):
+        pass
+
+
+# Serves the registry's metrics over HTTP on port, from a daemon thread, and
+# returns the server (or None if the port could not be bound). This must only
+# be called after any worker processes have been forked.
+def start_metrics_server(port, registry=REGISTRY):
+    try:
+        server = http.server.HTTPServer(('', port), _MetricsHandler)
+    except OSError as e:
+        logging.error('Unable to start metrics server on port %d: %s' %
+                      (port, str(e)))
+        return None
+
+    server.registry = registry
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    logging.info('Serving metrics on port %d.' % (port))
+    return server
@@ -12,17 +12,34 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+from anna.lattices import LWWPairLattice
 import cloudpickle as cp
 import pyarrow as pa
 import codecs
+import hashlib
 from io import BytesIO
 import numpy as np
+import os
+import uuid
 
 from .functions_pb2 import *
+from . import metrics
 from . import shared
 
 SER_FORMAT = 'raw_unicode_escape'
 
+# where NumPy arrays that are handed between executor threads on the same node
+# are written; this is a memory-backed file system on Linux
+SHM_DIR = '/dev/shm'
+
+# arguments and intermediate results that serialize to more than this many
+# bytes are stored in the KVS, and passed on as a FluentReference
+SPILL_THRESHOLD = 1024 * 1024
+SPILL_PREFIX = 'spill/'
+
+SERIALIZED_BYTES = metrics.counter('fluent_serialized_bytes_total',
+                                   'Bytes of values serialized.')
+
 
 class Serializer():
     def __init__(self):
@@ -81,24 +98,56 @@ class NumpySerializer(DefaultSerializer):
         pass
 
     def dump(self, msg):
-        return pa.serialize(msg).to_buffer().to_pybytes()
+        return self.dump_buffer(msg).to_pybytes()
+
+    # Returns the serialized array as a buffer, without copying it into a
+    # bytes object; load accepts such a buffer as well.
+    def dump_buffer(self, msg):
+        return pa.serialize(msg).to_buffer()
 
     def load(self, msg):
         return pa.deserialize(msg)
 
 
+# Writes a NumPy array once to a new file in SHM_DIR, and only passes around
+# the file's path. Readers map the file read-only instead of copying it, so
+# this only works between processes on the same node.
+class SharedMemorySerializer(DefaultSerializer):
+    def __init__(self):
+        pass
+
+    def dump(self, msg):
+        path = os.path.join(SHM_DIR, 'fluent-' + uuid.uuid4().hex + '.npy')
+
+        try:
+            np.save(path, msg, allow_pickle=False)
+        except Exception:
+            # don't leave a partially written array behind
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+
+        return path.encode()
+
+    def load(self, msg):
+        return np.load(msg.decode(), mmap_mode='r')
+
+
 numpy_ser = NumpySerializer()
 default_ser = DefaultSerializer()
 string_ser = StringSerializer()
+shm_ser = SharedMemorySerializer()
 
 function_ser = default_ser
 
 
 def get_serializer(kind):
-    global numpy_ser, default_ser, string_ser
+    global numpy_ser, default_ser, string_ser, shm_ser
 
     if kind == NUMPY:
         return numpy_ser
+    elif kind == SHARED_MEMORY:
+        return shm_ser
     elif kind == STRING:
         return string_ser
     elif kind == DEFAULT:
@@ -114,18 +163,48 @@ def serialize_val(val, valobj=None, serialize=True):
     if isinstance(val, shared.FluentFuture):
         valobj.body = default_ser.dump(shared.FluentReference(val.obj_id,
                                        True, LWW))
+        valobj.reference.key = val.obj_id
+    elif isinstance(val, shared.FluentReference):
+        valobj.body = default_ser.dump(val)
+        valobj.reference.key = val.key
     elif isinstance(val, np.ndarray):
         valobj.body = numpy_ser.dump(val)
         valobj.type = NUMPY
     else:
         valobj.body = default_ser.dump(val)
 
+    SERIALIZED_BYTES.inc(len(valobj.body))
+
     if not serialize:
         return valobj
 
     return valobj.SerializeToString()
 
 
+# Stores valobj, a serialized Value, in the KVS, and returns a Value holding a
+# reference to it to pass on in its place.
+def spill_val(kvs, valobj):
+    key, lattice, refobj = get_spill(valobj)
+    kvs.put(key, lattice)
+
+    return refobj
+
+
+# Returns the key and the lattice to store valobj under, and the Value holding
+# a reference to it. Spilled values are keyed by a hash of their contents, so
+# spilling the same value again reuses its key rather than leaving another
+# copy behind. The KVS has no deletes, so spilled values are never removed.
+def get_spill(valobj):
+    payload = valobj.SerializeToString()
+    key = SPILL_PREFIX + hashlib.sha256(payload).hexdigest()
+    lattice = LWWPairLattice(shared.generate_timestamp(0), payload)
+
+    refobj = serialize_val(shared.FluentReference(key, True, LWW),
+                           serialize=False)
+    refobj.reference.size = len(payload)
+    return key, lattice, refobj
+
+
 def deserialize_val(val):
     v = Value()
     v.ParseFromString(val)
@@ -136,3 +215,5 @@ def deserialize_val(val):
         return string_ser.load(v.body)
     elif v.type == NUMPY:
         return numpy_ser.load(v.body)
+    elif v.type == SHARED_MEMORY:
+        return shm_ser.load(v.body)
@@ -12,10 +12,14 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+from collections import namedtuple, OrderedDict
+
 from .functions_pb2 import *
 
 # shared constants
 FUNC_PREFIX = 'funcs/'
+FUNC_METADATA_PREFIX = 'funcs-metadata/'
+PROFILE_PREFIX = 'profiles/'
 BIND_ADDR_TEMPLATE = 'tcp://*:%d'
 
 PIN_PORT = 4000
@@ -24,15 +28,20 @@ FUNC_EXEC_PORT = 4020
 DAG_QUEUE_PORT = 4030
 DAG_EXEC_PORT = 4040
 SELF_DEPART_PORT = 4050
+METRICS_PORT = 4060
 
 STATUS_PORT = 5007
 SCHED_UPDATE_PORT = 5008
 BACKOFF_PORT = 5009
 PIN_ACCEPT_PORT = 5010
+SCHEDULER_METRICS_PORT = 5011
 
 # For message sending via the user library.
 RECV_INBOX_PORT = 5500
 
+# the most DAG indices each process keeps around
+DAG_INDEX_CACHE_SIZE = 1024
+
 STATISTICS_REPORT_PORT = 7006
 
 # create generic error response
@@ -49,6 +58,15 @@ def _get_func_kvs_name(fname):
     return FUNC_PREFIX + fname
 
 
+def _get_func_metadata_kvs_name(fname):
+    return FUNC_METADATA_PREFIX + fname
+
+
+# The key the profiles of a profiled request are stored under.
+def _get_profile_kvs_name(request_id):
+    return PROFILE_PREFIX + request_id
+
+
 def _get_dag_trigger_address(ip_tid):
     ip, tid = ip_tid.split(':')
     return 'tcp://' + ip + ':' + str(int(tid) + DAG_EXEC_PORT)
@@ -66,14 +84,83 @@ def _get_pin_accept_port(ip):
     return 'tcp://' + ip + ':' + str(PIN_ACCEPT_PORT)
 
 
+# Returns the Reference metadata of the FluentReferences among args, which are
+# serialized Values.
+def _get_references(args):
+    return [arg.reference for arg in args if arg.HasField('reference')]
+
+
 def _get_dag_predecessors(dag, fname):
-    result = []
+    return list(_get_dag_index(dag).predecessors[fname])
+
+
+# The topology of a DAG, which does not change once the DAG is created:
+# predecessors, successors and descendants map each function to a tuple (or a
+# frozenset, for descendants) of functions, and order lists the functions in
+# topological order.
+DagIndex = namedtuple('DagIndex', ['predecessors', 'successors',
+                                   'descendants', 'order', 'sources',
+                                   'sinks'])
+
+_dag_indices = OrderedDict()
+
+
+# Returns the index of dag, which is only built the first time a version of a
+# DAG is seen, so that per-call graph lookups do not walk its connections.
+def _get_dag_index(dag):
+    key = (dag.name, dag.version)
+
+    if key in _dag_indices:
+        _dag_indices.move_to_end(key)
+        return _dag_indices[key]
+
+    index = _build_dag_index(dag)
+    _dag_indices[key] = index
+
+    if len(_dag_indices) > DAG_INDEX_CACHE_SIZE:
+        _dag_indices.popitem(last=False)
+
+    return index
+
+
+def _build_dag_index(dag):
+    predecessors = {fname: [] for fname in dag.functions}
+    successors = {fname: [] for fname in dag.functions}
+
+    for conn in dag.connections:
+        predecessors[conn.sink].append(conn.source)
+        successors[conn.source].append(conn.sink)
+
+    sources = tuple(fname for fname in dag.functions if not
+                    predecessors[fname])
+    sinks = tuple(fname for fname in dag.functions if not successors[fname])
+
+    order = []
+    remaining = {fname: len(predecessors[fname]) for fname in dag.functions}
+    ready = list(sources)
+    while ready:
+        fname = ready.pop()
+        order.append(fname)
+
+        for sink in successors[fname]:
+            remaining[sink] -= 1
+            if remaining[sink] == 0:
+                ready.append(sink)
 
-    for connection in dag.connections:
-        if connection.sink == fname:
-            result.append(connection.source)
+    # in reverse topological order, each function's successors have their
+    # descendants computed already
+    descendants = {}
+    for fname in reversed(order):
+        result = set(successors[fname])
+        for sink in successors[fname]:
+            result |= descendants[sink]
+        descendants[fname] = frozenset(result)
 
-    return result
+    return DagIndex({fname: tuple(predecessors[fname]) for fname in
+                     predecessors},
+                    {fname: tuple(successors[fname]) for fname in
+                     successors},
+                    descendants, tuple(order), sources, sinks)
 
 
 def _get_user_msg_inbox_addr(ip, tid):
@@ -12,6 +12,7 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import asyncio
 import time
 
 from .functions_pb2 import *
@@ -25,6 +26,11 @@ DAG_CREATE_PORT = 5004
 DAG_CALL_PORT = 5005
 DAG_DELETE_PORT = 5006
 
+# the first and the largest interval (in seconds) between two reads of a key
+# that has not been written yet; the interval doubles after every empty read
+WAIT_MIN_INTERVAL = .001
+WAIT_MAX_INTERVAL = .05
+
 
 def generate_timestamp(tid=1):
     t = time.time()
@@ -36,16 +42,77 @@ def generate_timestamp(tid=1):
     return int(t * p + tid)
 
 
+class WaitTimeoutError(Exception):
+    def __init__(self, keys, timeout):
+        super().__init__('Timed out after %.3f seconds waiting for %s.' %
+                         (timeout, str(keys)))
+        self.keys = keys
+        self.timeout = timeout
+
+
+# Calls read until it returns something truthy, backing off exponentially
+# between attempts so that a key that is slow to appear does not flood the
+# KVS with requests. If timeout (in seconds) is set and passes first, this
+# raises a WaitTimeoutError naming keys.
+def wait_for(read, keys, timeout=None):
+    deadline = None if timeout is None else time.time() + timeout
+    interval = WAIT_MIN_INTERVAL
+
+    result = read()
+    while not result:
+        interval = _next_wait_interval(interval, deadline, keys, timeout)
+        result = read()
+
+    return result
+
+
+# The asyncio version of wait_for; read is a coroutine function.
+async def wait_for_async(read, keys, timeout=None):
+    deadline = None if timeout is None else time.time() + timeout
+    interval = WAIT_MIN_INTERVAL
+
+    result = await read()
+    while not result:
+        interval = await _next_wait_interval_async(interval, deadline, keys,
+                                                   timeout)
+        result = await read()
+
+    return result
+
+
+def _next_wait_interval(interval, deadline, keys, timeout):
+    time.sleep(_get_wait_sleep(interval, deadline, keys, timeout))
+    return min(interval * 2, WAIT_MAX_INTERVAL)
+
+
+async def _next_wait_interval_async(interval, deadline, keys, timeout):
+    await asyncio.sleep(_get_wait_sleep(interval, deadline, keys, timeout))
+    return min(interval * 2, WAIT_MAX_INTERVAL)
+
+
+def _get_wait_sleep(interval, deadline, keys, timeout):
+    if deadline is None:
+        return interval
+
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        raise WaitTimeoutError(keys, timeout)
+
+    return min(interval, remaining)
+
+
 class FluentFuture():
-    def __init__(self, obj_id, kvs_client):
+    # profile_id is set if the call that produces this result is profiled.
+    def __init__(self, obj_id, kvs_client, profile_id=None):
         self.obj_id = obj_id
         self.kvs_client = kvs_client
+        self.profile_id = profile_id
 
-    def get(self):
-        obj = self.kvs_client.get(self.obj_id)
-
-        while not obj:
-            obj = self.kvs_client.get(self.obj_id)
+    # Blocks until the result has been written. If timeout (in seconds) is
+    # set, this raises a WaitTimeoutError once it has passed.
+    def get(self, timeout=None):
+        obj = wait_for(lambda: self.kvs_client.get(self.obj_id), self.obj_id,
+                       timeout)
 
         return serializer.deserialize_val(obj.reveal()[1])
 
@@ -56,7 +123,11 @@ class FluentFunction():
         self._conn = conn
         self._kvs_client = kvs_client
 
-    def __call__(self, *args):
+    def __call__(self, *args, profile=False):
+        if profile:
+            obj_id, profile_id = self._conn.exec_func(self.name, args, True)
+            return FluentFuture(obj_id, self._kvs_client, profile_id)
+
         obj_id = self._conn.exec_func(self.name, args)
         return FluentFuture(obj_id, self._kvs_client)
 
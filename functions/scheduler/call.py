@@ -13,22 +13,24 @@
 #  limitations under the License.
 
 import logging
-import random
 import uuid
-import time
 import zmq
 
 from include.functions_pb2 import *
-from include.serializer import *
+from include import metrics
 from include import server_utils as sutils
 from include.shared import *
 from . import utils
 
-sys_random = random.SystemRandom()
+FUNCTION_CALLS = metrics.counter('fluent_scheduler_function_calls_total',
+                                 'Function calls scheduled, by function.',
+                                 ['function'])
+DAG_CALLS = metrics.counter('fluent_scheduler_dag_calls_total',
+                            'DAG calls scheduled, by DAG.', ['dag'])
 
 
-def call_function(func_call_socket, pusher_cache, executors, key_ip_map,
-                  running_counts, backoff):
+def call_function(func_call_socket, pusher_cache, placement,
+                  cache_summaries):
 
     call = FunctionCall()
     call.ParseFromString(func_call_socket.recv())
@@ -36,54 +38,78 @@ def call_function(func_call_socket, pusher_cache, executors, key_ip_map,
     if not call.HasField('resp_id'):
         call.resp_id = str(uuid.uuid4())
 
-    refs = list(filter(lambda arg: type(arg) == FluentReference,
-                       map(lambda arg: get_serializer(arg.type).load(arg.body),
-                           call.args)))
+    FUNCTION_CALLS.labels(call.name).inc()
 
-    ip, tid = _pick_node(executors, key_ip_map, refs, running_counts, backoff)
+    refs = sutils._get_references(call.args)
+    cache_summaries.record_sizes(refs)
 
+    # the thread stays available after this call; placement already counts
+    # the call towards its load
+    loc = placement.pick(cache_summaries, refs,
+                         object_sizes=cache_summaries.sizes)
+    if loc is None:
+        logging.info('No executors available for a call to %s.' %
+                     (call.name))
+        r = GenericResponse()
+        r.success = False
+        r.error = NO_RESOURCES
+
+        func_call_socket.send(r.SerializeToString())
+        return
+
+    ip, tid = loc
     sckt = pusher_cache.get(utils._get_exec_address(ip, tid))
     sckt.send(call.SerializeToString())
 
-    executors.discard((ip, tid))
-
     r = GenericResponse()
     r.success = True
     r.response_id = call.resp_id
 
+    if call.profile:
+        r.profile_id = sutils._get_profile_kvs_name(call.resp_id)
+
     func_call_socket.send(r.SerializeToString())
 
 
-def call_dag(call, pusher_cache, dags, func_locations, key_ip_map,
-             running_counts, backoff):
+# Returns the ID of the DAG's schedule, or None if one of its functions has
+# no executor to run on, in which case nothing was sent.
+def call_dag(call, pusher_cache, dags, func_locations, cache_summaries,
+             placement):
     dag, sources = dags[call.name]
+    DAG_CALLS.labels(call.name).inc()
 
     schedule = DagSchedule()
     schedule.id = str(uuid.uuid4())
     schedule.dag.CopyFrom(dag)
     schedule.consistency = NORMAL
+    schedule.profile = call.profile
     if call.HasField('response_address'):
         schedule.response_address = call.response_address
 
     for fname in dag.functions:
         locations = func_locations[fname]
-        args = call.function_args[fname].args
+        refs = sutils._get_references(call.function_args[fname].args)
+        cache_summaries.record_sizes(refs)
 
-        refs = list(filter(lambda arg: type(arg) == FluentReference,
-                    map(lambda arg: get_serializer(arg.type).load(arg.body),
-                        args)))
-        loc = _pick_node(locations, key_ip_map, refs, running_counts, backoff)
-        schedule.locations[fname] = loc[0] + ':' + str(loc[1])
+        loc = placement.pick(cache_summaries, refs, locations,
+                             cache_summaries.sizes)
+        if loc is None:
+            logging.info('No executors available for function %s of DAG %s.'
+                         % (fname, dag.name))
+            return None
 
-        # copy over arguments into the dag schedule
-        arg_list = schedule.arguments[fname]
-        arg_list.args.extend(args)
+        schedule.locations[fname] = loc[0] + ':' + str(loc[1])
 
     for func in schedule.locations:
         loc = schedule.locations[func].split(':')
         ip = utils._get_queue_address(loc[0], loc[1])
         schedule.target_function = func
 
+        # functions in a normal DAG only read their own arguments, so we do
+        # not copy every function's arguments into every schedule
+        schedule.ClearField('arguments')
+        schedule.arguments[func].args.extend(call.function_args[func].args)
+
         triggers = sutils._get_dag_predecessors(dag, func)
         if len(triggers) == 0:
             triggers.append('BEGIN')
@@ -105,75 +131,3 @@ def call_dag(call, pusher_cache, dags, func_locations, key_ip_map,
         sckt.send(trigger.SerializeToString())
 
     return schedule.id
-
-
-def _pick_node(valid_executors, key_ip_map, refs, running_counts, backoff):
-    # Construct a map which maps from IP addresses to the number of
-    # relevant arguments they have cached. For the time begin, we will
-    # just pick the machine that has the most number of keys cached.
-    arg_map = {}
-    reason = ''
-
-    executors = set(valid_executors)
-    for executor in backoff:
-        if len(executors) > 1:
-            executors.discard(executor)
-
-    keys = list(running_counts.keys())
-    sys_random.shuffle(keys)
-    for key in keys:
-        if len(running_counts[key]) > 1000 and len(executors) > 1:
-            executors.discard(key)
-
-    executors = set(valid_executors)
-    for executor in backoff:
-        if len(executors) > 1:
-            executors.discard(executor)
-
-    keys = list(running_counts.keys())
-    sys_random.shuffle(keys)
-    for key in keys:
-        if len(running_counts[key]) > 1000 and len(executors) > 1:
-            executors.discard(key)
-
-    executor_ips = [e[0] for e in executors]
-
-    for ref in refs:
-        if ref.key in key_ip_map:
-            ips = key_ip_map[ref.key]
-
-            for ip in ips:
-                # only choose this cached node if its a valid executor for our
-                # purposes
-                if ip in executor_ips:
-                    if ip not in arg_map:
-                        arg_map[ip] = 0
-
-                    arg_map[ip] += 1
-
-    max_ip = None
-    max_count = 0
-    for ip in arg_map.keys():
-        if arg_map[ip] > max_count:
-            max_count = arg_map[ip]
-            max_ip = ip
-
-    # pick a random thead from our potential executors that is on that IP
-    # address; we also route some requests to a random valid node
-    if max_ip:
-        candidates = list(filter(lambda e: e[0] == max_ip, executors))
-        max_ip = sys_random.choice(candidates)
-
-    # This only happens if max_ip is never set, and that means that
-    # there were no machines with any of the keys cached. In this case,
-    # we pick a random IP that was in the set of IPs that was running
-    # most recently.
-    if not max_ip or sys_random.random() < 0.20:
-        max_ip = sys_random.sample(executors, 1)[0]
-
-    if max_ip not in running_counts:
-        running_counts[max_ip] = set()
-
-    running_counts[max_ip].add(time.time())
-
-    return max_ip
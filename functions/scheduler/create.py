@@ -34,9 +34,17 @@ def create_func(func_create_socket, kvs):
     name = sutils._get_func_kvs_name(func.name)
     logging.info('Creating function %s.' % (name))
 
-    body = LWWPairLattice(generate_timestamp(0), func.body)
+    ts = generate_timestamp(0)
+    body = LWWPairLattice(ts, func.body)
     kvs.put(name, body)
 
+    # we also store a body-less copy of the function under the same
+    # timestamp, so that executors can cheaply check whether the version they
+    # have cached is still current
+    func.body = b''
+    metadata = LWWPairLattice(ts, func.SerializeToString())
+    kvs.put(sutils._get_func_metadata_kvs_name(func.name), metadata)
+
     funcs = utils._get_func_list(kvs, '', fullname=True)
     funcs.append(name)
     utils._put_func_list(kvs, funcs)
@@ -46,7 +54,7 @@ def create_func(func_create_socket, kvs):
 
 def create_dag(dag_create_socket, pusher_cache, kvs, executors, dags, ip,
                pin_accept_socket, func_locations, call_frequency,
-               num_replicas=1):
+               thread_statuses, num_replicas=1):
     serialized = dag_create_socket.recv()
 
     dag = Dag()
@@ -58,12 +66,13 @@ def create_dag(dag_create_socket, pusher_cache, kvs, executors, dags, ip,
         dag_create_socket.send(sutils.error.SerializeToString())
         return
 
-    payload = LWWPairLattice(generate_timestamp(0), serialized)
+    dag.version = generate_timestamp(0)
+
+    payload = LWWPairLattice(generate_timestamp(0), dag.SerializeToString())
     kvs.put(dag.name, payload)
 
-    pin_locations = {}
+    pinned = []
     for fname in dag.functions:
-        candidates = set(executors)
         ip_func_map = {}
         for fn in func_locations:
             for loc in func_locations[fn]:
@@ -71,21 +80,17 @@ def create_dag(dag_create_socket, pusher_cache, kvs, executors, dags, ip,
                     ip_func_map[loc] = set()
                 ip_func_map[loc].add(fn)
 
-        for thread in ip_func_map:
-            candidates.discard(thread)
+        # a thread can take this function if it does not already have it and
+        # it has room for another function
+        candidates = set()
+        for thread in executors:
+            funcs = ip_func_map.get(thread, set())
+            if fname not in funcs and \
+                    len(funcs) < _get_capacity(thread, thread_statuses):
+                candidates.add(thread)
 
         for _ in range(num_replicas):
-            if len(candidates) == 0:
-                sutils.error.error = NO_RESOURCES
-                dag_create_socket.send(sutils.error.SerializeToString())
-
-                # unpin any previously pinned functions because the operation
-                # failed
-                for loc in pin_locations:
-                    _unpin_func(pin_locations[loc], loc, pusher_cache)
-                return
-
-            result = _pin_func(fname, func_locations, candidates,
+            result = _pin_func(fname, candidates, thread_statuses,
                                pin_accept_socket, ip, pusher_cache)
 
             if result is None:
@@ -95,8 +100,8 @@ def create_dag(dag_create_socket, pusher_cache, kvs, executors, dags, ip,
 
                 # unpin any previously pinned functions because the operation
                 # failed
-                for loc in pin_locations:
-                    _unpin_func(pin_locations[loc], loc, pusher_cache)
+                for pinned_fname, loc in pinned:
+                    _unpin_func(pinned_fname, loc, pusher_cache)
                 return
 
             node, tid = result
@@ -109,14 +114,14 @@ def create_dag(dag_create_socket, pusher_cache, kvs, executors, dags, ip,
 
             func_locations[fname].add((node, tid))
             candidates.remove((node, tid))
-            pin_locations[(node, tid)] = fname
+            pinned.append((fname, (node, tid)))
 
     dags[dag.name] = (dag, utils._find_dag_source(dag))
     dag_create_socket.send(sutils.ok_resp)
 
 
 def delete_dag(dag_delete_socket, pusher_cache, dags, func_locations,
-               call_frequency, executors):
+               call_frequency):
     dag_name = dag_delete_socket.recv_string()
 
     if dag_name not in dags:
@@ -130,7 +135,6 @@ def delete_dag(dag_delete_socket, pusher_cache, dags, func_locations,
         locs = func_locations[fname]
         for location in locs:
             _unpin_func(fname, location, pusher_cache)
-            executors.discard(location)
 
         del func_locations[fname]
         del call_frequency[fname]
@@ -140,26 +144,12 @@ def delete_dag(dag_delete_socket, pusher_cache, dags, func_locations,
     logging.info('DAG %s deleted.' % (dag_name))
 
 
-def _pin_func(fname, ip_func_map, candidates, pin_accept_socket, ip,
+def _pin_func(fname, candidates, thread_statuses, pin_accept_socket, ip,
               pusher_cache):
-    # pick the node with the fewest functions pinned
-    min_count = 1000000
-    min_ip = None
-
     if len(candidates) == 0:
         return None
 
-    for candidate in candidates:
-        if candidate in ip_func_map:
-            count = len(ip_func_map[candidate])
-        else:
-            count = 0
-
-        if count < min_count:
-            min_count = count
-            min_ip = candidate
-
-    node, tid = min_ip
+    node, tid = utils._choose_pin_target(candidates, thread_statuses)
 
     sckt = pusher_cache.get(utils._get_pin_address(node, tid))
     msg = ip + ':' + fname
@@ -172,8 +162,8 @@ def _pin_func(fname, ip_func_map, candidates, pin_accept_socket, ip,
         logging.error('Pin operation to %s:%d timed out. Retrying.' %
                       (node, tid))
         # request timed out, try again
-        return _pin_func(fname, ip_func_map, candidates, pin_accept_socket, ip,
-                         pusher_cache)
+        return _pin_func(fname, candidates, thread_statuses,
+                         pin_accept_socket, ip, pusher_cache)
 
     if resp.success:
         return node, tid
@@ -182,8 +172,16 @@ def _pin_func(fname, ip_func_map, candidates, pin_accept_socket, ip,
                       % (node, tid, fname))
 
         candidates.discard((node, tid))
-        return _pin_func(fname, ip_func_map, candidates, pin_accept_socket, ip,
-                         pusher_cache)
+        return _pin_func(fname, candidates, thread_statuses,
+                         pin_accept_socket, ip, pusher_cache)
+
+
+# Threads we have not heard from yet are assumed to have the default capacity.
+def _get_capacity(thread, thread_statuses):
+    if thread in thread_statuses:
+        return thread_statuses[thread].capacity
+
+    return ThreadStatus().capacity
 
 
 def _unpin_func(fname, loc, pusher_cache):
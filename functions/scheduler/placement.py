@@ -0,0 +1,315 @@
+#  Copyright 2018 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from collections import deque
+import random
+import time
+
+# how long (in seconds) a call counts towards its executor's load, how many
+# buckets that window is split into, and how many recent calls make an
+# executor too busy to be picked
+LOAD_WINDOW = 2.5
+LOAD_BUCKETS = 10
+OVERLOAD_CALLS = 1000
+
+# how long (in seconds) an executor that asked us to back off is avoided
+BACKOFF_PERIOD = 5
+
+# the size (in bytes) we assume for a referenced object whose size we do not
+# know; these are mostly small, since caches report every large object
+DEFAULT_OBJECT_SIZE = 1024
+
+# the share of calls that ignore locality and go to a random executor, so
+# that load spreads out even when one node caches everything
+LOCALITY_BYPASS = .2
+
+sys_random = random.SystemRandom()
+
+
+class IndexedSet():
+    # A set that can also pick a uniformly random element in constant time.
+    # Elements are kept in a list, along with each element's position in it;
+    # removing an element moves the last one into its slot.
+    def __init__(self, items=()):
+        self._items = []
+        self._positions = {}
+
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        if item not in self._positions:
+            self._positions[item] = len(self._items)
+            self._items.append(item)
+
+    def discard(self, item):
+        if item not in self._positions:
+            return
+
+        pos = self._positions.pop(item)
+        last = self._items.pop()
+        if pos < len(self._items):
+            self._items[pos] = last
+            self._positions[last] = pos
+
+    def __contains__(self, item):
+        return item in self._positions
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(list(self._items))
+
+    def __getitem__(self, index):
+        return self._items[index]
+
+
+class WindowCounter():
+    # Counts events over the last window seconds, in a ring of buckets that
+    # each cover an equal slice of the window. Moving the window forward
+    # clears the buckets that fell out of it, so adding and reading both
+    # take at most one pass over the (fixed number of) buckets, however many
+    # events there were. Events are expired a bucket at a time; we keep one
+    # bucket more than the window needs, so the count includes every event
+    # in the window, and may include events up to one bucket older than it.
+    def __init__(self, window=LOAD_WINDOW, num_buckets=LOAD_BUCKETS):
+        self.width = window / num_buckets
+        self.buckets = [0] * (num_buckets + 1)
+        self.total = 0
+
+        # the (absolute) number of the newest bucket
+        self._latest = None
+
+    def add(self, now, count=1):
+        self._advance(now)
+
+        self.buckets[self._latest % len(self.buckets)] += count
+        self.total += count
+
+    def get(self, now):
+        self._advance(now)
+        return self.total
+
+    def _advance(self, now):
+        latest = int(now / self.width)
+
+        if self._latest is None:
+            self._latest = latest
+            return
+
+        steps = min(latest - self._latest, len(self.buckets))
+        for step in range(1, steps + 1):
+            slot = (self._latest + step) % len(self.buckets)
+            self.total -= self.buckets[slot]
+            self.buckets[slot] = 0
+
+        self._latest = max(self._latest, latest)
+
+
+class PlacementIndex():
+    # The executor threads that calls can be placed on, kept up to date as
+    # status, backoff and call events arrive rather than rebuilt on every
+    # call. Threads that asked us to back off or that are overloaded are
+    # unavailable; they are only picked if there is nothing else. Placement
+    # goes to the node that caches the most referenced keys, and between two
+    # random threads picks the one with fewer recent calls, so a decision
+    # does not depend on the size of the cluster.
+    def __init__(self):
+        # every executor thread, and the threads that are not excluded
+        self.executors = IndexedSet()
+        self.available = IndexedSet()
+
+        # the available threads on each node
+        self._node_threads = {}
+
+        # the time each backed-off thread asked us to back off, and the
+        # backoff requests in the order they expire in
+        self.backoff = {}
+        self._backoff_queue = deque()
+
+        # the number of recent calls placed on each thread
+        self.loads = {}
+
+        self._overloaded = set()
+
+    def add_executor(self, thread):
+        self.executors.add(thread)
+        self._update(thread)
+
+    def remove_executor(self, thread):
+        self.executors.discard(thread)
+        self._update(thread)
+
+    def set_backoff(self, thread, now):
+        self.backoff[thread] = now
+        self._backoff_queue.append((now, thread))
+        self._update(thread)
+
+    def record_call(self, thread, now):
+        if thread not in self.loads:
+            self.loads[thread] = WindowCounter()
+
+        self.loads[thread].add(now)
+        if thread not in self._overloaded and \
+                self.loads[thread].total > OVERLOAD_CALLS:
+            self._overloaded.add(thread)
+            self._update(thread)
+
+    # Forgets backoff requests that are too old to matter, and lets threads
+    # whose load has come down be picked again. This only looks at expired
+    # backoff requests and at overloaded threads, not at every thread.
+    def expire(self, now):
+        for thread in list(self._overloaded):
+            if self.get_load(thread, now) <= OVERLOAD_CALLS:
+                self._overloaded.discard(thread)
+                self._update(thread)
+
+        while self._backoff_queue and now - self._backoff_queue[0][0] > \
+                BACKOFF_PERIOD:
+            requested, thread = self._backoff_queue.popleft()
+
+            # a thread that asked again since has a later entry queued
+            if self.backoff.get(thread) == requested:
+                del self.backoff[thread]
+                self._update(thread)
+
+    def get_load(self, thread, now):
+        if thread not in self.loads:
+            return 0
+
+        return self.loads[thread].get(now)
+
+    # Picks a thread for a call that references refs (anything with a key,
+    # and optionally a size). key_locations.get(key, default) returns the
+    # nodes that cache key, and object_sizes.get(key, default), if given,
+    # the size of the object.
+    # If valid_executors is given (e.g., the threads a DAG function is pinned
+    # on), the thread is one of those; otherwise, it is any executor thread.
+    # Returns None if there is no thread to pick from.
+    def pick(self, key_locations, refs, valid_executors=None,
+             object_sizes=None):
+        if valid_executors is None:
+            candidates = self.available
+            node_threads = self._node_threads
+
+            if len(candidates) == 0:
+                candidates = self.executors
+                node_threads = None
+        else:
+            # these are the threads a function is pinned on, of which there
+            # are few, so we filter them directly
+            candidates = [thread for thread in valid_executors if thread not
+                          in self.backoff and thread not in self._overloaded]
+            if len(candidates) == 0:
+                candidates = list(valid_executors)
+
+            node_threads = {}
+            for thread in candidates:
+                if thread[0] not in node_threads:
+                    node_threads[thread[0]] = []
+                node_threads[thread[0]].append(thread)
+
+        if len(candidates) == 0:
+            return None
+
+        now = time.time()
+
+        thread = None
+        if node_threads and sys_random.random() >= LOCALITY_BYPASS:
+            node = self._pick_local_node(key_locations, refs, node_threads,
+                                         object_sizes, now)
+            if node is not None:
+                thread = self._pick_least_loaded(node_threads[node], now)
+
+        if thread is None:
+            thread = self._pick_least_loaded(candidates, now)
+
+        self.record_call(thread, now)
+        return thread
+
+    # Returns the node that would have to fetch the fewest bytes of refs,
+    # i.e., the one that caches the most bytes of them, if any caches any.
+    # Ties go to the less loaded of two of the tied nodes.
+    def _pick_local_node(self, key_locations, refs, node_threads,
+                         object_sizes, now):
+        cached = {}
+        for ref in refs:
+            size = _get_size(ref, object_sizes)
+
+            for ip in key_locations.get(ref.key, ()):
+                if ip in node_threads:
+                    cached[ip] = cached.get(ip, 0) + size
+
+        if len(cached) == 0:
+            return None
+
+        most = max(cached.values())
+        nodes = [ip for ip in cached if cached[ip] == most]
+        if len(nodes) == 1:
+            return nodes[0]
+
+        first = sys_random.choice(nodes)
+        second = sys_random.choice(nodes)
+        if self._get_node_load(node_threads[second], now) < \
+                self._get_node_load(node_threads[first], now):
+            return second
+
+        return first
+
+    def _get_node_load(self, threads, now):
+        return sum(self.get_load(thread, now) for thread in threads) / \
+            len(threads)
+
+    # Power of two choices: of two random threads, the one with fewer recent
+    # calls.
+    def _pick_least_loaded(self, threads, now):
+        first = sys_random.choice(threads)
+        if len(threads) == 1:
+            return first
+
+        second = sys_random.choice(threads)
+        if self.get_load(second, now) < self.get_load(first, now):
+            return second
+
+        return first
+
+    # Moves thread in or out of the available threads after anything that
+    # affects it changed.
+    def _update(self, thread):
+        node = thread[0]
+
+        if thread in self.executors and thread not in self.backoff and \
+                thread not in self._overloaded:
+            self.available.add(thread)
+
+            if node not in self._node_threads:
+                self._node_threads[node] = IndexedSet()
+            self._node_threads[node].add(thread)
+        else:
+            self.available.discard(thread)
+
+            if node in self._node_threads:
+                self._node_threads[node].discard(thread)
+                if len(self._node_threads[node]) == 0:
+                    del self._node_threads[node]
+
+
+def _get_size(ref, object_sizes):
+    size = getattr(ref, 'size', 0)
+
+    if not size and object_sizes is not None:
+        size = object_sizes.get(ref.key, 0)
+
+    return size or DEFAULT_OBJECT_SIZE
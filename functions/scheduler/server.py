@@ -22,11 +22,15 @@ from anna.client import AnnaClient
 from anna.zmq_util import SocketCache
 from include.kvs_pb2 import *
 from include.functions_pb2 import *
+from include.metrics import start_metrics_server
+from include import metrics
 from include import server_utils as sutils
 from include.shared import *
 from include.serializer import *
 from .create import *
 from .call import *
+from .placement import PlacementIndex
+from .summary import CacheSummaries
 from . import utils
 
 THRESHOLD = 5  # how often metadata is updated
@@ -38,7 +42,8 @@ def scheduler(ip, mgmt_ip, route_addr):
 
     kvs = AnnaClient(route_addr, ip)
 
-    key_ip_map = {}
+    # which nodes (likely) cache which keys
+    cache_summaries = CacheSummaries()
     ctx = zmq.Context(1)
 
     # Each dag consists of a set of functions and connections. Each one of
@@ -46,8 +51,11 @@ def scheduler(ip, mgmt_ip, route_addr):
     dags = {}
     thread_statuses = {}
     func_locations = {}
-    running_counts = {}
-    backoff = {}
+
+    # the executor threads we can place calls on, along with their recent
+    # load and whether they asked us to back off
+    placement = PlacementIndex()
+    executors = placement.executors
 
     connect_socket = ctx.socket(zmq.REP)
     connect_socket.bind(sutils.BIND_ADDR_TEMPLATE % (CONNECT_PORT))
@@ -100,13 +108,25 @@ def scheduler(ip, mgmt_ip, route_addr):
     poller.register(sched_update_socket, zmq.POLLIN)
     poller.register(backoff_socket, zmq.POLLIN)
 
-    executors = set()
     schedulers = _update_cluster_state(requestor_cache, mgmt_ip, executors,
-                                       key_ip_map, kvs)
+                                       cache_summaries, kvs)
 
     # track how often each DAG function is called
     call_frequency = {}
 
+    # the metrics served on this scheduler's metrics endpoint
+    start_metrics_server(sutils.SCHEDULER_METRICS_PORT)
+    backoff_events = metrics.counter('fluent_scheduler_backoff_events_total',
+                                     'Backoff messages received from busy '
+                                     'executors.')
+    backoff_size = metrics.gauge('fluent_scheduler_backoff_executors',
+                                 'Executor threads currently backed off.')
+    executor_count = metrics.gauge('fluent_scheduler_executors',
+                                   'Executor threads known to the scheduler.')
+    dag_count = metrics.gauge('fluent_scheduler_dags', 'Registered DAGs.')
+    socket_cache_size = metrics.gauge('fluent_socket_cache_size',
+                                      'Sockets in the push socket cache.')
+
     start = time.time()
 
     while True:
@@ -121,13 +141,14 @@ def scheduler(ip, mgmt_ip, route_addr):
             create_func(func_create_socket, kvs)
 
         if func_call_socket in socks and socks[func_call_socket] == zmq.POLLIN:
-            call_function(func_call_socket, pusher_cache, executors,
-                          key_ip_map, running_counts, backoff)
+            call_function(func_call_socket, pusher_cache, placement,
+                          cache_summaries)
 
         if (dag_create_socket in socks and socks[dag_create_socket]
                 == zmq.POLLIN):
             create_dag(dag_create_socket, pusher_cache, kvs, executors, dags,
-                       ip, pin_accept_socket, func_locations, call_frequency)
+                       ip, pin_accept_socket, func_locations, call_frequency,
+                       thread_statuses)
 
         if dag_call_socket in socks and socks[dag_call_socket] == zmq.POLLIN:
             call = DagCall()
@@ -148,17 +169,28 @@ def scheduler(ip, mgmt_ip, route_addr):
                 call_frequency[fname] += 1
 
             rid = call_dag(call, pusher_cache, dags, func_locations,
-                           key_ip_map, running_counts, backoff)
+                           cache_summaries, placement)
 
             resp = GenericResponse()
+            if rid is None:
+                resp.success = False
+                resp.error = NO_RESOURCES
+
+                dag_call_socket.send(resp.SerializeToString())
+                continue
+
             resp.success = True
             resp.response_id = rid
+
+            if call.profile:
+                resp.profile_id = sutils._get_profile_kvs_name(rid)
+
             dag_call_socket.send(resp.SerializeToString())
 
         if (dag_delete_socket in socks and socks[dag_delete_socket] ==
                 zmq.POLLIN):
             delete_dag(dag_delete_socket, pusher_cache, dags, func_locations,
-                       call_frequency, executors)
+                       call_frequency)
 
         if list_socket in socks and socks[list_socket] == zmq.POLLIN:
             msg = list_socket.recv_string()
@@ -178,6 +210,14 @@ def scheduler(ip, mgmt_ip, route_addr):
             logging.info('Received status update from executor %s:%d.' %
                          (key[0], int(key[1])))
 
+            # executors send a delta after serving calls, so any delta from
+            # a thread we know about means that it can take calls
+            if status.delta:
+                _apply_status_delta(status, thread_statuses, func_locations)
+                if key in thread_statuses:
+                    placement.add_executor(key)
+                continue
+
             # this means that this node is currently departing, so we remove it
             # from all of our metadata tracking
             if not status.running:
@@ -189,11 +229,10 @@ def scheduler(ip, mgmt_ip, route_addr):
                         func_locations[fname].discard((old_status.ip,
                                                        old_status.tid))
 
-                executors.discard(key)
+                placement.remove_executor(key)
                 continue
 
-            if key not in executors:
-                executors.add(key)
+            placement.add_executor(key)
 
             if key in thread_statuses and thread_statuses[key] != status:
                 # remove all the old function locations, and all the new ones
@@ -249,30 +288,22 @@ def scheduler(ip, mgmt_ip, route_addr):
             splits = msg.split(':')
             node, tid = splits[0], int(splits[1])
 
-            backoff[(node, tid)] = time.time()
-
-        # periodically clean up the running counts map
-        for executor in running_counts:
-            call_times = running_counts[executor]
-            new_set = set()
-            for ts in call_times:
-                if time.time() - ts < 2.5:
-                    new_set.add(ts)
+            placement.set_backoff((node, tid), time.time())
+            backoff_events.inc()
 
-            running_counts[executor] = new_set
+        # let threads whose backoff or overload has passed be picked again
+        placement.expire(time.time())
 
-        remove_set = set()
-        for executor in backoff:
-            if time.time() - backoff[executor] > 5:
-                remove_set.add(executor)
-
-        for executor in remove_set:
-            del backoff[executor]
+        backoff_size.set(len(placement.backoff))
+        executor_count.set(len(executors))
+        dag_count.set(len(dags))
+        socket_cache_size.set(len(pusher_cache))
 
         end = time.time()
         if end - start > THRESHOLD:
             schedulers = _update_cluster_state(requestor_cache, mgmt_ip,
-                                               executors, key_ip_map, kvs)
+                                               executors, cache_summaries,
+                                               kvs)
 
             status = SchedulerStatus()
             for name in dags.keys():
@@ -310,10 +341,47 @@ def scheduler(ip, mgmt_ip, route_addr):
             start = time.time()
 
 
-def _update_cluster_state(requestor_cache, mgmt_ip, executors, key_ip_map,
-                          kvs):
-    # update our local key-cache mapping information
-    utils._update_key_maps(key_ip_map, executors, kvs)
+def _apply_status_delta(delta, thread_statuses, func_locations):
+    key = (delta.ip, delta.tid)
+
+    # if we missed an update, we cannot apply this delta; the executor
+    # periodically sends its full status, at which point we will catch up
+    if key not in thread_statuses or \
+            delta.seq != thread_statuses[key].seq + 1:
+        logging.info('Ignoring out-of-order status delta from %s:%d.' %
+                     (key[0], int(key[1])))
+        return
+
+    status = thread_statuses[key]
+    status.seq = delta.seq
+
+    for fname in delta.removed_functions:
+        if fname in status.functions:
+            status.functions.remove(fname)
+
+        for futil in list(status.function_utilization):
+            if futil.fname == fname:
+                status.function_utilization.remove(futil)
+
+        if fname in func_locations:
+            func_locations[fname].discard(key)
+
+    for fname in delta.functions:
+        status.functions.append(fname)
+
+        if fname not in func_locations:
+            func_locations[fname] = set()
+
+        func_locations[fname].add(key)
+
+    if delta.HasField('utilization'):
+        status.utilization = delta.utilization
+
+
+def _update_cluster_state(requestor_cache, mgmt_ip, executors,
+                          cache_summaries, kvs):
+    # update our summaries of what each node caches
+    utils._update_cache_summaries(cache_summaries, executors, kvs)
 
     schedulers = utils._get_ip_set(utils._get_scheduler_list_address(mgmt_ip),
                                    requestor_cache, False)
@@ -0,0 +1,122 @@
+#  Copyright 2018 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from collections import OrderedDict
+
+from include.functions_pb2 import *
+
+# the constants of 64-bit FNV-1a, which is how caches hash keys into their
+# summaries (see functions/cache/include/cache_summary.hpp)
+FNV_OFFSET = 14695981039346656037
+FNV_PRIME = 1099511628211
+HASH_MASK = (1 << 64) - 1
+
+# the most key lookups we remember between summary updates, and the most
+# object sizes we remember
+LOOKUP_CACHE_SIZE = 100000
+OBJECT_SIZES_SIZE = 100000
+
+
+class CacheSummaries():
+    # The Bloom filter summary of the keys each node's cache holds. Nodes
+    # report a new summary every few seconds; a summary is only parsed again
+    # if its timestamp changed. get(key, default) answers which nodes likely
+    # hold key, the same way a dict from keys to nodes would, and answers are
+    # remembered until the next summary changes, since the same keys tend to
+    # be read over and over.
+    def __init__(self):
+        # the timestamp, filter bits and number of hashes of each summary
+        self._summaries = {}
+        self._lookups = {}
+
+        # the sizes (in bytes) of the large objects caches told us about, and
+        # of the objects calls' references told us about
+        self.sizes = OrderedDict()
+
+    # Replaces the node's summary with the one in lattice, the LWW lattice the
+    # cache published, which holds a serialized CacheSummary.
+    def update(self, ip, lattice):
+        ts = lattice.reveal()[0]
+        if ip in self._summaries and self._summaries[ip][0] == ts:
+            return
+
+        summary = CacheSummary()
+        summary.ParseFromString(lattice.reveal()[1])
+        self._summaries[ip] = (ts, summary.bits, summary.num_hashes)
+        self._lookups.clear()
+
+        self.record_sizes(summary.large_objects)
+
+    # Remembers the sizes of refs (Reference messages) that have one.
+    def record_sizes(self, refs):
+        for ref in refs:
+            if ref.size > 0:
+                self.sizes[ref.key] = ref.size
+                self.sizes.move_to_end(ref.key)
+
+        while len(self.sizes) > OBJECT_SIZES_SIZE:
+            self.sizes.popitem(last=False)
+
+    def remove(self, ip):
+        if ip in self._summaries:
+            del self._summaries[ip]
+            self._lookups.clear()
+
+    def nodes(self):
+        return set(self._summaries.keys())
+
+    def get(self, key, default=None):
+        if key not in self._lookups:
+            if len(self._lookups) >= LOOKUP_CACHE_SIZE:
+                self._lookups.clear()
+
+            self._lookups[key] = self._find(key)
+
+        result = self._lookups[key]
+        if len(result) == 0:
+            return default
+
+        return result
+
+    def _find(self, key):
+        h1, h2 = _hash(key)
+
+        result = []
+        for ip in self._summaries:
+            _, bits, num_hashes = self._summaries[ip]
+            if _contains(bits, num_hashes, h1, h2):
+                result.append(ip)
+
+        return result
+
+
+def _hash(key):
+    result = FNV_OFFSET
+    for byte in key.encode():
+        result = ((result ^ byte) * FNV_PRIME) & HASH_MASK
+
+    return result & 0xffffffff, result >> 32
+
+
+def _contains(bits, num_hashes, h1, h2):
+    num_bits = len(bits) * 8
+    if num_bits == 0:
+        return False
+
+    for i in range(num_hashes):
+        index = (h1 + i * h2) % num_bits
+        if not bits[index // 8] & (1 << (index % 8)):
+            return False
+
+    return True
@@ -17,11 +17,16 @@ from include.kvs_pb2 import *
 from include.shared import *
 from include.serializer import *
 from include.server_utils import *
+import include.server_utils as sutils
 
 FUNCOBJ = 'funcs/index-allfuncs'
 
 NUM_EXEC_THREADS = 3
 
+# we only pack another function onto a thread that is less busy than this;
+# k8s/management_server.py keeps a copy, so the two have to change together
+PIN_UTILIZATION_MAX = .7
+
 EXECUTORS_PORT = 7002
 SCHEDULERS_PORT = 7004
 
@@ -50,8 +55,8 @@ def _put_func_list(client, funclist):
     client.put(FUNCOBJ, lattice)
 
 
-def _get_cache_ip_key(ip):
-    return 'ANNA_METADATA|cache_ip|' + ip
+def _get_cache_summary_key(ip):
+    return 'ANNA_METADATA|cache_summary|' + ip
 
 
 def _get_pin_address(ip, tid):
@@ -102,36 +107,41 @@ def _get_ip_set(request_ip, socket_cache, exec_threads=True):
         return set(ips.keys)
 
 
-def _update_key_maps(key_ip_map, executors, kvs):
+def _update_cache_summaries(cache_summaries, executors, kvs):
     exec_ips = set(map(lambda e: e[0], executors))
 
-    key_ip_map.clear()
-    for ip in exec_ips:
-        key = _get_cache_ip_key(ip)
+    for ip in cache_summaries.nodes() - exec_ips:
+        cache_summaries.remove(ip)
 
-        # this is of type LWWPairLattice, which has a KeySet protobuf packed
-        # into it; we want the keys in that KeySet protobuf
-        lattice = kvs.get(key)
+    for ip in exec_ips:
+        # this is of type LWWPairLattice, which has a CacheSummary protobuf
+        # packed into it
+        lattice = kvs.get(_get_cache_summary_key(ip))
         if lattice is None:  # this executor is still joining
             continue
 
-        ks = KeySet()
-        ks.ParseFromString(lattice.reveal()[1])
+        cache_summaries.update(ip, lattice)
 
-        for key in ks.keys:
-            if key not in key_ip_map:
-                key_ip_map[key] = []
 
-            key_ip_map[key].append(ip)
+def _find_dag_source(dag):
+    return set(sutils._get_dag_index(dag).sources)
 
 
-def _find_dag_source(dag):
-    sinks = set()
-    for conn in dag.connections:
-        sinks.add(conn.sink)
+# Picks which of the candidate threads to pin a function on. We pack functions
+# onto the busiest thread that still has headroom, which keeps the other
+# threads free for functions that turn out to need a whole thread; if every
+# candidate is busy, we pick the least busy one.
+def _choose_pin_target(candidates, thread_statuses):
+    def utilization(thread):
+        if thread in thread_statuses:
+            return thread_statuses[thread].utilization
+        return 0.0
+
+    candidates = sorted(candidates, key=utilization)
+    fits = [thread for thread in candidates
+            if utilization(thread) < PIN_UTILIZATION_MAX]
 
-    funcs = set(dag.functions)
-    for sink in sinks:
-        funcs.remove(sink)
+    if fits:
+        return fits[-1]
 
-    return funcs
+    return candidates[0]
@@ -18,6 +18,7 @@ import time
 import zmq
 
 from benchmarks.server import *
+from executor.async_server import async_executor
 from executor.server import *
 import client as flclient
 from scheduler.server import *
@@ -43,7 +44,19 @@ def run():
     else:
         schedulers = os.environ['SCHED_IPS'].split(' ')
         thread_id = int(os.environ['THREAD_ID'])
-        executor(ip, mgmt_ip, schedulers, thread_id)
+
+        # the number of worker processes to run user functions in; by default
+        # functions run inline on the executor thread
+        pool_size = int(os.environ.get('EXEC_POOL_SIZE', 0))
+
+        # the number of functions each executor thread can have pinned
+        pin_capacity = int(os.environ.get('PIN_CAPACITY', 1))
+
+        if os.environ.get('EXECUTOR_MODE') == 'async':
+            async_executor(ip, mgmt_ip, schedulers, thread_id, pin_capacity)
+        else:
+            executor(ip, mgmt_ip, schedulers, thread_id, pool_size,
+                     pin_capacity)
 
 
 if __name__ == '__main__':
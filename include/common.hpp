@@ -26,13 +26,14 @@
 #include "zmq/socket_cache.hpp"
 #include "zmq/zmq_util.hpp"
 
-enum UserMetadataType { cache_ip };
+enum UserMetadataType { cache_ip, cache_summary };
 
 // TODO: split this off for kvs vs user metadata keys?
 const string kMetadataIdentifier = "ANNA_METADATA";
 const string kMetadataDelimiter = "|";
 const char kMetadataDelimiterChar = '|';
 const string kMetadataTypeCacheIP = "cache_ip";
+const string kMetadataTypeCacheSummary = "cache_summary";
 
 inline void split(const string& s, char delim, vector<string>& elems) {
   std::stringstream ss(s);
@@ -66,6 +67,9 @@ inline Key get_user_metadata_key(string data_key, UserMetadataType type) {
   if (type == UserMetadataType::cache_ip) {
     return kMetadataIdentifier + kMetadataDelimiter + kMetadataTypeCacheIP +
            kMetadataDelimiter + data_key;
+  } else if (type == UserMetadataType::cache_summary) {
+    return kMetadataIdentifier + kMetadataDelimiter +
+           kMetadataTypeCacheSummary + kMetadataDelimiter + data_key;
   }
   return "";
 }
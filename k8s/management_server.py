@@ -40,6 +40,9 @@ grace_start = 0
 EXECUTOR_REPORT_PERIOD = 20
 
 NUM_EXEC_THREADS = 3
+
+# see PIN_UTILIZATION_MAX in functions/scheduler/utils.py
+PIN_UTILIZATION_MAX = .7
 EXECUTOR_INCREASE = 4  # the number of exec nodes to add at once
 
 ISOLATION = 'STRONG'
@@ -189,6 +192,27 @@ def run():
             stats = ExecutorStatistics()
             stats.ParseFromString(executor_statistics_socket.recv())
 
+            if stats.HasField('function_cache_hits'):
+                logging.info('Function cache: %d hits, %d misses.' %
+                             (stats.function_cache_hits,
+                              stats.function_cache_misses))
+
+            if stats.HasField('object_cache_hits'):
+                logging.info(('Object cache: %d hits, %d misses, %d bytes ' +
+                              'saved.') % (stats.object_cache_hits,
+                                           stats.object_cache_misses,
+                                           stats.object_cache_bytes_saved))
+
+            if stats.HasField('pending_invocations'):
+                logging.info(('Pending invocations: %d (%d bytes), %d ' +
+                              'expired, %d dropped.') %
+                             (stats.pending_invocations, stats.pending_bytes,
+                              stats.pending_expired, stats.pending_dropped))
+
+            if stats.HasField('memo_hits'):
+                logging.info('Memoized results: %d hits, %d misses.' %
+                             (stats.memo_hits, stats.memo_misses))
+
             for fstats in stats.statistics:
                 fname = fstats.fname
 
@@ -237,8 +261,6 @@ def check_function_load(context, function_frequencies, function_runtimes,
 
             func_locations[fname].add(key)
 
-    executors = set(executor_statuses.keys())
-
     for fname in function_frequencies:
         runtime = function_runtimes[fname]
         call_count = function_frequencies[fname]
@@ -265,7 +287,7 @@ def check_function_load(context, function_frequencies, function_runtimes,
                                                                   call_count,
                                                                   increase))
             replicate_function(fname, context, increase, func_locations,
-                               executors)
+                               executor_statuses)
         elif call_count < thruput * .1:
             decrease = math.ceil((call_count / thruput) * num_replicas) + 1
             logging.info(('Function %s: %d calls in recent period under ' +
@@ -287,16 +309,26 @@ def check_function_load(context, function_frequencies, function_runtimes,
                               '%d replicas.')
                              % (fname, avg_latency, ratio, num_replicas))
                 replicate_function(fname, context, num_replicas,
-                                   func_locations, executors)
+                                   func_locations, executor_statuses)
             else:
                 for status in executor_statuses.values():
                     if status.utilization > .9:
                         logging.info(('Node %s:%d has over 90%% utilization.'
                                       + ' Replicating its functions.') %
                                      (status.ip, status.tid))
-                        for fname in status.functions:
-                            replicate_function(fname, context, 2,
-                                               func_locations, executors)
+
+                        # if we know how much of the load each function
+                        # accounts for, only the busiest one is replicated
+                        busy_fnames = status.functions
+                        if len(status.function_utilization) > 0:
+                            busiest = max(status.function_utilization,
+                                          key=lambda fu: fu.utilization)
+                            busy_fnames = [busiest.fname]
+
+                        for busy_fname in busy_fnames:
+                            replicate_function(busy_fname, context, 2,
+                                               func_locations,
+                                               executor_statuses)
 
             # update these variables based on history, so we can insert them
             # into the history tracker
@@ -311,18 +343,27 @@ def check_function_load(context, function_frequencies, function_runtimes,
 
 
 def replicate_function(fname, context, num_replicas, func_locations,
-                       executors):
+                       executor_statuses):
     if num_replicas < 0:
         return
 
     for _ in range(num_replicas):
-        existing_replicas = func_locations[fname]
-        candiate_nodes = executors.difference(existing_replicas)
-
-        if len(candiate_nodes) == 0:
+        pinned_counts = {}
+        for fn in func_locations:
+            for loc in func_locations[fn]:
+                pinned_counts[loc] = pinned_counts.get(loc, 0) + 1
+
+        # a thread can take another replica if it does not have one yet and
+        # it has room for another function
+        candidates = [key for key in executor_statuses
+                      if key not in func_locations[fname] and
+                      pinned_counts.get(key, 0) <
+                      executor_statuses[key].capacity]
+
+        if len(candidates) == 0:
             continue
 
-        ip, tid = random.sample(candiate_nodes, 1)[0]
+        ip, tid = choose_pin_target(candidates, executor_statuses)
 
         socket = context.socket(zmq.PUSH)
         socket.connect(util._get_executor_pin_address(ip, tid))
@@ -331,6 +372,20 @@ def replicate_function(fname, context, num_replicas, func_locations,
         func_locations[fname].add((ip, tid))
 
 
+# The management server runs from k8s/ and cannot import the functions
+# package, so this mirrors _choose_pin_target in functions/scheduler/utils.py.
+def choose_pin_target(candidates, executor_statuses):
+    candidates = sorted(candidates,
+                        key=lambda key: executor_statuses[key].utilization)
+    fits = [key for key in candidates
+            if executor_statuses[key].utilization < PIN_UTILIZATION_MAX]
+
+    if fits:
+        return fits[-1]
+
+    return candidates[0]
+
+
 def dereplicate_function(fname, context, num_replicas, func_locations):
     if num_replicas < 2:
         return
@@ -0,0 +1,149 @@
+#  Copyright 2018 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import logging
+import zmq
+import zmq.asyncio
+
+from .ipc_client import *
+from .ipc_client import _build_causal_get_request, \
+        _build_causal_put_request, _build_get_request, _build_put_request, \
+        _parse_causal_get_response, _parse_get_response
+
+# the number of requests that a single client can have outstanding at once
+MAX_OUTSTANDING = 16
+
+# how long (in seconds) we wait for the cache before giving up on a request
+REQUEST_TIMEOUT = 5
+
+
+class AsyncIpcAnnaClient:
+    # An asyncio version of the IpcAnnaClient. The cache tracks pending
+    # requests by their response address, so every outstanding request is
+    # given its own response socket; a client can have up to MAX_OUTSTANDING
+    # requests in flight, and further requests wait for a free socket.
+    def __init__(self, thread_id=0, max_outstanding=MAX_OUTSTANDING):
+        self.context = zmq.asyncio.Context(1)
+
+        self.get_request_socket = self.context.socket(zmq.PUSH)
+        self.get_request_socket.connect(GET_REQUEST_ADDR)
+
+        self.put_request_socket = self.context.socket(zmq.PUSH)
+        self.put_request_socket.connect(PUT_REQUEST_ADDR)
+
+        # response slots are addressed by the thread ID and a slot index, so
+        # they never collide with the synchronous client's addresses
+        self.get_response_base = GET_RESPONSE_ADDR_TEMPLATE % thread_id
+        self.put_response_base = PUT_RESPONSE_ADDR_TEMPLATE % thread_id
+
+        self.get_slots = asyncio.Queue()
+        self.put_slots = asyncio.Queue()
+
+        for slot in range(max_outstanding):
+            self.get_slots.put_nowait(self._bind_slot(self.get_response_base,
+                                                      slot))
+            self.put_slots.put_nowait(self._bind_slot(self.put_response_base,
+                                                      slot))
+
+    def _bind_slot(self, base, slot):
+        sckt = self.context.socket(zmq.PULL)
+        sckt.bind(_get_slot_address(base, slot))
+
+        return (slot, sckt)
+
+    # Requests are built without a response address, which is only known once
+    # one of the response slots is free (see _request).
+    async def get(self, keys):
+        if type(keys) != list:
+            keys = [keys]
+
+        msg = await self._request(self.get_request_socket, self.get_slots,
+                                  self.get_response_base,
+                                  _build_get_request(keys, ''), keys)
+        if msg is None:
+            resp = {}
+            for key in keys:
+                resp[key] = None
+
+            return resp
+
+        return _parse_get_response(msg)
+
+    async def causal_get(self, keys, future_read_set,
+                         versioned_key_locations, consistency, client_id):
+        request = _build_causal_get_request(keys, future_read_set,
+                                            versioned_key_locations,
+                                            consistency, client_id, '')
+        if request is None:
+            return None
+
+        msg = await self._request(self.get_request_socket, self.get_slots,
+                                  self.get_response_base, request, keys)
+        if msg is None:
+            resp = {}
+            for key in keys:
+                resp[key] = None
+
+            return resp
+
+        return _parse_causal_get_response(msg)
+
+    async def put(self, key, value):
+        msg = await self._request(self.put_request_socket, self.put_slots,
+                                  self.put_response_base,
+                                  _build_put_request(key, value, ''), key)
+        if msg is None:
+            return False
+
+        resp = KeyResponse()
+        resp.ParseFromString(msg)
+
+        return resp.tuples[0].error == 0
+
+    async def causal_put(self, key, vector_clock, dependency, value,
+                         client_id):
+        request = _build_causal_put_request(key, vector_clock, dependency,
+                                            value, client_id, '')
+        msg = await self._request(self.put_request_socket, self.put_slots,
+                                  self.put_response_base, request, key)
+
+        return msg is not None
+
+    # Sends request with the address of a free slot as its response address,
+    # and returns the response, or None if it timed out.
+    async def _request(self, request_socket, slots, base, request, keys):
+        slot, sckt = await slots.get()
+
+        try:
+            request.response_address = _get_slot_address(base, slot)
+            await request_socket.send(request.SerializeToString())
+
+            msg = await asyncio.wait_for(sckt.recv(), REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.error("Request for %s timed out!" % (str(keys)))
+
+            # a late response would be read by the next request on this
+            # socket, so we replace it instead of returning it to the pool
+            sckt.close(linger=0)
+            slots.put_nowait(self._bind_slot(base, slot))
+
+            return None
+        else:
+            slots.put_nowait((slot, sckt))
+            return msg
+
+
+def _get_slot_address(base, slot):
+    return base + '_' + str(slot)
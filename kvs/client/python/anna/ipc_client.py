@@ -49,14 +49,7 @@ class IpcAnnaClient:
         if type(keys) != list:
             keys = [keys]
 
-        request = KeyRequest()
-        request.type = GET
-
-        for key in keys:
-            tp = request.tuples.add()
-            tp.key = key
-
-        request.response_address = self.get_response_address
+        request = _build_get_request(keys, self.get_response_address)
         self.get_request_socket.send(request.SerializeToString())
 
         try:
@@ -73,73 +66,17 @@ class IpcAnnaClient:
 
             return resp
         else:
-            kv_pairs = {}
-            resp = KeyResponse()
-            resp.ParseFromString(msg)
-
-            for tp in resp.tuples:
-                if tp.error == 1 or tp.lattice_type == NO:
-                    kv_pairs[tp.key] = None
-
-                elif tp.lattice_type == LWW:
-                    val = LWWValue()
-                    val.ParseFromString(tp.payload)
-
-                    kv_pairs[tp.key] = LWWPairLattice(val.timestamp, val.value)
-                elif tp.lattice_type == SET:
-                    res = set()
-
-                    val = SetValue()
-                    val.ParseFromString(tp.payload)
-
-                    for v in val.values:
-                        res.add(v)
-
-                    kv_pairs[tp.key] = SetLattice(res)
-
-
-                elif tp.lattice_type == ORDERED_SET:
-                    res = ListBasedOrderedSet()
-                    val = SetValue()
-                    val.ParseFromString(tp.payload)
-                    for v in val.values:
-                        res.insert(v)
-                    kv_pairs[tp.key] = OrderedSetLattice(res)
-
-                else:
-                    raise ValueError('Invalid Lattice type: ' +
-                                     str(tp.lattice_type))
-            return kv_pairs
+            return _parse_get_response(msg)
 
     def causal_get(self, keys, future_read_set,
                    versioned_key_locations, consistency, client_id):
-        if type(keys) != list:
-            keys = list(keys)
-
-        request = CausalRequest()
-
-        if consistency == SINGLE:
-            request.consistency = SINGLE
-        elif consistency == CROSS:
-            request.consistency = CROSS
-        else:
-            logging.error("Error: non causal consistency in causal mode!")
+        request = _build_causal_get_request(keys, future_read_set,
+                                            versioned_key_locations,
+                                            consistency, client_id,
+                                            self.get_response_address)
+        if request is None:
             return None
 
-        request.id = str(client_id)
-
-        for addr in versioned_key_locations:
-            request.versioned_key_locations[addr].versioned_keys.extend(
-                                versioned_key_locations[addr].versioned_keys)
-
-        for keys in keys:
-            tp = request.tuples.add()
-            tp.key = key
-
-        request.response_address = self.get_response_address
-
-        (request.future_read_set.add(k) for k in future_read_set)
-
         self.get_request_socket.send(request.SerializeToString())
 
         try:
@@ -157,59 +94,10 @@ class IpcAnnaClient:
             return resp
 
         else:
-            kv_pairs = {}
-            resp = CausalResponse()
-            resp.ParseFromString(msg)
-
-            for tp in resp.tuples:
-                if tp.error == 1:
-                    logging.info('Key %s does not exist!' % (key))
-                    return None
-
-                val = CrossCausalValue()
-                val.ParseFromString(tp.payload)
-
-                # for now, we just take the first value in the setlattice
-                kv_pairs[tp.key] = (val.vector_clock, val.values[0])
-            if len(resp.versioned_keys) != 0:
-                return ((resp.versioned_key_query_addr,
-                        resp.versioned_keys), kv_pairs)
-            else:
-                return (None, kv_pairs)
+            return _parse_causal_get_response(msg)
 
     def put(self, key, value):
-        request = KeyRequest()
-        request.type = PUT
-
-        tp = request.tuples.add()
-        tp.key = key
-
-        if type(value) == LWWPairLattice:
-            tp.lattice_type = LWW
-
-            ser = LWWValue()
-            ser.timestamp = value.reveal()[0]
-            ser.value = value.reveal()[1]
-
-            tp.payload = ser.SerializeToString()
-        elif type(value) == SetLattice:
-            tp.lattice_type = SET
-
-            ser = SetValue()
-            ser.values.extend(list(value.reveal()))
-
-            tp.payload = ser.SerializeToString()
-
-        elif type(value) == OrderedSetLattice:
-            tp.lattice_type == ORDERED_SET
-            ser = SetValue()
-            ser.values.extend(value.reveal().lst)
-            tp.payload = ser.SerializeToString()
-
-        else:
-            raise ValueError('Invalid PUT type: ' + str(type(value)))
-
-        request.response_address = self.put_response_address
+        request = _build_put_request(key, value, self.put_response_address)
 
         self.put_request_socket.send(request.SerializeToString())
 
@@ -229,26 +117,9 @@ class IpcAnnaClient:
             return resp.tuples[0].error == 0
 
     def causal_put(self, key, vector_clock, dependency, value, client_id):
-        request = CausalRequest()
-        request.consistency = CROSS
-        request.id = client_id
-
-        tp = request.tuples.add()
-        tp.key = key
-
-        cross_causal_value = CrossCausalValue()
-        cross_causal_value.vector_clock = vector_clock
-
-        for key in dependency:
-            dep = cross_causal_value.deps.add()
-            dep.key = key
-            dep.vector_clock = dependency[key]
-
-        cross_causal_value.values.add(value)
-
-        tp.payload = cross_causal_value.SerializeToString()
-
-        request.response_address = self.put_response_address
+        request = _build_causal_put_request(key, vector_clock, dependency,
+                                            value, client_id,
+                                            self.put_response_address)
 
         self.put_request_socket.send(request.SerializeToString())
 
@@ -263,3 +134,169 @@ class IpcAnnaClient:
             return False
         else:
             return True
+
+
+def _build_get_request(keys, response_address):
+    request = KeyRequest()
+    request.type = GET
+
+    for key in keys:
+        tp = request.tuples.add()
+        tp.key = key
+
+    request.response_address = response_address
+    return request
+
+
+def _parse_get_response(msg):
+    kv_pairs = {}
+    resp = KeyResponse()
+    resp.ParseFromString(msg)
+
+    for tp in resp.tuples:
+        if tp.error == 1 or tp.lattice_type == NO:
+            kv_pairs[tp.key] = None
+
+        elif tp.lattice_type == LWW:
+            val = LWWValue()
+            val.ParseFromString(tp.payload)
+
+            kv_pairs[tp.key] = LWWPairLattice(val.timestamp, val.value)
+        elif tp.lattice_type == SET:
+            res = set()
+
+            val = SetValue()
+            val.ParseFromString(tp.payload)
+
+            for v in val.values:
+                res.add(v)
+
+            kv_pairs[tp.key] = SetLattice(res)
+
+
+        elif tp.lattice_type == ORDERED_SET:
+            res = ListBasedOrderedSet()
+            val = SetValue()
+            val.ParseFromString(tp.payload)
+            for v in val.values:
+                res.insert(v)
+            kv_pairs[tp.key] = OrderedSetLattice(res)
+
+        else:
+            raise ValueError('Invalid Lattice type: ' +
+                             str(tp.lattice_type))
+    return kv_pairs
+
+
+def _build_put_request(key, value, response_address):
+    request = KeyRequest()
+    request.type = PUT
+
+    tp = request.tuples.add()
+    tp.key = key
+
+    if type(value) == LWWPairLattice:
+        tp.lattice_type = LWW
+
+        ser = LWWValue()
+        ser.timestamp = value.reveal()[0]
+        ser.value = value.reveal()[1]
+
+        tp.payload = ser.SerializeToString()
+    elif type(value) == SetLattice:
+        tp.lattice_type = SET
+
+        ser = SetValue()
+        ser.values.extend(list(value.reveal()))
+
+        tp.payload = ser.SerializeToString()
+
+    elif type(value) == OrderedSetLattice:
+        tp.lattice_type == ORDERED_SET
+        ser = SetValue()
+        ser.values.extend(value.reveal().lst)
+        tp.payload = ser.SerializeToString()
+
+    else:
+        raise ValueError('Invalid PUT type: ' + str(type(value)))
+
+    request.response_address = response_address
+    return request
+
+
+def _build_causal_get_request(keys, future_read_set, versioned_key_locations,
+                              consistency, client_id, response_address):
+    if type(keys) != list:
+        keys = list(keys)
+
+    request = CausalRequest()
+
+    if consistency == SINGLE:
+        request.consistency = SINGLE
+    elif consistency == CROSS:
+        request.consistency = CROSS
+    else:
+        logging.error("Error: non causal consistency in causal mode!")
+        return None
+
+    request.id = str(client_id)
+
+    for addr in versioned_key_locations:
+        request.versioned_key_locations[addr].versioned_keys.extend(
+                            versioned_key_locations[addr].versioned_keys)
+
+    for key in keys:
+        tp = request.tuples.add()
+        tp.key = key
+
+    request.response_address = response_address
+
+    request.future_read_set.extend(future_read_set)
+    return request
+
+
+def _parse_causal_get_response(msg):
+    kv_pairs = {}
+    resp = CausalResponse()
+    resp.ParseFromString(msg)
+
+    for tp in resp.tuples:
+        if tp.error == 1:
+            logging.info('Key %s does not exist!' % (tp.key))
+            return None
+
+        val = CrossCausalValue()
+        val.ParseFromString(tp.payload)
+
+        # for now, we just take the first value in the setlattice
+        kv_pairs[tp.key] = (val.vector_clock, val.values[0])
+    if len(resp.versioned_keys) != 0:
+        return ((resp.versioned_key_query_addr,
+                resp.versioned_keys), kv_pairs)
+    else:
+        return (None, kv_pairs)
+
+
+def _build_causal_put_request(key, vector_clock, dependency, value, client_id,
+                              response_address):
+    request = CausalRequest()
+    request.consistency = CROSS
+    request.id = client_id
+
+    tp = request.tuples.add()
+    tp.key = key
+
+    cross_causal_value = CrossCausalValue()
+    cross_causal_value.vector_clock.update(vector_clock)
+
+    for dep_key in dependency:
+        dep = cross_causal_value.deps.add()
+        dep.key = dep_key
+        dep.vector_clock.update(dependency[dep_key])
+
+    cross_causal_value.values.append(value)
+
+    tp.payload = cross_causal_value.SerializeToString()
+
+    request.response_address = response_address
+    return request
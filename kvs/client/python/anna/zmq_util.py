@@ -27,6 +27,9 @@ class SocketCache():
         self._cache = {}
         self.zmq_type = zmq_type
 
+    def __len__(self):
+        return len(self._cache)
+
     def get(self, addr):
         if addr not in self._cache:
             sock = self.context.socket(self.zmq_type)